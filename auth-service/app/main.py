@@ -2,8 +2,32 @@ from fastapi import FastAPI
 from .routes.auth import router as auth_router
 from .routes.profile import router as profile_router
 from fastapi.middleware.cors import CORSMiddleware
+from core.diagnostics import register_stats, router as diagnostics_router
+from core.uploads import UploadSizeLimitMiddleware
+from core.ratelimit import UPLOADS, RateLimitMiddleware, route_class
+from core.metrics import MetricsMiddleware, router as metrics_router
+from core.lifespan import lifespan, on_startup, on_shutdown
+from .outbox import start_outbox_worker, stop_outbox_worker
+from .search import start_username_index, stop_username_index, username_index_stats
 
-app = FastAPI()
+on_startup(start_outbox_worker)
+on_shutdown(stop_outbox_worker)
+on_startup(start_username_index)
+on_shutdown(stop_username_index)
+register_stats("username_index", username_index_stats)
+
+app = FastAPI(lifespan=lifespan)
+
+# Лимит тела на загрузку картинок (внутри CORS, чтобы 413 тоже получал CORS-заголовки)
+app.add_middleware(UploadSizeLimitMiddleware, paths=("/profile/upload-avatar",))
+
+# Частые запросы одного клиента отклоняются 429 до обработчика (внутри CORS)
+app.add_middleware(RateLimitMiddleware, classes=(
+    # Подбор паролей и массовая регистрация — по IP
+    route_class("login", 0.5, 10, r"/auth/(?:login|register)", methods=("POST",)),
+    route_class("search", 5, 20, r"/profile/search"),
+    UPLOADS,
+))
 
 # Разрешаем CORS для фронтенда
 app.add_middleware(
@@ -14,5 +38,11 @@ app.add_middleware(
     allow_headers=["*"],  # Разрешаем все заголовки
 )
 
+# Время ответов по шаблонам маршрутов для /metrics; снаружи всех, чтобы
+# учитывать и ответы CORS, лимита запросов и 304
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(auth_router)
-app.include_router(profile_router)
\ No newline at end of file
+app.include_router(profile_router)
+app.include_router(diagnostics_router)
+app.include_router(metrics_router)
\ No newline at end of file
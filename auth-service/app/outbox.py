@@ -0,0 +1,84 @@
+"""
+Фоновая обработка profile_outbox (см. миграцию profile_outbox).
+
+Обработчики профиля меняют строку profiles через RPC set_profile_field и
+сразу отвечают клиенту; копии значения в других таблицах (friends.sender_name
+и т.п.) обновляет эта задача. Задания хранятся в БД, поэтому после
+перезапуска сервиса ничего не теряется, а несколько реплик разбирают
+очередь без пересечений (for update skip locked).
+"""
+import asyncio
+import contextlib
+import logging
+from typing import Optional
+
+from core.config import setting_float, setting_int
+from core.db import db
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = setting_int("PROFILE_OUTBOX_BATCH", 100)
+POLL_INTERVAL = setting_float("PROFILE_OUTBOX_INTERVAL", 5)
+RETRY_DELAY = 1.0
+
+
+class ProfileOutboxWorker:
+    def __init__(self, batch_size: int = BATCH_SIZE, poll_interval: float = POLL_INTERVAL):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.processed = 0
+
+    def notify(self) -> None:
+        """Новое задание в очереди — обработать его, не дожидаясь опроса."""
+        self._wakeup.set()
+
+    async def drain(self) -> int:
+        total = 0
+        while True:
+            response = await db.rpc("process_profile_outbox", {"p_limit": self.batch_size}).execute()
+            processed = response.data or 0
+            total += processed
+            self.processed += processed
+            if processed < self.batch_size:
+                return total
+
+    async def run(self) -> None:
+        while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            self._wakeup.clear()
+            try:
+                await self.drain()
+            except Exception:
+                logger.exception("profile outbox failed")
+                await asyncio.sleep(RETRY_DELAY)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+
+_worker: Optional[ProfileOutboxWorker] = None
+
+
+def get_outbox_worker() -> ProfileOutboxWorker:
+    global _worker
+    if _worker is None:
+        _worker = ProfileOutboxWorker()
+    return _worker
+
+
+async def start_outbox_worker() -> None:
+    await get_outbox_worker().start()
+
+
+async def stop_outbox_worker() -> None:
+    await get_outbox_worker().stop()
@@ -1,6 +1,9 @@
 from fastapi import APIRouter, HTTPException, Request
-from ..database import supabase
+from core.db import db, supabase_auth
+from core.auth import get_current_user
+from core.profiles import get_profile_cache
 from ..schemas import UserRegister, UserLogin
+from ..search import publish_username
 from fastapi import Depends
 
 router = APIRouter(prefix="/auth")
@@ -9,7 +12,7 @@ router = APIRouter(prefix="/auth")
 async def register(user: UserRegister):
     try:
         # 1. Регистрация в Supabase Auth
-        auth_response = supabase.auth.sign_up({
+        auth_response = await supabase_auth.sign_up({
             "email": user.email,
             "password": user.password,
             "options": {
@@ -21,7 +24,7 @@ async def register(user: UserRegister):
         })
         
         # 2. Создание профиля в public.profiles
-        supabase.table("profiles").insert({
+        await db.table("profiles").insert({
             "user_id": auth_response.user.id,
             "username": user.username,
             "first_name": user.first_name,
@@ -29,6 +32,7 @@ async def register(user: UserRegister):
             # Базовая ава для всех новых
             "avatar_url": "https://sun9-11.userapi.com/impg/tPC_WVw9-lSqlypnpBxySZm9eloqJBL9di2tSQ/j6onL53z90o.jpg?size=456x492&quality=95&sign=49455024b494d4189109706212579dfe&type=album",
         }).execute()
+        await publish_username(auth_response.user.id, user.username)
         
         return {"user_id": auth_response.user.id}
     
@@ -38,43 +42,26 @@ async def register(user: UserRegister):
 @router.post("/login")
 async def login(user: UserLogin):
     try:
-        response = supabase.auth.sign_in_with_password({
+        response = await supabase_auth.sign_in_with_password({
             "email": user.email,
             "password": user.password
         })
 
-        profile = supabase.table("profiles") \
-            .select("*") \
-            .eq("user_id", response.user.id) \
-            .single() \
-            .execute()
+        profile = await get_profile_cache().get(response.user.id)
 
         return {
             "access_token": response.session.access_token,
-            "user_id": profile.data.get("user_id"),
-            "username": profile.data.get("username"),
-            "avatar_url": profile.data.get("avatar_url"),
+            "user_id": profile.get("user_id"),
+            "username": profile.get("username"),
+            "avatar_url": profile.get("avatar_url"),
         }
     except Exception as e:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-async def get_current_user(request: Request):
-    # Извлекаем токен из заголовка
-    token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    
-    try:
-        # Проверяем токен через Supabase
-        user = supabase.auth.get_user(token)
-        return user
-    except Exception as e:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
 @router.get("/me")
 async def get_profile(user = Depends(get_current_user)):
-    profile = supabase.table("profiles") \
-        .select("*") \
-        .eq("user_id", user.user.id) \
-        .single() \
-        .execute()
-    
-    return profile.data
\ No newline at end of file
+    profile = await get_profile_cache().get(user.user.id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    return profile
\ No newline at end of file
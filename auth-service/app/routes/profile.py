@@ -1,71 +1,99 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile
-from ..schemas import UpdateUsername, UpdateFirstName, UpdateEmail, UpdatePassword, UpdateAvatar
-from ..database import supabase
-import os
-import cloudinary
-import cloudinary.uploader
-from dotenv import load_dotenv
-
-load_dotenv()
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET"),
-    secure=True
-)
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, UploadFile
+from ..schemas import UpdateUsername, UpdateFirstName, UpdateEmail, UpdatePassword, UpdateAvatar, ProfileBatch
+from core.db import db, supabase_auth
+from core.auth import get_current_user
+from core.profiles import get_profile_cache, invalidate_profile, project
+from core.uploads import process_image_upload
+from postgrest.exceptions import APIError
+from ..outbox import get_outbox_worker
+from ..search import RELATIONS, get_circle_cache, get_username_index, publish_username
 
 router = APIRouter(prefix="/profile")
 
-async def get_current_user(request: Request):
-    token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    
-    try:
-        user = supabase.auth.get_user(token)
-        return user
-    except Exception as e:
-        raise HTTPException(status_code=401, detail="Invalid token")
+PROFILE_COLUMNS = ("user_id", "username", "first_name", "avatar_url")
+
+@router.post("/batch")
+async def get_profiles_batch(data: ProfileBatch):
+    """
+    Профили нескольких пользователей за один запрос (один in_ по промахам кэша).
+    Неизвестные id в ответ не попадают.
+    """
+    columns = list(dict.fromkeys(data.columns))
+    # Ключи кэша и ответа — строки в том виде, в каком их возвращает PostgREST
+    user_ids = list(dict.fromkeys(str(user_id) for user_id in data.user_ids))
+    profiles = await get_profile_cache().get_many(user_ids)
+    found = [user_id for user_id in user_ids if user_id in profiles]
+
+    if data.compact:
+        return {
+            "user_ids": found,
+            "columns": {
+                column: [profiles[user_id].get(column) for user_id in found]
+                for column in columns
+            },
+        }
+
+    return {user_id: project(profiles[user_id], columns) for user_id in found}
+
+@router.get("/search")
+async def search_profiles(
+    q: str = Query(..., min_length=1, max_length=64),
+    limit: int = Query(10, ge=1, le=50),
+    user=Depends(get_current_user),
+):
+    """
+    Поиск по username: префикс и нечёткое совпадение (индекс app.search).
+    Сначала друзья, затем участники общих серверов.
+    """
+    query = q.strip()
+    if not query:
+        return []
+
+    index = get_username_index()
+    user_id = user.user.id
+    circle = await get_circle_cache().get(user_id)
+    found = index.search(query, limit, circle, exclude=index.number_of(user_id))
+
+    profiles = await get_profile_cache().get_many(index.user_id(number) for number, _ in found)
+    return [
+        {**project(profiles[index.user_id(number)], PROFILE_COLUMNS), "relation": RELATIONS[relation]}
+        for number, relation in found
+        if index.user_id(number) in profiles
+    ]
+
+async def set_profile_field(user_id: str, field: str, value: str) -> None:
+    """
+    Меняет поле профиля одной транзакцией (RPC set_profile_field). Копии поля
+    в других таблицах, например friends.sender_name, обновляет фоновая
+    задача app.outbox — ответ клиенту её не ждёт.
+    """
+    await db.rpc("set_profile_field", {
+        "p_user_id": user_id,
+        "p_field": field,
+        "p_value": value,
+    }).execute()
+    await invalidate_profile(user_id)
+    get_outbox_worker().notify()
 
 @router.patch("/update_username")
-def update_username(data: UpdateUsername, user=Depends(get_current_user)):
+async def update_username(data: UpdateUsername, user=Depends(get_current_user)):
     user_id = user.user.id
     
     try:
-        check = supabase.table("profiles") \
-            .select("user_id") \
-            .eq("username", data.username) \
-            .execute()
-        
-        if check.data and any(profile["user_id"] != user_id for profile in check.data):
+        await set_profile_field(user_id, "username", data.username)
+        await publish_username(user_id, data.username)
+        return {"message": "Имя пользователя обновлено"}
+
+    except APIError as e:
+        if e.code == "23505":
             raise HTTPException(
                 status_code=400,
                 detail="Имя пользователя уже используется"
             )
-        
-        result = supabase.table("profiles") \
-            .update({"username": data.username}) \
-            .eq("user_id", user_id) \
-            .execute()
-        
-        if hasattr(result, 'error') and result.error:
-            raise HTTPException(
-                status_code=400,
-                detail="Ошибка обновления имени пользователя"
-            )
-        
-        # Обновляем имя пользователя в таблице friends, если он отправитель
-        supabase.table("friends") \
-            .update({"sender_name": data.username}) \
-            .eq("sender_id", user_id) \
-            .execute()
-
-        # Обновляем имя пользователя в таблице friends, если он получатель
-        supabase.table("friends") \
-            .update({"receiver_name": data.username}) \
-            .eq("receiver_id", user_id) \
-            .execute()
-        
-        return {"message": "Имя пользователя обновлено"}
-    
+        raise HTTPException(
+            status_code=400,
+            detail="Ошибка обновления имени пользователя"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -73,41 +101,35 @@ def update_username(data: UpdateUsername, user=Depends(get_current_user)):
         )
 
 @router.patch("/update_first_name")
-def update_first_name(data: UpdateFirstName, user=Depends(get_current_user)):
+async def update_first_name(data: UpdateFirstName, user=Depends(get_current_user)):
     user_id = user.user.id
 
     try:
-        result = supabase.table("profiles").update({"first_name": data.first_name}) \
-            .eq("user_id", user_id).execute()
-
-        if hasattr(result, 'error') and result.error:
-            raise HTTPException(status_code=400, detail="Ошибка обновления имени")
-        
+        await set_profile_field(user_id, "first_name", data.first_name)
         return {"message": "Имя обновлено"}
-    
+
+    except APIError:
+        raise HTTPException(status_code=400, detail="Ошибка обновления имени")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
 
 @router.patch("/update_avatar")
-def update_avatar(data: UpdateAvatar, user=Depends(get_current_user)):
+async def update_avatar(data: UpdateAvatar, user=Depends(get_current_user)):
     user_id = user.user.id
 
     try:
-        result = supabase.table("profiles").update({"avatar_url": data.avatar_url}) \
-            .eq("user_id", user_id).execute()
-
-        if hasattr(result, 'error') and result.error:
-            raise HTTPException(status_code=400, detail="Ошибка обновления аватара")
-
+        await set_profile_field(user_id, "avatar_url", data.avatar_url)
         return {"message": "Аватар обновлён"}
-    
+
+    except APIError:
+        raise HTTPException(status_code=400, detail="Ошибка обновления аватара")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
 
 @router.patch("/update_email")
-def update_email(data: UpdateEmail):
+async def update_email(data: UpdateEmail):
     try:
-        response = supabase.auth.update_user(           
+        response = await supabase_auth.update_user(           
             attributes={"email": data.email},
         )
         
@@ -134,9 +156,9 @@ def update_email(data: UpdateEmail):
             )
 
 @router.patch("/update_password")
-def update_password(data: UpdatePassword):
+async def update_password(data: UpdatePassword):
     try:
-        response = supabase.auth.update_user(           
+        response = await supabase_auth.update_user(           
             attributes={"password": data.password},
         )
         
@@ -155,21 +177,12 @@ def update_password(data: UpdatePassword):
             detail=f"Внутренняя ошибка сервера: {str(e)}"
         )
     
-async def upload_avatar_to_cloudinary(file: UploadFile):
-    try:
-        result = cloudinary.uploader.upload(
-            file.file,
-            folder="avatar_users",
-            resource_type="auto",
-        )
-        return result["secure_url"]
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Cloudinary upload error: {str(e)}")
-    
 @router.post("/upload-avatar")
 async def upload_avatar(file: UploadFile):
     try:
-        image_url = await upload_avatar_to_cloudinary(file)
-        return {"url": image_url}
+        result = await process_image_upload(file, folder="avatar_users")
+        return {"url": result.url, "upload": result.report()}
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Cloudinary upload error: {str(e)}")
\ No newline at end of file
@@ -1,6 +1,7 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import date
-from typing import Optional
+from typing import Literal, Optional
+from uuid import UUID
 
 class UserRegister(BaseModel):
     email: EmailStr
@@ -26,4 +27,12 @@ class UpdateEmail(BaseModel):
     email: EmailStr
 
 class UpdatePassword(BaseModel):
-    password: str
\ No newline at end of file
+    password: str
+
+ProfileColumn = Literal["user_id", "username", "first_name", "avatar_url"]
+
+class ProfileBatch(BaseModel):
+    user_ids: list[UUID] = Field(max_length=500)
+    columns: list[ProfileColumn] = ["user_id", "username", "first_name", "avatar_url"]
+    # compact: вместо словаря по id — параллельные массивы колонок
+    compact: bool = False
\ No newline at end of file
@@ -0,0 +1,471 @@
+"""
+Поиск пользователей по имени (GET /profile/search) в памяти процесса.
+
+Индекс хранит все username из profiles:
+  - отсортированные ключи "имя в нижнем регистре\\0номер" (SortedKeys) —
+    поиск по префиксу это bisect до первого подходящего ключа и просмотр
+    вперёд, то есть то же, что обход поддерева префиксного дерева, но без
+    узла на каждую букву;
+  - триграммы (как pg_trgm) -> отсортированный array("I") номеров
+    пользователей для нечёткого поиска, когда по префиксу нашлось мало
+    (numpy импортируется при первом таком запросе).
+
+Вставка и удаление имени не пересортировывают и не сдвигают весь индекс:
+ключи лежат блоками, а номер в списке триграммы находится бинарным поиском.
+
+Индекс загружается постранично в фоне при старте сервиса и уже во время
+загрузки отвечает по загруженной части. register и update_username вызывают
+publish_username: изменение применяется сразу и расходится по остальным
+репликам через core.pubsub.
+
+Ранжирование: друзья, затем участники общих серверов, затем остальные;
+внутри группы — точное совпадение, префикс, нечёткое совпадение.
+"""
+import asyncio
+import contextlib
+import logging
+import sys
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Optional
+
+from core.config import setting_float, setting_int
+from core.db import db
+from core.pubsub import get_broker
+
+logger = logging.getLogger(__name__)
+
+EVENTS_CHANNEL = "profiles.usernames"
+PAGE_SIZE = 10000
+LOAD_CHUNK = 1000
+SIMILARITY = setting_float("SEARCH_SIMILARITY", 0.3)
+# Сколько номеров из списков триграмм просматривать на один запрос:
+# самые частые триграммы ("  a" и т.п.) почти ничего не отсеивают
+CANDIDATE_BUDGET = setting_int("SEARCH_CANDIDATE_BUDGET", 20000)
+
+FRIEND, SERVER, OTHER = 0, 1, 2
+RELATIONS = {FRIEND: "friend", SERVER: "server", OTHER: None}
+EXACT, PREFIX, FUZZY = 0, 1, 2
+
+
+def trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a: set[str], b: set[str]) -> float:
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared) if shared else 0.0
+
+
+class SortedKeys:
+    """
+    Отсортированные строки блоками не длиннее 2 * BLOCK (как в
+    sortedcontainers): вставка и удаление — бинарный поиск по максимумам
+    блоков и сдвиг внутри одного блока, а не списка из миллиона ключей.
+    """
+
+    BLOCK = 1000
+
+    def __init__(self):
+        self._blocks: list[list[str]] = []
+        self._maxes: list[str] = []
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block
+
+    def add(self, key: str) -> None:
+        if not self._blocks:
+            self._blocks.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            return
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+            self._blocks[i].append(key)
+            self._maxes[i] = key
+        else:
+            insort(self._blocks[i], key)
+        self._len += 1
+
+        block = self._blocks[i]
+        if len(block) > 2 * self.BLOCK:
+            self._blocks[i:i + 1] = [block[:self.BLOCK], block[self.BLOCK:]]
+            self._maxes[i:i + 1] = [block[self.BLOCK - 1], block[-1]]
+
+    def discard(self, key: str) -> bool:
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return False
+        block = self._blocks[i]
+        j = bisect_left(block, key)
+        if j == len(block) or block[j] != key:
+            return False
+        del block[j]
+        self._len -= 1
+        if not block:
+            del self._blocks[i]
+            del self._maxes[i]
+        elif j == len(block):
+            self._maxes[i] = block[-1]
+        return True
+
+    def starting_at(self, start: str):
+        """Ключи, не меньшие start, по возрастанию."""
+        i = bisect_left(self._maxes, start)
+        if i == len(self._maxes):
+            return
+        block = self._blocks[i]
+        for j in range(bisect_left(block, start), len(block)):
+            yield block[j]
+        for k in range(i + 1, len(self._blocks)):
+            yield from self._blocks[k]
+
+
+class UsernameIndex:
+    def __init__(self):
+        self._numbers: dict[str, int] = {}
+        self._ids: list[str] = []
+        # номер пользователя -> текущий username (None — ещё не загружен)
+        self._names: list[Optional[str]] = []
+        self._keys = SortedKeys()
+        self._trigrams: dict[str, array] = {}
+        self.ready = False
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _number(self, user_id: str) -> int:
+        number = self._numbers.get(user_id)
+        if number is None:
+            number = self._numbers[user_id] = len(self._ids)
+            self._ids.append(user_id)
+            self._names.append(None)
+        return number
+
+    @staticmethod
+    def _key(name: str, number: int) -> str:
+        return f"{name.lower()}\0{number}"
+
+    def _index_trigrams(self, name: str, number: int) -> None:
+        for trigram in trigrams(name.lower()):
+            postings = self._trigrams.get(trigram)
+            if postings is None:
+                postings = self._trigrams[trigram] = array("I")
+            # Новые пользователи получают самые большие номера — почти всегда в конец
+            if not postings or postings[-1] < number:
+                postings.append(number)
+            else:
+                insort(postings, number)
+
+    def _unindex(self, name: str, number: int) -> None:
+        self._keys.discard(self._key(name, number))
+        for trigram in trigrams(name.lower()):
+            postings = self._trigrams.get(trigram)
+            if postings is None:
+                continue
+            i = bisect_left(postings, number)
+            if i < len(postings) and postings[i] == number:
+                del postings[i]
+                if not postings:
+                    del self._trigrams[trigram]
+
+    def put(self, user_id: str, username: str) -> None:
+        """Новый пользователь или смена имени."""
+        number = self._number(user_id)
+        old = self._names[number]
+        if old == username:
+            return
+        if old is not None:
+            self._unindex(old, number)
+        self._names[number] = username
+        self._keys.add(self._key(username, number))
+        self._index_trigrams(username, number)
+
+    def load(self, rows: list[dict]) -> None:
+        """
+        Страница из profiles. Пользователи, чьё имя уже пришло событием,
+        пропускаются: событие новее строки, прочитанной загрузкой.
+        """
+        for row in rows:
+            number = self._number(row["user_id"])
+            username = row.get("username")
+            if self._names[number] is not None or not username:
+                continue
+            self._names[number] = username
+            self._keys.add(self._key(username, number))
+            self._index_trigrams(username, number)
+
+    def number_of(self, user_id: str) -> Optional[int]:
+        return self._numbers.get(user_id)
+
+    def numbers_of(self, user_ids) -> list[int]:
+        return [self._numbers[user_id] for user_id in user_ids if user_id in self._numbers]
+
+    def prefix(self, query: str, limit: int) -> list[int]:
+        query = query.lower()
+        found = []
+        for key in self._keys.starting_at(query):
+            if len(found) >= limit or not key.startswith(query):
+                break
+            found.append(int(key.rpartition("\0")[2]))
+        return found
+
+    def fuzzy(self, query: str, limit: int) -> list[tuple[float, int]]:
+        """До limit пользователей с похожестью триграмм не ниже SIMILARITY."""
+        import numpy as np
+
+        query_trigrams = trigrams(query.lower())
+        postings = sorted(
+            (self._trigrams[trigram] for trigram in query_trigrams if self._trigrams.get(trigram)),
+            key=len,
+        )
+        # Общие триграммы считаются сортировкой склеенных списков: на Python-цикле
+        # (Counter) это в разы дольше. frombuffer не копирует массивы, а
+        # представления живут только до concatenate — между ними нет await,
+        # поэтому put не может изменить массив посередине
+        parts, budget = [], CANDIDATE_BUDGET
+        for numbers in postings:
+            if len(numbers) > budget and parts:
+                break
+            parts.append(np.frombuffer(numbers, dtype=np.uint32)[:budget])
+            budget -= len(numbers)
+        if not parts:
+            return []
+        candidates = np.concatenate(parts)
+        del parts
+        if not candidates.size:
+            return []
+        candidates.sort()
+        starts = np.flatnonzero(np.r_[True, candidates[1:] != candidates[:-1]])
+        counts = np.diff(np.r_[starts, len(candidates)])
+        best = min(limit * 4, len(counts))
+        top = np.argpartition(-counts, best - 1)[:best]
+
+        scored = []
+        for number in candidates[starts[top]].tolist():
+            name = self._names[number]
+            score = similarity(query_trigrams, trigrams(name.lower())) if name else 0.0
+            if score >= SIMILARITY:
+                scored.append((score, number))
+        scored.sort(reverse=True)
+        return scored[:limit]
+
+    def match(self, query: str, number: int) -> Optional[tuple[int, float]]:
+        """Совпадает ли имя пользователя с запросом: (вид совпадения, похожесть)."""
+        name = self._names[number]
+        if name is None:
+            return None
+        name = name.lower()
+        if name == query:
+            return EXACT, 1.0
+        if name.startswith(query):
+            return PREFIX, 1.0
+        if query in name:
+            return FUZZY, 1.0
+        return None
+
+    def search(self, query: str, limit: int, circle: dict[int, int], exclude: Optional[int] = None) -> list[tuple[int, int]]:
+        """
+        Возвращает [(номер, отношение)] в порядке выдачи. circle — номера
+        друзей и участников общих серверов -> FRIEND / SERVER.
+        """
+        query = query.lower()
+        found: dict[int, tuple] = {}
+
+        def add(number: int, kind: int, score: float) -> None:
+            if number == exclude:
+                return
+            name = self._names[number] or ""
+            rank = (circle.get(number, OTHER), kind, -score, len(name), name)
+            if number not in found or rank < found[number]:
+                found[number] = rank
+
+        # Свой круг проверяется целиком: он небольшой и должен быть сверху
+        for number in circle:
+            matched = self.match(query, number)
+            if matched is not None:
+                add(number, *matched)
+
+        for number in self.prefix(query, limit + 1):
+            add(number, EXACT if self._names[number].lower() == query else PREFIX, 1.0)
+        if len(found) < limit and len(query) >= 3:
+            for score, number in self.fuzzy(query, limit):
+                add(number, FUZZY, score)
+
+        ranked = sorted(found.items(), key=lambda item: item[1])[:limit]
+        return [(number, rank[0]) for number, rank in ranked]
+
+    def user_id(self, number: int) -> str:
+        return self._ids[number]
+
+    def memory_bytes(self) -> int:
+        """
+        Обходит весь индекс (около секунды на миллион имён) — для бенчмарков,
+        в stats() не входит: его читают /internal/cache-stats и /metrics.
+        """
+        total = sys.getsizeof(self._numbers) + sys.getsizeof(self._ids) + sys.getsizeof(self._names)
+        total += sys.getsizeof(self._trigrams) + sum(sys.getsizeof(block) for block in self._keys._blocks)
+        total += sum(sys.getsizeof(user_id) for user_id in self._ids)
+        total += sum(sys.getsizeof(name) for name in self._names if name is not None)
+        total += sum(sys.getsizeof(key) for key in self._keys)
+        total += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in self._trigrams.items())
+        return total
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "usernames": len(self._keys),
+            "trigrams": len(self._trigrams),
+        }
+
+
+class CircleCache:
+    """Друзья и участники общих серверов пользователя (номера в индексе) с TTL."""
+
+    def __init__(self, index: UsernameIndex, max_size: int = 10000, ttl: float = 60.0):
+        self.index = index
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple[float, dict[int, int]]]" = OrderedDict()
+
+    async def get(self, user_id: str) -> dict[int, int]:
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+        circle = await self._load(user_id)
+        self._entries[user_id] = (time.monotonic() + self.ttl, circle)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return circle
+
+    async def _load(self, user_id: str) -> dict[int, int]:
+        friends_response, memberships = await asyncio.gather(
+            db.table("friends")
+                .select("sender_id, receiver_id")
+                .eq("status", "accepted")
+                .or_(f"sender_id.eq.{user_id},receiver_id.eq.{user_id}")
+                .execute(),
+            db.table("server_members")
+                .select("server_id")
+                .eq("user_id", user_id)
+                .execute(),
+        )
+
+        circle: dict[int, int] = {}
+        server_ids = [row["server_id"] for row in memberships.data]
+        if server_ids:
+            members = await db.table("server_members") \
+                .select("user_id") \
+                .in_("server_id", server_ids) \
+                .execute()
+            for number in self.index.numbers_of(row["user_id"] for row in members.data):
+                circle[number] = SERVER
+
+        friend_ids = (
+            row["receiver_id"] if row["sender_id"] == user_id else row["sender_id"]
+            for row in friends_response.data
+        )
+        for number in self.index.numbers_of(friend_ids):
+            circle[number] = FRIEND
+        return circle
+
+
+_index: Optional[UsernameIndex] = None
+_circles: Optional[CircleCache] = None
+_loader: Optional[asyncio.Task] = None
+
+
+def get_username_index() -> UsernameIndex:
+    global _index
+    if _index is None:
+        _index = UsernameIndex()
+        get_broker().subscribe(EVENTS_CHANNEL, _on_event)
+    return _index
+
+
+def get_circle_cache() -> CircleCache:
+    global _circles
+    if _circles is None:
+        _circles = CircleCache(
+            get_username_index(),
+            max_size=setting_int("SEARCH_CIRCLE_CACHE_SIZE", 10000),
+            ttl=setting_float("SEARCH_CIRCLE_TTL", 60),
+        )
+    return _circles
+
+
+async def _on_event(message: dict) -> None:
+    if _index is not None:
+        _index.put(message["user_id"], message["username"])
+
+
+async def publish_username(user_id: str, username: str) -> None:
+    """Вызывать после записи username в profiles."""
+    get_username_index().put(user_id, username)
+    await get_broker().publish(EVENTS_CHANNEL, {"user_id": user_id, "username": username})
+
+
+async def load_usernames() -> None:
+    index = get_username_index()
+    last_id = None
+    while True:
+        query = db.table("profiles") \
+            .select("user_id, username") \
+            .order("user_id") \
+            .limit(PAGE_SIZE)
+        if last_id is not None:
+            query = query.gt("user_id", last_id)
+        page = (await query.execute()).data
+
+        # Порциями, чтобы между ними успевали выполняться запросы
+        for start in range(0, len(page), LOAD_CHUNK):
+            index.load(page[start:start + LOAD_CHUNK])
+            await asyncio.sleep(0)
+        if len(page) < PAGE_SIZE:
+            break
+        last_id = page[-1]["user_id"]
+        # Отдаём управление запросам между страницами
+        await asyncio.sleep(0)
+    index.ready = True
+
+
+async def _load_forever() -> None:
+    while True:
+        try:
+            started = time.perf_counter()
+            await load_usernames()
+            logger.info("username index loaded: %d in %.1fs", len(get_username_index()), time.perf_counter() - started)
+            return
+        except Exception:
+            logger.exception("username index load failed")
+            await asyncio.sleep(5)
+
+
+async def start_username_index() -> None:
+    global _loader
+    _loader = asyncio.create_task(_load_forever())
+
+
+async def stop_username_index() -> None:
+    global _loader
+    if _loader is not None:
+        _loader.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _loader
+    _loader = None
+
+
+def username_index_stats() -> Optional[dict]:
+    return _index.stats() if _index is not None else None
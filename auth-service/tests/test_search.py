@@ -0,0 +1,125 @@
+import random
+
+import pytest
+
+from app.search import FRIEND, OTHER, SERVER, SortedKeys, UsernameIndex
+
+
+@pytest.fixture
+def keys():
+    keys = SortedKeys()
+    # Маленькие блоки, чтобы тест доходил до деления и удаления блоков
+    keys.BLOCK = 2
+    return keys
+
+
+def test_sorted_keys_add_and_discard(keys):
+    for key in ("m", "c", "x", "a", "q", "c2"):
+        keys.add(key)
+    assert list(keys) == ["a", "c", "c2", "m", "q", "x"]
+    assert len(keys) == 6
+
+    assert keys.discard("c2")
+    assert not keys.discard("c2")
+    assert not keys.discard("zz")
+    assert list(keys) == ["a", "c", "m", "q", "x"]
+    assert len(keys) == 5
+
+
+def test_sorted_keys_split_blocks(keys):
+    for key in "abcdefghij":
+        keys.add(key)
+    assert all(len(block) <= 2 * keys.BLOCK for block in keys._blocks)
+    assert len(keys._blocks) > 1
+    assert keys._maxes == [block[-1] for block in keys._blocks]
+
+    for key in "abcdefghij":
+        assert keys.discard(key)
+    assert list(keys) == [] and keys._blocks == [] and keys._maxes == []
+
+
+def test_sorted_keys_matches_sorted_list(keys):
+    rng = random.Random(1)
+    expected = []
+    for _ in range(2000):
+        key = "".join(rng.choices("abc", k=3))
+        if expected and rng.random() < 0.4:
+            key = rng.choice(expected)
+            keys.discard(key)
+            expected.remove(key)
+        else:
+            keys.add(key)
+            expected.append(key)
+            expected.sort()
+        start = "".join(rng.choices("abc", k=2))
+        assert list(keys.starting_at(start)) == [key for key in expected if key >= start]
+    assert list(keys) == expected
+
+
+@pytest.fixture
+def index():
+    index = UsernameIndex()
+    index.load([
+        {"user_id": "u-alice", "username": "alice"},
+        {"user_id": "u-alicia", "username": "Alicia"},
+        {"user_id": "u-albert", "username": "albert"},
+        {"user_id": "u-malice", "username": "malice"},
+        {"user_id": "u-bob", "username": "bob"},
+        {"user_id": "u-empty", "username": None},
+    ])
+    return index
+
+
+def names(index: UsernameIndex, numbers) -> list[str]:
+    return [index._names[number] for number in numbers]
+
+
+def test_prefix_is_case_insensitive_and_limited(index):
+    assert names(index, index.prefix("ALI", 10)) == ["alice", "Alicia"]
+    assert names(index, index.prefix("al", 2)) == ["albert", "alice"]
+    assert index.prefix("zzz", 10) == []
+
+
+def test_rename_moves_user_in_index(index):
+    index.put("u-bob", "robert")
+    assert index.prefix("bob", 10) == []
+    assert names(index, index.prefix("rob", 10)) == ["robert"]
+    assert len(index) == 5
+
+
+def test_load_skips_names_from_events(index):
+    index.put("u-new", "newcomer")
+    index.load([{"user_id": "u-new", "username": "stale"}])
+    assert names(index, index.prefix("new", 10)) == ["newcomer"]
+    assert index.prefix("stale", 10) == []
+
+
+def test_fuzzy_finds_similar_names(index):
+    found = names(index, [number for _, number in index.fuzzy("malise", 10)])
+    assert found[0] == "malice"
+    assert "bob" not in found
+
+
+def test_fuzzy_after_renames_empty_postings():
+    index = UsernameIndex()
+    index.put("u1", "zzzqx")
+    index.put("u1", "alice")
+    assert "zzq" not in index._trigrams
+    assert index.fuzzy("zzzqx", 10) == []
+    assert index.search("zzzqx", 10, {}) == []
+
+
+def test_search_ranks_circle_then_match_kind(index):
+    alice, alicia, malice, albert = (index.number_of(f"u-{name}") for name in ("alice", "alicia", "malice", "albert"))
+    circle = {alicia: FRIEND, malice: SERVER}
+
+    found = index.search("alice", 10, circle)
+
+    # Сначала друзья, затем общие серверы, затем остальные; внутри — точное, префикс, нечёткое
+    assert found[:3] == [(alicia, FRIEND), (malice, SERVER), (alice, OTHER)]
+    assert albert not in [number for number, _ in found[:3]]
+
+
+def test_search_excludes_self(index):
+    alice = index.number_of("u-alice")
+    assert alice not in [number for number, _ in index.search("alice", 10, {}, exclude=alice)]
@@ -0,0 +1,72 @@
+"""
+Опрос списков с If-None-Match (core.etag) против полного ответа каждый раз.
+
+Заглушка PostgREST — из server_bootstrap.py (задержка на запрос по умолчанию
+30 мс). Клиент опрашивает /servers/s1/member (ETag по хэшу тела: обработчик
+выполняется, но тело не передаётся) и /servers/s1/textchannels (версия
+ресурса: при неизменных каналах обработчик не вызывается).
+
+Запуск из корня репозитория:
+    python benchmarks/etag_polling.py [--members 200] [--polls 50] [--latency 0.03]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "server-service"), os.path.dirname(os.path.abspath(__file__))]
+
+from server_bootstrap import USER_ID, make_stub  # noqa: E402
+
+TOKEN = "bench-token"
+
+
+async def poll(client: httpx.AsyncClient, path: str, polls: int, conditional: bool) -> tuple[float, float]:
+    headers = {"Authorization": f"Bearer {TOKEN}"}
+    etag, received = None, 0
+    started = time.perf_counter()
+    for _ in range(polls):
+        if conditional and etag:
+            headers["If-None-Match"] = etag
+        response = await client.get(path, headers=headers)
+        etag = response.headers.get("etag", etag)
+        received += len(response.content)
+    return (time.perf_counter() - started) / polls * 1000, received / polls
+
+
+async def run(members: int, polls: int, latency: float) -> None:
+    from app.main import app
+    from app.routes import server as routes
+    import core.profiles
+    from core.auth import Identity, VerifiedUser, get_current_user, verifier
+
+    routes.db = core.profiles.db = make_stub(1, members, latency)
+    identity = Identity(user=VerifiedUser(id=USER_ID))
+    app.dependency_overrides[get_current_user] = lambda: identity
+    verifier.cache.put(TOKEN, identity)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"{members} members, upstream latency {latency * 1000:.0f} ms, {polls} polls")
+        for path in ("/servers/s1/member", "/servers/s1/textchannels"):
+            for conditional in (False, True):
+                ms, size = await poll(client, path, polls, conditional)
+                label = "If-None-Match" if conditional else "full body"
+                print(f"  {path:<26} {label:>13}: {ms:7.2f} ms/poll, {size:8.0f} bytes/poll")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--polls", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.03)
+    args = parser.parse_args()
+    asyncio.run(run(args.members, args.polls, args.latency))
+
+
+if __name__ == "__main__":
+    main()
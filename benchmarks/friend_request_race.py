@@ -0,0 +1,107 @@
+"""
+Гонка одновременных заявок в друзья против RPC send_friend_request.
+
+100 соединений одновременно (через Barrier) отправляют одну и ту же заявку:
+  - без ключа идемпотентности — ровно одна должна создаться, остальные
+    получить "exists";
+  - с одним Idempotency-Key — одна "created", остальные "replayed";
+  - встречные заявки (половина A->B, половина B->A) — тоже одна строка на пару.
+После каждого раунда в friends должна остаться одна строка для пары.
+
+Те же раунды с проверками в pytest — tests/test_friend_request_race.py;
+этот скрипт нужен для ручного замера на существующих профилях.
+
+Нужна БД с применёнными миграциями и двумя существующими профилями.
+Заявка между ними удаляется перед каждым раундом.
+
+Запуск из корня репозитория:
+    DATABASE_URL=postgresql://... python benchmarks/friend_request_race.py \\
+        --sender-id <uuid> --receiver-id <uuid> [--parallel 100]
+"""
+import argparse
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+
+def reset_pair(url: str, a: str, b: str) -> None:
+    with psycopg2.connect(url) as conn, conn.cursor() as cur:
+        cur.execute(
+            "delete from friends where user_low = least(%s::uuid, %s::uuid) and user_high = greatest(%s::uuid, %s::uuid)",
+            (a, b, a, b),
+        )
+
+
+def pair_rows(url: str, a: str, b: str) -> int:
+    with psycopg2.connect(url) as conn, conn.cursor() as cur:
+        cur.execute(
+            "select count(*) from friends where least(sender_id, receiver_id) = least(%s::uuid, %s::uuid) "
+            "and greatest(sender_id, receiver_id) = greatest(%s::uuid, %s::uuid)",
+            (a, b, a, b),
+        )
+        return cur.fetchone()[0]
+
+
+def username(url: str, user_id: str) -> str:
+    with psycopg2.connect(url) as conn, conn.cursor() as cur:
+        cur.execute("select username from profiles where user_id = %s", (user_id,))
+        return cur.fetchone()[0]
+
+
+def race(url: str, calls: list[tuple[str, str, str]]) -> tuple[Counter, float]:
+    """calls — (sender_id, receiver_username, idempotency_key) на каждое соединение."""
+    connections = [psycopg2.connect(url) for _ in calls]
+    for conn in connections:
+        conn.autocommit = True
+    barrier = threading.Barrier(len(calls))
+
+    def send(conn, call):
+        with conn.cursor() as cur:
+            barrier.wait()
+            cur.execute("select send_friend_request(%s, %s, %s)", call)
+            return cur.fetchone()[0]["result"]
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+            results = Counter(pool.map(send, connections, calls))
+    finally:
+        for conn in connections:
+            conn.close()
+    return results, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--sender-id", required=True)
+    parser.add_argument("--receiver-id", required=True)
+    parser.add_argument("--parallel", type=int, default=100)
+    args = parser.parse_args()
+
+    url, a, b, n = args.database_url, args.sender_id, args.receiver_id, args.parallel
+    name_a, name_b = username(url, a), username(url, b)
+    rounds = {
+        "duplicates": [(a, name_b, None)] * n,
+        "same idempotency key": [(a, name_b, "race-key")] * n,
+        "both directions": [(a, name_b, None) if i % 2 else (b, name_a, None) for i in range(n)],
+    }
+
+    failed = False
+    for name, calls in rounds.items():
+        reset_pair(url, a, b)
+        results, elapsed = race(url, calls)
+        rows = pair_rows(url, a, b)
+        ok = results["created"] == 1 and rows == 1
+        failed |= not ok
+        print(f"{name:>22}: {dict(results)}, rows for pair: {rows}, {elapsed * 1000:.0f} ms {'OK' if ok else 'FAIL'}")
+    reset_pair(url, a, b)
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Расчёт «возможных друзей» (app.suggestions) на синтетическом графе.
+
+Граф по умолчанию — 1M пользователей, в среднем 10 друзей; пользователи
+разбиты на сообщества по 1000 человек, 80% дружб внутри сообщества (иначе
+общих друзей почти не бывает). Измеряются:
+  - построение CSR-матрицы смежности;
+  - блочное произведение A @ A с отбором top-K;
+  - для сравнения — подсчёт друзей друзей на Python для выборки
+    пользователей, экстраполированный на весь граф (так выглядел бы расчёт
+    «по запросу»);
+  - пересечение отсортированных массивов для /friends/mutual.
+
+Запуск из корня репозитория:
+    python benchmarks/friend_suggestions_1m.py [--users 1000000] [--degree 10] [--top-k 20]
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import time
+from array import array
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "friends-service")]
+
+from app.graph import intersect_sorted  # noqa: E402
+from app.suggestions import adjacency_matrix, top_k_suggestions  # noqa: E402
+
+
+def synthetic_edges(users: int, degree: int, community: int, seed: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    count = users * degree // 2
+    rows = rng.integers(0, users, count, dtype=np.int64)
+    local = rng.random(count) < 0.8
+    cols = np.where(
+        local,
+        rows // community * community + rng.integers(0, community, count),
+        rng.integers(0, users, count),
+    )
+    cols = np.minimum(cols, users - 1)
+    keep = rows != cols
+    return rows[keep].astype(np.uint32), cols[keep].astype(np.uint32)
+
+
+def naive_per_user(adjacency, user: int, top_k: int) -> list[tuple[int, int]]:
+    indptr, indices = adjacency.indptr, adjacency.indices
+    friends = set(indices[indptr[user]:indptr[user + 1]].tolist())
+    counts: dict[int, int] = {}
+    for friend in friends:
+        for candidate in indices[indptr[friend]:indptr[friend + 1]].tolist():
+            if candidate != user and candidate not in friends:
+                counts[candidate] = counts.get(candidate, 0) + 1
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--degree", type=int, default=10)
+    parser.add_argument("--community", type=int, default=1000)
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--sample", type=int, default=2000)
+    args = parser.parse_args()
+
+    rows, cols = synthetic_edges(args.users, args.degree, args.community)
+    print(f"{args.users} users, {len(rows)} friendships, top-{args.top_k}")
+
+    started = time.perf_counter()
+    adjacency = adjacency_matrix(rows, cols, args.users)
+    built = time.perf_counter()
+    indptr, candidates, scores = top_k_suggestions(adjacency, top_k=args.top_k)
+    computed = time.perf_counter()
+
+    print(f"  adjacency (CSR):        {built - started:8.2f} s, {adjacency.nnz} non-zeros")
+    print(f"  A @ A + top-K (batch):  {computed - built:8.2f} s, {len(candidates)} suggestions stored")
+    print(f"  peak RSS:               {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:8.0f} MB")
+
+    sample = random.Random(2).sample(range(args.users), min(args.sample, args.users))
+    started = time.perf_counter()
+    for user in sample:
+        expected = naive_per_user(adjacency, user, args.top_k)
+        got = list(zip(
+            candidates[indptr[user]:indptr[user + 1]].tolist(),
+            scores[indptr[user]:indptr[user + 1]].tolist(),
+        ))
+        assert got == expected, (user, got, expected)
+    per_user = (time.perf_counter() - started) / len(sample)
+    print(
+        f"  per-user Python:        {per_user * 1e6:8.1f} us/user, "
+        f"~{per_user * args.users:.0f} s for all users (results match the batch job)"
+    )
+
+    friend_lists = [
+        array("I", adjacency.indices[adjacency.indptr[u]:adjacency.indptr[u + 1]].tolist()) for u in sample
+    ]
+    pairs = list(zip(friend_lists, friend_lists[1:] + friend_lists[:1]))
+    started = time.perf_counter()
+    for a, b in pairs:
+        intersect_sorted(a, b)
+    print(f"  mutual (sorted arrays): {(time.perf_counter() - started) / len(pairs) * 1e6:8.2f} us/pair")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Пропускная способность шлюза (gateway-service) против прямого обращения
+к сервису или другого прокси.
+
+Без --target скрипт поднимает локально два процесса uvicorn:
+  - заглушку сервиса (этот файл, приложение backend): GET /friends/friendsList
+    с get_current_user и анонимный GET /friends/{user_id}, каждый отвечает
+    после --latency секунд (имитация запроса к БД);
+  - gateway-service перед ней с INTERNAL_IDENTITY_SECRET.
+и сравнивает "direct" (клиент -> сервис) и "gateway" (клиент -> шлюз -> сервис).
+
+Сравнение с nginx из gateway/default.conf — на запущенном docker-compose:
+    python benchmarks/gateway_throughput.py \\
+        --target nginx=http://localhost --target gateway=http://localhost:8080 \\
+        --token <access_token> --user-id <uuid>
+
+Все процессы делят CPU машины, поэтому цифры — для сравнения вариантов
+между собой, а не абсолютный предел.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT]
+
+JWT_SECRET = "bench-jwt-secret"
+IDENTITY_SECRET = "bench-identity-secret"
+BACKEND_PORT, GATEWAY_PORT = 18001, 18000
+LATENCY = float(os.environ.get("BENCH_BACKEND_LATENCY", "0.005"))
+
+
+def make_backend():
+    from fastapi import Depends, FastAPI
+
+    from core.auth import get_current_user
+
+    backend = FastAPI()
+
+    @backend.get("/friends/friendsList")
+    async def friends_list(user=Depends(get_current_user)):
+        await asyncio.sleep(LATENCY)
+        return [{"user_id": f"u{i}", "username": f"user{i}", "avatar_url": None} for i in range(20)]
+
+    @backend.get("/friends/{user_id}")
+    async def profile(user_id: str):
+        await asyncio.sleep(LATENCY)
+        return {"user_id": user_id, "username": "bench", "first_name": "Bench", "avatar_url": None}
+
+    return backend
+
+
+if os.environ.get("BENCH_BACKEND"):
+    backend = make_backend()
+
+
+def make_token(user_id: str) -> str:
+    import jwt
+
+    return jwt.encode(
+        {"sub": user_id, "aud": "authenticated", "role": "authenticated", "exp": int(time.time()) + 3600},
+        JWT_SECRET,
+        algorithm="HS256",
+    )
+
+
+def spawn(app: str, port: int, app_dir: str, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--app-dir", app_dir, "--no-access-log", "--log-level", "warning"],
+        env={**os.environ, "PYTHONPATH": ROOT, **env},
+    )
+
+
+async def wait_ready(url: str) -> None:
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not start")
+
+
+async def request(reader, writer, raw: bytes) -> int:
+    """Один GET по keep-alive соединению; ответы сервисов всегда с Content-Length."""
+    writer.write(raw)
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head[9:12])
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line[:15].lower() == b"content-length:":
+            length = int(line[15:])
+    await reader.readexactly(length)
+    return status
+
+
+async def load(url: str, headers: dict, concurrency: int, duration: float) -> tuple[float, float, float, int]:
+    # Свой минимальный HTTP/1.1-клиент: httpx сам съедает больше CPU, чем
+    # измеряемые сервера, а машина у всех процессов общая
+    parsed = httpx.URL(url)
+    lines = [f"GET {parsed.raw_path.decode()} HTTP/1.1", f"Host: {parsed.host}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    raw = ("\r\n".join(lines) + "\r\n\r\n").encode()
+    timings, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(parsed.host, parsed.port or 80)
+        try:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                status = await request(reader, writer, raw)
+                timings.append(time.perf_counter() - started)
+                if status != 200:
+                    errors += 1
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    timings.sort()
+    return len(timings) / elapsed, statistics.median(timings) * 1000, timings[int(len(timings) * 0.99)] * 1000, errors
+
+
+async def run(args) -> None:
+    processes = []
+    targets = dict(target.split("=", 1) for target in args.target)
+    token, user_id = args.token, args.user_id
+    if not targets:
+        token = make_token(user_id)
+        common = {"SUPABASE_JWT_SECRET": JWT_SECRET, "INTERNAL_IDENTITY_SECRET": IDENTITY_SECRET,
+                  "BENCH_BACKEND_LATENCY": str(args.latency)}
+        backend_url = f"http://127.0.0.1:{BACKEND_PORT}"
+        processes.append(spawn("gateway_throughput:backend", BACKEND_PORT, os.path.dirname(__file__),
+                               {**common, "BENCH_BACKEND": "1"}))
+        processes.append(spawn("app.main:app", GATEWAY_PORT, os.path.join(ROOT, "gateway-service"),
+                               {**common, **{f"{name}_SERVICE_URL": backend_url for name in ("AUTH", "SERVER", "FRIENDS", "CHAT")}}))
+        targets = {"direct": backend_url, "gateway": f"http://127.0.0.1:{GATEWAY_PORT}"}
+        for url in targets.values():
+            await wait_ready(url)
+
+    try:
+        print(f"concurrency {args.concurrency}, {args.duration:.0f} s per run")
+        workloads = {
+            "GET /friends/friendsList (auth)": ("/friends/friendsList", {"Authorization": f"Bearer {token}"}),
+            "GET /friends/{user_id} (anonymous)": (f"/friends/{user_id}", {}),
+        }
+        for label, (path, headers) in workloads.items():
+            print(f"  {label}")
+            for name, base in targets.items():
+                rps, p50, p99, errors = await load(base + path, headers, args.concurrency, args.duration)
+                print(f"    {name:>8}: {rps:8.0f} req/s, p50 {p50:6.1f} ms, p99 {p99:6.1f} ms, errors {errors}")
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", action="append", default=[], help="name=base_url, можно несколько")
+    parser.add_argument("--token", help="access_token для --target")
+    parser.add_argument("--user-id", default="00000000-0000-0000-0000-000000000001")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--latency", type=float, default=LATENCY)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
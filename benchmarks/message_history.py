@@ -0,0 +1,97 @@
+"""
+Стоимость страницы истории сообщений в зависимости от глубины прокрутки.
+
+Синтетический канал из 1M сообщений в SQLite с тем же индексом, что у
+public.messages: (channel_id, created_at desc, id desc). Сравниваются
+пагинация по ключу (как GET /chat/{chat_id}/messages) и OFFSET.
+
+Запуск из корня репозитория:
+    python benchmarks/message_history.py [--messages 1000000] [--limit 50]
+"""
+import argparse
+import sqlite3
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+CHANNEL = "c0"
+DEPTHS = (0, 1_000, 10_000, 100_000, 500_000, 990_000)
+
+KEYSET = """
+    select id, created_at from messages
+    where channel_id = ? and created_at <= ?
+      and (created_at < ? or (created_at = ? and id < ?))
+    order by created_at desc, id desc
+    limit ?
+"""
+OFFSET = """
+    select id, created_at from messages
+    where channel_id = ?
+    order by created_at desc, id desc
+    limit ? offset ?
+"""
+
+
+def build(total: int) -> sqlite3.Connection:
+    conn = sqlite3.connect(":memory:")
+    conn.execute("""
+        create table messages (
+            id text primary key, channel_id text, author_id text,
+            content text, created_at text
+        )
+    """)
+    started = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+    def rows():
+        for i in range(total):
+            # По несколько сообщений на одну миллисекунду, чтобы id решал порядок
+            created_at = started + timedelta(milliseconds=i // 3)
+            yield str(uuid.uuid4()), CHANNEL, f"u{i % 500}", "hello", created_at.isoformat()
+
+    conn.executemany("insert into messages values (?, ?, ?, ?, ?)", rows())
+    conn.execute("create index messages_channel_created_idx on messages (channel_id, created_at desc, id desc)")
+    conn.commit()
+    return conn
+
+
+def timed(conn, sql, params, repeat=20) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    conn = build(args.messages)
+    print(f"built {args.messages} messages in {time.perf_counter() - started:.1f} s")
+
+    # Курсор на нужной глубине = последняя строка предыдущей страницы
+    cursors = {}
+    for depth in DEPTHS:
+        if 0 < depth < args.messages:
+            cursors[depth] = conn.execute(OFFSET, (CHANNEL, 1, depth - 1)).fetchone()
+
+    print(f"{'depth':>8} {'keyset ms':>10} {'offset ms':>10}")
+    for depth in DEPTHS:
+        if depth >= args.messages:
+            continue
+        if depth:
+            message_id, created_at = cursors[depth]
+            keyset = timed(conn, KEYSET, (CHANNEL, created_at, created_at, created_at, message_id, args.limit))
+        else:
+            keyset = timed(conn, OFFSET, (CHANNEL, args.limit, 0))
+        offset = timed(conn, OFFSET, (CHANNEL, args.limit, depth), repeat=5)
+        print(f"{depth:>8} {keyset:>10.3f} {offset:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
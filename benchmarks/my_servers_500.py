@@ -0,0 +1,122 @@
+"""
+Микробенчмарк GET /servers/my-servers для пользователя в 500 серверах.
+
+Обработчики вызываются напрямую, PostgREST заменён заглушкой в памяти
+(с необязательной задержкой на каждый запрос). Сравниваются:
+  - before: два запроса и поиск роли через next() в цикле (O(n²));
+  - after (miss): один запрос со встроенным join, кэш промахивается;
+  - after (hit):  ответ из кэша списка серверов.
+
+Запуск из корня репозитория:
+    python benchmarks/my_servers_500.py [--servers 500] [--rounds 200] [--latency 0]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "server-service")]
+
+USER_ID = "00000000-0000-0000-0000-000000000001"
+
+
+class StubQuery:
+    def __init__(self, tables, latency, table):
+        self.tables, self.latency, self.table = tables, latency, table
+        self.columns = ""
+
+    def select(self, columns):
+        self.columns = columns
+        return self
+
+    def eq(self, *args):
+        return self
+
+    def in_(self, *args):
+        return self
+
+    async def execute(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        rows = self.tables[self.table]
+        if self.table == "server_members" and "servers(" not in self.columns:
+            rows = [{"server_id": m["servers"]["id"], "role": m["role"]} for m in rows]
+        return types.SimpleNamespace(data=rows)
+
+
+def make_stub(servers: int, latency: float):
+    server_rows = [
+        {"id": f"s{i}", "name": f"server {i}", "image_url": "", "owner_id": USER_ID}
+        for i in range(servers)
+    ]
+    tables = {
+        "servers": server_rows,
+        # Порядок членств не совпадает с порядком серверов, как в реальной БД
+        "server_members": [{"role": "member", "servers": s} for s in reversed(server_rows)],
+    }
+    return types.SimpleNamespace(table=lambda name: StubQuery(tables, latency, name))
+
+
+async def legacy_handler(db):
+    memberships = await db.table("server_members") \
+        .select("server_id, role") \
+        .eq("user_id", USER_ID) \
+        .execute()
+    server_ids = [m["server_id"] for m in memberships.data]
+    servers = await db.table("servers") \
+        .select("id, name, image_url, owner_id") \
+        .in_("id", server_ids) \
+        .execute()
+    return [
+        {**s, "user_role": next(m for m in memberships.data if m["server_id"] == s["id"])["role"]}
+        for s in servers.data
+    ]
+
+
+async def measure(call, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await call()
+    return (time.perf_counter() - started) / rounds * 1000
+
+
+async def run(servers: int, rounds: int, latency: float) -> None:
+    from app.routes import server as routes
+    from app.server_list import get_server_list_cache, invalidate_server_lists
+    from core.auth import Identity, VerifiedUser
+
+    stub = make_stub(servers, latency)
+    routes.db = stub
+    user = Identity(user=VerifiedUser(id=USER_ID))
+    cache = get_server_list_cache()
+
+    async def miss():
+        cache.invalidate_local([USER_ID])
+        return await routes.get_user_servers(user)
+
+    assert len(await routes.get_user_servers(user)) == len(await legacy_handler(stub)) == servers
+
+    print(f"{servers} servers, {rounds} rounds, upstream latency {latency * 1000:.0f} ms")
+    for name, call in (
+        ("before", lambda: legacy_handler(stub)),
+        ("after (miss)", miss),
+        ("after (hit)", lambda: routes.get_user_servers(user)),
+    ):
+        print(f"{name:>13}: {await measure(call, rounds):8.3f} ms/request")
+    await invalidate_server_lists([USER_ID])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.servers, args.rounds, args.latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Пропускная способность GET /servers/my-servers при 200 одновременных клиентах.
+
+Supabase заменён локальной заглушкой PostgREST с фиксированной задержкой
+ответа (по умолчанию 50 мс, как до облачного Supabase), она работает в отдельном процессе. Сравниваются:
+  - before: прежний обработчик на синхронном клиенте (блокирует event loop);
+  - after:  текущий обработчик server-service на core.db.
+
+Запуск из корня репозитория:
+    python benchmarks/my_servers_concurrency.py [--clients 200] [--requests 5]
+"""
+import argparse
+import asyncio
+import os
+import multiprocessing
+import socket
+import sys
+import time
+
+import httpx
+import uvicorn
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import JSONResponse
+from postgrest import SyncPostgrestClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "server-service")]
+
+USER_ID = "00000000-0000-0000-0000-000000000001"
+SERVERS = [
+    {"id": f"s{i}", "name": f"server {i}", "image_url": "", "owner_id": USER_ID}
+    for i in range(20)
+]
+
+
+def make_stub(latency: float) -> FastAPI:
+    stub = FastAPI()
+
+    @stub.get("/rest/v1/{table}")
+    async def select(table: str, request: Request):
+        await asyncio.sleep(latency)
+        if table == "server_members":
+            rows = [{"server_id": s["id"], "role": "member", "servers": s} for s in SERVERS]
+        else:
+            rows = SERVERS
+        return JSONResponse(rows)
+
+    return stub
+
+
+def serve_stub(port: int, latency: float) -> None:
+    uvicorn.run(make_stub(latency), host="127.0.0.1", port=port, log_level="error")
+
+
+def start_stub(latency: float) -> str:
+    # Заглушка в отдельном процессе, чтобы не делить GIL с измеряемым приложением
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    multiprocessing.Process(target=serve_stub, args=(port, latency), daemon=True).start()
+    url = f"http://127.0.0.1:{port}"
+    while True:
+        try:
+            httpx.get(f"{url}/rest/v1/servers")
+            return url
+        except httpx.TransportError:
+            time.sleep(0.05)
+
+
+def make_legacy_app(url: str) -> FastAPI:
+    """Обработчик /servers/my-servers в том виде, в каком он был до core.db."""
+    legacy = FastAPI()
+    client = SyncPostgrestClient(f"{url}/rest/v1")
+
+    @legacy.get("/servers/my-servers")
+    async def get_user_servers():
+        memberships = client.table("server_members") \
+            .select("server_id, role") \
+            .eq("user_id", USER_ID) \
+            .execute()
+        server_ids = [m["server_id"] for m in memberships.data]
+        servers = client.table("servers") \
+            .select("id, name, image_url, owner_id") \
+            .in_("id", server_ids) \
+            .execute()
+        return [
+            {**s, "user_role": next(m for m in memberships.data if m["server_id"] == s["id"])["role"]}
+            for s in servers.data
+        ]
+
+    return legacy
+
+
+def make_current_app() -> FastAPI:
+    from app.main import app
+    from core.auth import Identity, VerifiedUser, get_current_user
+
+    app.dependency_overrides[get_current_user] = lambda: Identity(user=VerifiedUser(id=USER_ID))
+    return app
+
+
+async def run_load(app: FastAPI, clients: int, requests: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for _ in range(requests):
+                response = await client.get("/servers/my-servers")
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        return clients * requests / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    url = start_stub(args.latency)
+    # Кэш my-servers отключён: меряем путь до Supabase, а не попадания в кэш
+    os.environ.update(SUPABASE_URL=url, SUPABASE_KEY="bench", MY_SERVERS_CACHE_TTL="0")
+
+    print(f"{args.clients} clients x {args.requests} requests, upstream latency {args.latency * 1000:.0f} ms")
+    for name, app in (("before", make_legacy_app(url)), ("after", make_current_app())):
+        rps = asyncio.run(run_load(app, args.clients, args.requests))
+        print(f"{name:>6}: {rps:8.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
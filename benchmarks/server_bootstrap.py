@@ -0,0 +1,127 @@
+"""
+Открытие сервера: цепочка прежних запросов клиента против GET /servers/{id}/bootstrap.
+
+PostgREST заменён заглушкой в памяти с фиксированной задержкой на каждый
+запрос (по умолчанию 30 мс). Прежний клиент последовательно вызывает
+/servers/{id} (три запроса к БД), /textchannels, /voicechannels, /member и
+/voicechannels/{id}/members для каждого голосового канала.
+
+Запуск из корня репозитория:
+    python benchmarks/server_bootstrap.py [--voice-channels 3] [--rounds 10] [--latency 0.03]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import types
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "server-service")]
+
+USER_ID = "00000000-0000-0000-0000-000000000001"
+SERVER = {"id": "s1", "name": "bench", "image_url": "", "owner_id": USER_ID}
+
+
+class StubQuery:
+    """Понимает ровно те цепочки, что строят обработчики server-service."""
+
+    def __init__(self, tables, latency, table):
+        self.tables, self.latency, self.table = tables, latency, table
+        self.columns, self.one = "", False
+
+    def select(self, columns, count=None):
+        self.columns = columns
+        return self
+
+    def single(self):
+        self.one = True
+        return self
+
+    maybe_single = single
+
+    def __getattr__(self, name):
+        # eq, in_, order и т.п. на выдачу заглушки не влияют
+        return lambda *args, **kwargs: self
+
+    async def execute(self):
+        await asyncio.sleep(self.latency)
+        rows = self.tables[self.table]
+        if self.table == "server_members" and self.one:
+            row = {"role": "owner", "servers": SERVER} if "servers(" in self.columns else {"role": "owner"}
+            return types.SimpleNamespace(data=row, count=1)
+        if self.one:
+            return types.SimpleNamespace(data=rows[0], count=1)
+        return types.SimpleNamespace(data=rows, count=len(rows))
+
+
+def make_stub(voice_channels: int, members: int, latency: float):
+    tables = {
+        "servers": [SERVER],
+        "text_channels": [{"id": f"t{i}", "server_id": "s1", "name": f"text {i}", "position": i} for i in range(5)],
+        "voice_channels": [
+            {"id": f"v{i}", "server_id": "s1", "name": f"voice {i}", "position": i} for i in range(voice_channels)
+        ],
+        "server_members": [{"server_id": "s1", "user_id": f"u{i}", "role": "member"} for i in range(members)],
+        "profiles": [{"user_id": f"u{i}", "username": f"user{i}", "avatar_url": None} for i in range(members)],
+    }
+    return types.SimpleNamespace(table=lambda name: StubQuery(tables, latency, name))
+
+
+async def measure(client: httpx.AsyncClient, flow, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await flow(client)
+    return (time.perf_counter() - started) / rounds * 1000
+
+
+async def legacy_flow(client: httpx.AsyncClient) -> None:
+    for path in ("/servers/s1", "/servers/s1/textchannels", "/servers/s1/member"):
+        (await client.get(path)).raise_for_status()
+    channels = (await client.get("/servers/s1/voicechannels")).json()
+    for channel in channels:
+        (await client.get(f"/servers/s1/voicechannels/{channel['id']}/members")).raise_for_status()
+
+
+async def bootstrap_flow(client: httpx.AsyncClient) -> None:
+    (await client.get("/servers/s1/bootstrap")).raise_for_status()
+
+
+async def run(voice_channels: int, members: int, rounds: int, latency: float) -> None:
+    from app.main import app
+    from app.presence import get_presence
+    from app.routes import server as routes
+    import core.profiles
+    from core.auth import Identity, VerifiedUser, get_current_user
+
+    stub = make_stub(voice_channels, members, latency)
+    routes.db = core.profiles.db = stub
+    app.dependency_overrides[get_current_user] = lambda: Identity(user=VerifiedUser(id=USER_ID))
+    for i in range(voice_channels):
+        await get_presence().join("s1", f"v{i}", f"u{i}")
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await bootstrap_flow(client)
+        print(
+            f"{voice_channels} voice channels, {members} members, "
+            f"upstream latency {latency * 1000:.0f} ms, {rounds} rounds"
+        )
+        for name, flow in (("before", legacy_flow), ("bootstrap", bootstrap_flow)):
+            print(f"{name:>9}: {await measure(client, flow, rounds):8.1f} ms to open a server")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--voice-channels", type=int, default=3)
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.03)
+    args = parser.parse_args()
+    asyncio.run(run(args.voice_channels, args.members, args.rounds, args.latency))
+
+
+if __name__ == "__main__":
+    main()
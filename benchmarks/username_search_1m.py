@@ -0,0 +1,101 @@
+"""
+Поиск по username (app.search.UsernameIndex) на синтетических именах.
+
+По умолчанию 1M имён вида <слог><слог>[<слог>][цифры]. Измеряются:
+  - загрузка индекса страницами по 10000 (как load_usernames);
+  - задержка search() для префиксов разной длины и для запросов с опечаткой
+    (нечёткий поиск по триграммам), с кругом из 300 друзей/участников серверов;
+  - для сравнения — линейный проход по всем именам (так работает
+    ilike 'q%' без индекса).
+
+Запуск из корня репозитория:
+    python benchmarks/username_search_1m.py [--users 1000000] [--queries 2000]
+"""
+import argparse
+import os
+import random
+import resource
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "auth-service")]
+
+from app.search import FRIEND, SERVER, UsernameIndex  # noqa: E402
+
+SYLLABLES = [c + v for c in "bcdfghklmnprstvz" for v in "aeiou"] + ["dark", "neo", "pro", "max", "sky", "ice"]
+
+
+def synthetic_usernames(count: int, rng: random.Random) -> list[str]:
+    names = set()
+    while len(names) < count:
+        name = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if rng.random() < 0.5:
+            name += str(rng.randint(0, 9999))
+        names.add(name)
+    return list(names)
+
+
+def typo(name: str, rng: random.Random) -> str:
+    i = rng.randrange(len(name))
+    return name[:i] + rng.choice("aeiouxyz") + name[i + 1:]
+
+
+def latency(index, queries, circle, limit=10) -> tuple[float, float]:
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query, limit, circle)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return statistics.median(timings) * 1e3, timings[int(len(timings) * 0.99)] * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    names = synthetic_usernames(args.users, rng)
+    rows = [{"user_id": f"user-{i:08d}", "username": name} for i, name in enumerate(names)]
+
+    index = UsernameIndex()
+    started = time.perf_counter()
+    for i in range(0, len(rows), 10000):
+        index.load(rows[i:i + 10000])
+    print(f"{args.users} usernames")
+    print(f"  load (pages of 10000):   {time.perf_counter() - started:8.2f} s")
+    print(f"  index memory:            {index.memory_bytes() / 2**20:8.0f} MB (peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB)")
+
+    circle = {number: FRIEND if i < 100 else SERVER for i, number in enumerate(rng.sample(range(args.users), 300))}
+    sample = rng.sample(names, args.queries)
+    workloads = {
+        "prefix, 2 chars": [name[:2] for name in sample],
+        "prefix, 4 chars": [name[:4] for name in sample],
+        "full username": sample,
+        "username with typo": [typo(name, rng) for name in sample],
+    }
+    for label, queries in workloads.items():
+        p50, p99 = latency(index, queries, circle)
+        print(f"  search, {label:<19} p50 {p50:6.3f} ms, p99 {p99:6.3f} ms")
+
+    lowered = [name.lower() for name in names]
+    queries = workloads["prefix, 4 chars"][:50]
+    started = time.perf_counter()
+    for query in queries:
+        [name for name in lowered if name.startswith(query)][:10]
+    print(f"  linear scan (no index):  {(time.perf_counter() - started) / len(queries) * 1e3:8.2f} ms/query")
+
+    index.put(rows[0]["user_id"], "renamed_user")
+    started = time.perf_counter()
+    index.put(rows[0]["user_id"], "renamed_again")
+    print(f"  rename (put):            {(time.perf_counter() - started) * 1e3:8.2f} ms")
+    assert index.search("renamed_again", 1, {})[0][0] == index.number_of(rows[0]["user_id"])
+    assert not index.prefix("renamed_user", 1)
+
+
+if __name__ == "__main__":
+    main()
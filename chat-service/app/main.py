@@ -1,8 +1,20 @@
 from fastapi import FastAPI
 from .routes.chat import router as server_router
 from fastapi.middleware.cors import CORSMiddleware
+from core.diagnostics import register_stats, router as diagnostics_router
+from core.ratelimit import RateLimitMiddleware
+from core.metrics import MetricsMiddleware, router as metrics_router
+from core.lifespan import lifespan, on_startup, on_shutdown
+from .messages import message_writer_stats, start_message_writer, stop_message_writer
 
-app = FastAPI()
+on_startup(start_message_writer)
+on_shutdown(stop_message_writer)
+register_stats("messages", message_writer_stats)
+
+app = FastAPI(lifespan=lifespan)
+
+# Частые запросы одного клиента отклоняются 429 до обработчика (внутри CORS)
+app.add_middleware(RateLimitMiddleware)
 
 # Разрешаем CORS для фронтенда
 app.add_middleware(
@@ -13,4 +25,10 @@ app.add_middleware(
     allow_headers=["*"],  # Разрешаем все заголовки
 )
 
-app.include_router(server_router)
\ No newline at end of file
+# Время ответов по шаблонам маршрутов для /metrics; снаружи всех, чтобы
+# учитывать и ответы CORS, лимита запросов и 304
+app.add_middleware(MetricsMiddleware)
+
+app.include_router(server_router)
+app.include_router(diagnostics_router)
+app.include_router(metrics_router)
\ No newline at end of file
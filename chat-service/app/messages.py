@@ -0,0 +1,208 @@
+"""
+Пакетная запись сообщений в таблицу messages.
+
+Сообщение получает id и created_at на сервере и сразу рассылается
+подписчикам канала, а в БД попадает фоновой задачей: всё, что накопилось
+за FLUSH_INTERVAL (или BATCH_SIZE сообщений), уходит одним bulk insert.
+
+Если пачку отклонила сама БД (ошибка данных или ограничения — например,
+канал успели удалить), пачка делится пополам, пока не останутся отдельные
+строки; такие строки откладываются в dead letters, остальные записываются.
+Сетевые и прочие временные ошибки повторяются, но очередь ограничена
+MAX_PENDING: при переполнении новые сообщения отклоняются (503).
+
+stop() не прерывает идущий insert: дожидается его и записывает остаток
+очереди, иначе сообщения, уже разосланные подписчикам, пропали бы.
+"""
+import asyncio
+import contextlib
+import logging
+from collections import deque
+from typing import Optional
+
+from postgrest.exceptions import APIError
+from postgrest.types import ReturnMethod
+
+from core.broadcast import Broadcaster
+from core.config import setting_float, setting_int
+from core.db import db
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = setting_int("MESSAGES_BATCH_SIZE", 200)
+FLUSH_INTERVAL = setting_float("MESSAGES_FLUSH_INTERVAL", 0.05)
+MAX_PENDING = setting_int("MESSAGES_MAX_PENDING", 10000)
+DEAD_LETTERS_SIZE = 100
+RETRY_DELAY = 1.0
+
+
+def is_transient(error: Exception) -> bool:
+    """Повтор поможет, если ошибка не в данных: классы SQLSTATE 22 и 23 — в данных."""
+    if isinstance(error, APIError):
+        return not str(error.code or "").startswith(("22", "23"))
+    return True
+
+
+class MessageWriter:
+    def __init__(
+        self,
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+        max_pending: int = MAX_PENDING,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # Ещё не отправленные в БД сообщения: id -> строка таблицы
+        self._pending: dict[str, dict] = {}
+        # Сообщения текущего insert и событие его завершения
+        self._in_flight: dict[str, dict] = {}
+        self._flushed = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        # Последние строки, которые БД отказалась принять: (строка, ошибка)
+        self.dead_letters: deque[tuple[dict, str]] = deque(maxlen=DEAD_LETTERS_SIZE)
+        self.batches = 0
+        self.written = 0
+        self.dead_lettered = 0
+
+    def add(self, row: dict) -> bool:
+        """False — очередь переполнена (БД недоступна), сообщение не принято."""
+        if len(self._pending) >= self.max_pending:
+            return False
+        self._pending[row["id"]] = row
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    async def update(self, message_id: str, changes: dict) -> bool:
+        """
+        Применяет изменения к ещё не записанному сообщению.
+        False — сообщение уже в БД, обновлять нужно там.
+        """
+        row = self._pending.get(message_id)
+        if row is not None:
+            row.update(changes)
+            return True
+        await self._wait_in_flight(message_id)
+        return False
+
+    async def discard(self, message_id: str) -> bool:
+        """Убирает ещё не записанное сообщение. False — оно уже в БД."""
+        if self._pending.pop(message_id, None) is not None:
+            return True
+        await self._wait_in_flight(message_id)
+        return False
+
+    def get(self, message_id: str) -> Optional[dict]:
+        return self._pending.get(message_id) or self._in_flight.get(message_id)
+
+    async def _wait_in_flight(self, message_id: str) -> None:
+        # Не даём UPDATE/DELETE обогнать INSERT той же строки
+        while message_id in self._in_flight:
+            await self._flushed.wait()
+
+    async def flush(self) -> None:
+        while self._pending:
+            batch = dict(list(self._pending.items())[:self.batch_size])
+            for message_id in batch:
+                del self._pending[message_id]
+            self._in_flight = batch
+            self._flushed.clear()
+            try:
+                await self._insert(list(batch.values()))
+            finally:
+                # После ошибки или отмены здесь остаются незаписанные строки
+                # пачки — в начало очереди, повторим позже
+                if self._in_flight:
+                    self._pending = {**self._in_flight, **self._pending}
+                self._in_flight = {}
+                self._flushed.set()
+
+    async def _insert(self, rows: list[dict]) -> None:
+        try:
+            # ignore_duplicates: повтор после обрыва, когда вставка всё же прошла
+            await db.table("messages") \
+                .upsert(rows, ignore_duplicates=True, returning=ReturnMethod.minimal) \
+                .execute()
+        except Exception as e:
+            if is_transient(e):
+                raise
+            if len(rows) == 1:
+                self._dead_letter(rows[0], e)
+                return
+            middle = len(rows) // 2
+            await self._insert(rows[:middle])
+            await self._insert(rows[middle:])
+            return
+        self.batches += 1
+        self.written += len(rows)
+        for row in rows:
+            self._in_flight.pop(row["id"], None)
+
+    def _dead_letter(self, row: dict, error: Exception) -> None:
+        logger.error("message %s rejected by database: %s", row["id"], error)
+        self._in_flight.pop(row["id"], None)
+        self.dead_letters.append((row, str(error)))
+        self.dead_lettered += 1
+        # Подписчики уже получили message.created — сообщение пропадает из канала
+        channel_events.publish(row["channel_id"], {"type": "message.deleted", "message_id": row["id"]})
+
+    async def run(self) -> None:
+        while not self._closing:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("messages flush failed")
+                if not self._closing:
+                    await asyncio.sleep(RETRY_DELAY)
+
+    async def start(self) -> None:
+        self._closing = False
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Дожидается текущей записи и записывает остаток очереди."""
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "written": self.written,
+            "dead_lettered": self.dead_lettered,
+        }
+
+
+# События каналов для WebSocket-подписчиков: тема — id текстового канала
+channel_events = Broadcaster(queue_size=setting_int("CHAT_QUEUE_SIZE", 256))
+
+_writer: Optional[MessageWriter] = None
+
+
+def get_writer() -> MessageWriter:
+    global _writer
+    if _writer is None:
+        _writer = MessageWriter()
+    return _writer
+
+
+async def start_message_writer() -> None:
+    await get_writer().start()
+
+
+async def stop_message_writer() -> None:
+    await get_writer().stop()
+
+
+def message_writer_stats() -> dict:
+    return get_writer().stats()
@@ -1,30 +1,16 @@
-from fastapi import APIRouter, UploadFile, HTTPException, Depends, Request
-from ..database import supabase
-from ..schemas import Server, ServerUpdate, ServerMember, TextChannel, TextChannelCreate
-from uuid import UUID
-from typing import List
-import os
-import cloudinary
-import cloudinary.uploader
-from cloudinary.utils import cloudinary_url
-from dotenv import load_dotenv
-
-load_dotenv()
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET"),
-    secure=True
-)
-
-async def get_current_user(request: Request):
-    token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    
-    try:
-        user = supabase.auth.get_user(token)
-        return user
-    except Exception as e:
-        raise HTTPException(status_code=401, detail="Invalid token")
+from fastapi import APIRouter, UploadFile, HTTPException, Depends, Request, Query, WebSocket, WebSocketDisconnect
+from core.db import db
+from core.auth import get_current_user, authenticate_websocket
+from core.broadcast import receive_object
+from core.profiles import get_profile_cache, project
+from ..messages import channel_events, get_writer
+from ..schemas import Server, ServerUpdate, ServerMember, TextChannel, TextChannelCreate, MessageCreate, MessageUpdate
+from uuid import UUID, uuid4
+from typing import List, Optional
+from datetime import datetime, timezone
+import asyncio
+import base64
+import time
 
 router = APIRouter(prefix="/chat")
 
@@ -35,7 +21,7 @@ async def get_chat(
     user = Depends(get_current_user)
 ):
     try:
-        chat = supabase.table("text_channels") \
+        chat = await db.table("text_channels") \
             .select("*") \
             .eq("id", chat_id) \
             .eq("server_id", server_id.server_id) \
@@ -51,4 +37,236 @@ async def get_chat(
         return chat.data
         
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Кэш прав доступа к каналу: (user_id, chat_id) -> (истекает, server_id),
+# чтобы отправка сообщения не стоила двух запросов к БД
+ACCESS_TTL = 60
+ACCESS_CACHE_SIZE = 10000
+_channel_access: dict[tuple[str, str], tuple[float, str]] = {}
+
+async def require_channel_access(chat_id: str, user_id: str) -> str:
+    cached = _channel_access.get((user_id, chat_id))
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    channel = await db.table("text_channels") \
+        .select("server_id") \
+        .eq("id", chat_id) \
+        .maybe_single() \
+        .execute()
+    if not channel or not channel.data:
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+    server_id = channel.data["server_id"]
+    member = await db.table("server_members") \
+        .select("role") \
+        .eq("server_id", server_id) \
+        .eq("user_id", user_id) \
+        .maybe_single() \
+        .execute()
+    if not member or not member.data:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    if len(_channel_access) >= ACCESS_CACHE_SIZE:
+        _channel_access.pop(next(iter(_channel_access)))
+    _channel_access[(user_id, chat_id)] = (time.monotonic() + ACCESS_TTL, server_id)
+    return server_id
+
+def utcnow() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+def check_content(content: str) -> None:
+    if not content.strip():
+        raise HTTPException(status_code=400, detail="Empty message")
+    # Postgres не хранит \x00 в text: такая строка не запишется никогда
+    if "\x00" in content:
+        raise HTTPException(status_code=400, detail="Invalid characters in message")
+
+@router.post("/{chat_id}/messages")
+async def send_message(chat_id: str, data: MessageCreate, user=Depends(get_current_user)):
+    check_content(data.content)
+    await require_channel_access(chat_id, user.user.id)
+
+    message = {
+        "id": str(uuid4()),
+        "channel_id": chat_id,
+        "author_id": user.user.id,
+        "content": data.content,
+        "created_at": utcnow(),
+        "edited_at": None,
+    }
+    # В БД сообщение попадёт со следующей пачкой, подписчикам уходит сразу
+    if not get_writer().add(message):
+        raise HTTPException(status_code=503, detail="Messages are temporarily not accepted")
+    channel_events.publish(chat_id, {"type": "message.created", "message": message})
+    return message
+
+def encode_cursor(message: dict) -> str:
+    raw = f"{message['created_at']}|{message['id']}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, message_id = raw.split("|", 1)
+        datetime.fromisoformat(created_at)
+        UUID(message_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, message_id
+
+@router.get("/{chat_id}/messages")
+async def get_messages(
+    chat_id: str,
+    before: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=100),
+    user=Depends(get_current_user),
+):
+    """
+    История канала от новых к старым. Пагинация по ключу (created_at, id):
+    next_cursor из ответа передаётся в before, чтобы получить более старую
+    страницу. Глубина прокрутки не влияет на стоимость запроса.
+    """
+    await require_channel_access(chat_id, user.user.id)
+
+    query = db.table("messages") \
+        .select("id, channel_id, author_id, content, created_at, edited_at") \
+        .eq("channel_id", chat_id)
+    if before:
+        created_at, message_id = decode_cursor(before)
+        # lte даёт планировщику границу для range scan по индексу,
+        # or_ отсекает строки с тем же created_at, но большим id
+        query = query.lte("created_at", created_at).or_(
+            f'created_at.lt."{created_at}",'
+            f'and(created_at.eq."{created_at}",id.lt.{message_id})'
+        )
+
+    try:
+        # Берём на одну строку больше, чтобы узнать, есть ли следующая страница
+        response = await query \
+            .order("created_at", desc=True) \
+            .order("id", desc=True) \
+            .limit(limit + 1) \
+            .execute()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    messages = response.data[:limit]
+    has_more = len(response.data) > limit
+
+    # Авторы страницы — из общего кэша профилей, промахи одним запросом in_
+    profiles = await get_profile_cache().get_many(m["author_id"] for m in messages)
+    authors = {
+        user_id: project(profile, ("user_id", "username", "avatar_url"))
+        for user_id, profile in profiles.items()
+    }
+
+    return {
+        "messages": messages,
+        "authors": authors,
+        "next_cursor": encode_cursor(messages[-1]) if has_more else None,
+    }
+
+@router.patch("/{chat_id}/messages/{message_id}")
+async def edit_message(chat_id: str, message_id: str, data: MessageUpdate, user=Depends(get_current_user)):
+    check_content(data.content)
+    await require_channel_access(chat_id, user.user.id)
+
+    changes = {"content": data.content, "edited_at": utcnow()}
+    writer = get_writer()
+    pending = writer.get(message_id)
+    if pending is not None:
+        # Как и запрос к БД ниже: сообщение ищется только в этом канале
+        if pending["channel_id"] != chat_id:
+            raise HTTPException(status_code=404, detail="Message not found")
+        if pending["author_id"] != user.user.id:
+            raise HTTPException(status_code=403, detail="Access denied")
+
+    if await writer.update(message_id, changes):
+        message = writer.get(message_id)
+    else:
+        try:
+            result = await db.table("messages") \
+                .update(changes) \
+                .eq("id", message_id) \
+                .eq("channel_id", chat_id) \
+                .eq("author_id", user.user.id) \
+                .execute()
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not result.data:
+            raise HTTPException(status_code=404, detail="Message not found")
+        message = result.data[0]
+
+    channel_events.publish(chat_id, {"type": "message.updated", "message": message})
+    return message
+
+@router.delete("/{chat_id}/messages/{message_id}")
+async def delete_message(chat_id: str, message_id: str, user=Depends(get_current_user)):
+    await require_channel_access(chat_id, user.user.id)
+
+    writer = get_writer()
+    pending = writer.get(message_id)
+    if pending is not None:
+        # Как и запрос к БД ниже: сообщение ищется только в этом канале
+        if pending["channel_id"] != chat_id:
+            raise HTTPException(status_code=404, detail="Message not found")
+        if pending["author_id"] != user.user.id:
+            raise HTTPException(status_code=403, detail="Access denied")
+
+    if not await writer.discard(message_id):
+        try:
+            result = await db.table("messages") \
+                .delete() \
+                .eq("id", message_id) \
+                .eq("channel_id", chat_id) \
+                .eq("author_id", user.user.id) \
+                .execute()
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not result.data:
+            raise HTTPException(status_code=404, detail="Message not found")
+
+    channel_events.publish(chat_id, {"type": "message.deleted", "message_id": message_id})
+    return {"message": "Message deleted"}
+
+@router.websocket("/{chat_id}/ws")
+async def chat_socket(websocket: WebSocket, chat_id: str):
+    """
+    Подписка на события канала: message.created, message.updated, message.deleted.
+    Отправка сообщений — через POST /chat/{chat_id}/messages.
+    """
+    user = await authenticate_websocket(websocket)
+    if user is None:
+        await websocket.close(code=4401, reason="Invalid token")
+        return
+    try:
+        await require_channel_access(chat_id, user.user.id)
+    except HTTPException as e:
+        await websocket.close(code=4000 + e.status_code, reason=e.detail)
+        return
+
+    await websocket.accept()
+    events = channel_events.subscribe(chat_id)
+
+    async def push_events():
+        while True:
+            event = await events.get()
+            if event is None:
+                # Клиент не успевал читать — пусть переподключится и догрузит историю
+                await websocket.close(code=4408, reason="Too slow")
+                return
+            await websocket.send_json(event)
+
+    pusher = asyncio.create_task(push_events())
+    try:
+        while True:
+            message = await receive_object(websocket)
+            if message is not None and message.get("type") == "ping":
+                await websocket.send_json({"type": "pong"})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        pusher.cancel()
+        channel_events.unsubscribe(chat_id, events)
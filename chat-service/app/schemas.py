@@ -21,7 +21,7 @@ class TextChannel(BaseModel):
     server_id: str
     name: str
     description: str | None
-    position: str
+    position: float
     is_private: bool
     created_at: str
     updated_at: str
@@ -31,4 +31,9 @@ class TextChannelCreate(BaseModel):
     is_private: bool = False
 
 class Server(BaseModel):
-    server_id: str
\ No newline at end of file
+    server_id: str
+class MessageCreate(BaseModel):
+    content: str
+
+class MessageUpdate(BaseModel):
+    content: str
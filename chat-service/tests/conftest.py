@@ -0,0 +1,15 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+SERVICE = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(SERVICE.parent), str(SERVICE)]
+# У каждого сервиса свой пакет app: тесты другого сервиса могли уже импортировать свой
+for name in [name for name in sys.modules if name == "app" or name.startswith("app.")]:
+    del sys.modules[name]
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
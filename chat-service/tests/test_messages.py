@@ -0,0 +1,159 @@
+import asyncio
+import uuid
+
+import pytest
+from postgrest.exceptions import APIError
+
+from app import messages
+from app.messages import MessageWriter
+
+pytestmark = pytest.mark.anyio
+
+CHANNEL = "channel"
+
+
+class FakeMessages:
+    """Таблица messages: upsert пачки строк, ошибки задаются тестом."""
+
+    def __init__(self):
+        self.rows: dict[str, dict] = {}
+        self.batches: list[list[str]] = []
+        # Следующие вызовы upsert падают с этими ошибками
+        self.errors: list[Exception] = []
+        # Строки, которые БД отвергает (нарушено ограничение)
+        self.rejected: set[str] = set()
+        self.delay = 0.0
+
+    def table(self, name):
+        assert name == "messages"
+        return self
+
+    def upsert(self, rows, **kwargs):
+        self._rows = list(rows)
+        return self
+
+    async def execute(self):
+        rows = self._rows
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        if any(row["id"] in self.rejected for row in rows):
+            raise APIError({"code": "23503", "message": "channel does not exist"})
+        self.batches.append([row["id"] for row in rows])
+        for row in rows:
+            self.rows.setdefault(row["id"], row)
+
+
+@pytest.fixture
+def table(monkeypatch):
+    table = FakeMessages()
+    monkeypatch.setattr(messages, "db", table)
+    return table
+
+
+def message(content: str = "hi") -> dict:
+    return {"id": str(uuid.uuid4()), "channel_id": CHANNEL, "author_id": "alice", "content": content}
+
+
+async def test_flush_writes_in_batches(table):
+    writer = MessageWriter(batch_size=2)
+    rows = [message(str(i)) for i in range(5)]
+    for row in rows:
+        assert writer.add(row)
+
+    await writer.flush()
+
+    assert [len(batch) for batch in table.batches] == [2, 2, 1]
+    assert list(table.rows) == [row["id"] for row in rows]
+    assert writer.stats()["pending"] == 0
+    assert writer.written == 5
+
+
+async def test_pending_message_is_edited_before_insert(table):
+    writer = MessageWriter()
+    row = message()
+    writer.add(row)
+
+    assert await writer.update(row["id"], {"content": "edited"})
+    await writer.flush()
+
+    assert table.rows[row["id"]]["content"] == "edited"
+
+
+async def test_transient_error_keeps_batch_queued(table):
+    writer = MessageWriter(batch_size=2)
+    first, second, third = message("1"), message("2"), message("3")
+    for row in (first, second, third):
+        writer.add(row)
+    table.errors.append(APIError({"code": "08006", "message": "connection failure"}))
+
+    with pytest.raises(APIError):
+        await writer.flush()
+    # Пачка вернулась в начало очереди в прежнем порядке
+    assert list(writer._pending) == [first["id"], second["id"], third["id"]]
+
+    await writer.flush()
+    assert list(table.rows) == [first["id"], second["id"], third["id"]]
+
+
+async def test_rejected_row_is_dead_lettered_by_split(table):
+    writer = MessageWriter(batch_size=8)
+    rows = [message(str(i)) for i in range(8)]
+    for row in rows:
+        writer.add(row)
+    table.rejected.add(rows[5]["id"])
+    events = messages.channel_events.subscribe(CHANNEL)
+    try:
+        await writer.flush()
+    finally:
+        messages.channel_events.unsubscribe(CHANNEL, events)
+
+    assert set(table.rows) == {row["id"] for row in rows} - {rows[5]["id"]}
+    assert writer.dead_lettered == 1
+    assert writer.dead_letters[0][0] is rows[5]
+    assert events.get_nowait() == {"type": "message.deleted", "message_id": rows[5]["id"]}
+    assert writer.stats()["pending"] == 0
+
+
+async def test_full_queue_rejects_message(table):
+    writer = MessageWriter(max_pending=2)
+    assert writer.add(message())
+    assert writer.add(message())
+    assert not writer.add(message())
+
+
+async def test_stop_waits_for_insert_in_flight(table):
+    table.delay = 0.05
+    writer = MessageWriter(batch_size=2, flush_interval=0.01)
+    await writer.start()
+    rows = [message(str(i)) for i in range(3)]
+    for row in rows:
+        writer.add(row)
+    # Запись первой пачки уже идёт
+    while not writer._in_flight:
+        await asyncio.sleep(0.001)
+
+    await writer.stop()
+
+    assert set(table.rows) == {row["id"] for row in rows}
+    assert not writer._pending and not writer._in_flight
+
+
+async def test_cancelled_insert_returns_rows_to_queue(table):
+    table.delay = 1.0
+    writer = MessageWriter()
+    row = message()
+    writer.add(row)
+    task = asyncio.create_task(writer.flush())
+    while not writer._in_flight:
+        await asyncio.sleep(0.001)
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert list(writer._pending) == [row["id"]]
+    table.delay = 0
+    await writer.flush()
+    assert list(table.rows) == [row["id"]]
@@ -0,0 +1 @@
+"""Общий код для всех сервисов (auth, server, friends, chat)."""
@@ -0,0 +1,353 @@
+"""
+Проверка Supabase JWT локально, без запроса к Supabase на каждый вызов API.
+
+Токен проверяется по подписи и сроку действия:
+  - HS256 — по секрету проекта (SUPABASE_JWT_SECRET);
+  - RS256/ES256 — по ключам из JWKS (SUPABASE_JWKS_URL, по умолчанию
+    {SUPABASE_URL}/auth/v1/.well-known/jwks.json, нужен пакет cryptography).
+
+Проверенные токены кладутся в ограниченный кэш, запись живёт не дольше,
+чем сам токен. Если локальная проверка невозможна и AUTH_REMOTE_FALLBACK=1,
+токен проверяется через supabase.auth.get_user как раньше.
+
+За шлюзом (gateway-service) токен проверяется один раз: шлюз передаёт
+сервису заголовок X-Internal-Identity, подписанный HMAC общим секретом
+INTERNAL_IDENTITY_SECRET. Сервис с тем же секретом доверяет такому
+заголовку без проверки токена; без секрета заголовок игнорируется.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+import jwt
+from fastapi import HTTPException, Request, WebSocket
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import HTTPConnection
+
+from .config import setting, setting_bool, setting_float, setting_int
+
+JWT_AUDIENCE = "authenticated"
+IDENTITY_HEADER = "X-Internal-Identity"
+# Подпись шлюза старше этого считается недействительной (защита от повтора)
+IDENTITY_MAX_AGE = setting_float("INTERNAL_IDENTITY_MAX_AGE", 60)
+HMAC_ALGORITHMS = ("HS256",)
+JWKS_ALGORITHMS = ("RS256", "ES256")
+
+
+@dataclass(frozen=True)
+class VerifiedUser:
+    id: str
+    email: Optional[str] = None
+    role: Optional[str] = None
+    expires_at: int = 0
+    user_metadata: dict = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class Identity:
+    # Та же форма, что у ответа supabase.auth.get_user: обработчики
+    # по-прежнему обращаются к user.user.id
+    user: VerifiedUser
+
+
+class IdentityCache:
+    """LRU-кэш проверенных токенов с учётом срока действия каждого токена."""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, tuple[float, Identity]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        # Храним не сам токен (он может быть ~1 КБ), а его короткий хэш
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, token: str) -> Optional[Identity]:
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires, identity = entry
+        if expires <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return identity
+
+    def peek(self, token: str) -> Optional[Identity]:
+        """
+        Как get, но без счётчиков и порядка LRU: для middleware, которые
+        смотрят в кэш до обработчика — иначе каждый запрос считался бы дважды.
+        """
+        entry = self._entries.get(self._key(token))
+        if entry is None or entry[0] <= time.time():
+            return None
+        return entry[1]
+
+    def put(self, token: str, identity: Identity) -> None:
+        expires = time.time() + self.ttl
+        if identity.user.expires_at:
+            expires = min(expires, identity.user.expires_at)
+
+        key = self._key(token)
+        self._entries[key] = (expires, identity)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class TokenVerifier:
+    def __init__(
+        self,
+        jwt_secret: Optional[str] = None,
+        jwks_url: Optional[str] = None,
+        remote_fallback: bool = False,
+        cache: Optional[IdentityCache] = None,
+        leeway: float = 0,
+    ):
+        self.jwt_secret = jwt_secret
+        self.jwks_url = jwks_url
+        self.remote_fallback = remote_fallback
+        self.cache = cache or IdentityCache()
+        self.leeway = leeway
+        self.remote_checks = 0
+        self.rejected = 0
+        self._jwks_client = None
+
+    @classmethod
+    def from_env(cls) -> "TokenVerifier":
+        supabase_url = setting("SUPABASE_URL")
+        jwks_url = setting("SUPABASE_JWKS_URL")
+        if not jwks_url and supabase_url:
+            jwks_url = f"{supabase_url.rstrip('/')}/auth/v1/.well-known/jwks.json"
+
+        return cls(
+            jwt_secret=setting("SUPABASE_JWT_SECRET"),
+            jwks_url=jwks_url,
+            remote_fallback=setting_bool("AUTH_REMOTE_FALLBACK"),
+            cache=IdentityCache(
+                max_size=setting_int("AUTH_CACHE_SIZE", 10000),
+                ttl=setting_float("AUTH_CACHE_TTL", 300),
+            ),
+        )
+
+    def _decode_local(self, token: str) -> dict:
+        """Проверяет подпись и exp. Бросает jwt.PyJWTError при любой ошибке."""
+        header = jwt.get_unverified_header(token)
+        algorithm = header.get("alg")
+        options = {"require": ["exp", "sub"]}
+
+        if algorithm in HMAC_ALGORITHMS:
+            if not self.jwt_secret:
+                raise jwt.InvalidKeyError("SUPABASE_JWT_SECRET is not configured")
+            key = self.jwt_secret
+        elif algorithm in JWKS_ALGORITHMS:
+            if not self.jwks_url:
+                raise jwt.InvalidKeyError("JWKS url is not configured")
+            if self._jwks_client is None:
+                self._jwks_client = jwt.PyJWKClient(self.jwks_url, cache_keys=True)
+            key = self._jwks_client.get_signing_key_from_jwt(token).key
+        else:
+            raise jwt.InvalidAlgorithmError(f"Unsupported algorithm: {algorithm}")
+
+        return jwt.decode(
+            token,
+            key,
+            algorithms=[algorithm],
+            audience=JWT_AUDIENCE,
+            options=options,
+            leeway=self.leeway,
+        )
+
+    async def _verify_remote(self, token: str) -> Identity:
+        from .db import supabase_auth
+
+        response = await supabase_auth.get_user(token)
+        claims = jwt.decode(token, options={"verify_signature": False})
+        return Identity(user=VerifiedUser(
+            id=response.user.id,
+            email=response.user.email,
+            role=response.user.role,
+            expires_at=int(claims.get("exp", 0)),
+            user_metadata=response.user.user_metadata or {},
+        ))
+
+    async def verify(self, token: str) -> Identity:
+        identity = self.cache.get(token)
+        if identity is not None:
+            return identity
+
+        try:
+            if self.jwt_secret and jwt.get_unverified_header(token).get("alg") in HMAC_ALGORITHMS:
+                claims = self._decode_local(token)
+            else:
+                # Получение JWKS — блокирующий HTTP-запрос, уводим из event loop
+                claims = await run_in_threadpool(self._decode_local, token)
+
+            identity = Identity(user=VerifiedUser(
+                id=claims["sub"],
+                email=claims.get("email"),
+                role=claims.get("role"),
+                expires_at=int(claims["exp"]),
+                user_metadata=claims.get("user_metadata") or {},
+            ))
+        except (jwt.ExpiredSignatureError, jwt.InvalidSignatureError, jwt.InvalidAudienceError):
+            # Токен точно невалиден — удалённая проверка не поможет
+            self.rejected += 1
+            raise HTTPException(status_code=401, detail="Invalid token")
+        except jwt.PyJWTError:
+            if not self.remote_fallback:
+                self.rejected += 1
+                raise HTTPException(status_code=401, detail="Invalid token")
+            try:
+                self.remote_checks += 1
+                identity = await self._verify_remote(token)
+            except Exception:
+                self.rejected += 1
+                raise HTTPException(status_code=401, detail="Invalid token")
+
+        self.cache.put(token, identity)
+        return identity
+
+    def stats(self) -> dict:
+        return {
+            **self.cache.stats(),
+            "remote_checks": self.remote_checks,
+            "rejected": self.rejected,
+        }
+
+
+verifier = TokenVerifier.from_env()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def sign_identity(identity: Identity, secret: str) -> str:
+    """Значение X-Internal-Identity: base64(json).base64(hmac-sha256)."""
+    user = identity.user
+    payload = _b64encode(json.dumps({
+        "sub": user.id,
+        "email": user.email,
+        "role": user.role,
+        "exp": user.expires_at,
+        "user_metadata": user.user_metadata,
+        "iat": int(time.time()),
+    }, separators=(",", ":")).encode())
+    signature = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest()
+    return f"{payload}.{_b64encode(signature)}"
+
+
+def verify_identity(value: str, secret: str, max_age: float = IDENTITY_MAX_AGE) -> Optional[Identity]:
+    """Identity из заголовка шлюза или None, если подпись, срок или формат не подходят."""
+    try:
+        payload, signature = value.split(".", 1)
+        expected = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+
+    now = time.time()
+    if now - claims["iat"] > max_age or (claims["exp"] and claims["exp"] <= now):
+        return None
+    return Identity(user=VerifiedUser(
+        id=claims["sub"],
+        email=claims.get("email"),
+        role=claims.get("role"),
+        expires_at=int(claims["exp"]),
+        user_metadata=claims.get("user_metadata") or {},
+    ))
+
+
+_identity_secret = setting("INTERNAL_IDENTITY_SECRET")
+_trusted = 0
+_SCOPE_KEY = "core.auth.trusted_identity"
+
+
+def trusted_identity(connection: HTTPConnection) -> Optional[Identity]:
+    global _trusted
+    if not _identity_secret:
+        return None
+    # Middleware (ETag, лимиты) и обработчик проверяют подпись один раз на запрос
+    if _SCOPE_KEY in connection.scope:
+        return connection.scope[_SCOPE_KEY]
+    value = connection.headers.get(IDENTITY_HEADER)
+    identity = verify_identity(value, _identity_secret) if value else None
+    if identity is not None:
+        _trusted += 1
+    connection.scope[_SCOPE_KEY] = identity
+    return identity
+
+
+def extract_token(request: HTTPConnection) -> str:
+    return request.headers.get("Authorization", "").replace("Bearer ", "")
+
+
+async def get_current_user(request: Request) -> Identity:
+    identity = trusted_identity(request)
+    if identity is not None:
+        return identity
+
+    token = extract_token(request)
+    if not token:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return await verifier.verify(token)
+
+
+async def authenticate_websocket(websocket: WebSocket) -> Optional[Identity]:
+    """
+    Браузер не может передать заголовок Authorization при открытии WebSocket,
+    поэтому токен принимается также из параметра ?token=.
+    Возвращает None, если токен невалиден.
+    """
+    identity = trusted_identity(websocket)
+    if identity is not None:
+        return identity
+
+    token = websocket.query_params.get("token") or extract_token(websocket)
+    if not token:
+        return None
+    try:
+        return await verifier.verify(token)
+    except HTTPException:
+        return None
+
+
+def auth_cache_stats() -> dict:
+    return {**verifier.stats(), "trusted_identities": _trusted}
@@ -0,0 +1,66 @@
+import asyncio
+import json
+from collections import defaultdict
+from typing import Optional
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+
+async def receive_object(websocket: WebSocket) -> Optional[dict]:
+    """
+    Следующее сообщение клиента как JSON-объект. None — кадр не текстовый или
+    не объект JSON: такие кадры пропускаются, а не роняют соединение с 1011.
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    text = message.get("text")
+    if text is None:
+        return None
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+class Broadcaster:
+    """
+    Рассылка событий подписчикам темы (сервера, канала) внутри процесса.
+
+    У каждого подписчика своя ограниченная очередь: если клиент не успевает
+    читать и очередь переполнилась, подписка закрывается, а не тормозит
+    рассылку остальным. Отключённый подписчик получает None последним
+    элементом очереди.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers: dict[str, set[asyncio.Queue]] = defaultdict(set)
+        self.dropped = 0
+
+    def subscribe(self, topic: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[topic].add(queue)
+        return queue
+
+    def unsubscribe(self, topic: str, queue: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(topic)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[topic]
+
+    def subscribers(self, topic: str) -> int:
+        return len(self._subscribers.get(topic, ()))
+
+    def publish(self, topic: str, event: dict) -> None:
+        for queue in list(self._subscribers.get(topic, ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.unsubscribe(topic, queue)
+                self.dropped += 1
+                queue.get_nowait()
+                queue.put_nowait(None)
@@ -0,0 +1,54 @@
+"""
+Клиенты, которые нужны не каждому запросу: SQLAlchemy и Cloudinary.
+
+Всё создаётся при первом обращении, а не при импорте, и закрывается
+в lifespan приложения (см. core.lifespan).
+"""
+from .config import setting
+
+_engine = None
+_session_factory = None
+_cloudinary_configured = False
+
+
+def get_engine():
+    """SQLAlchemy engine для прямого доступа к Postgres (DATABASE_URL)."""
+    global _engine
+    if _engine is None:
+        from sqlalchemy import create_engine
+
+        _engine = create_engine(setting("DATABASE_URL"), pool_pre_ping=True)
+    return _engine
+
+
+def get_session():
+    global _session_factory
+    if _session_factory is None:
+        from sqlalchemy.orm import sessionmaker
+
+        _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+    return _session_factory()
+
+
+def get_cloudinary_uploader():
+    """Модуль cloudinary.uploader с уже применённой конфигурацией."""
+    global _cloudinary_configured
+    import cloudinary
+    import cloudinary.uploader
+
+    if not _cloudinary_configured:
+        cloudinary.config(
+            cloud_name=setting("CLOUDINARY_CLOUD_NAME"),
+            api_key=setting("CLOUDINARY_API_KEY"),
+            api_secret=setting("CLOUDINARY_API_SECRET"),
+            secure=True
+        )
+        _cloudinary_configured = True
+    return cloudinary.uploader
+
+
+def dispose_engine() -> None:
+    global _engine, _session_factory
+    if _engine is not None:
+        _engine.dispose()
+    _engine = _session_factory = None
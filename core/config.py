@@ -0,0 +1,23 @@
+"""Настройки сервисов из переменных окружения (.env читается один раз)."""
+import os
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def setting(name: str, default: Optional[str] = None) -> Optional[str]:
+    return os.getenv(name, default)
+
+
+def setting_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+def setting_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+def setting_bool(name: str, default: bool = False) -> bool:
+    return os.getenv(name, "1" if default else "0").lower() in ("1", "true", "yes")
@@ -0,0 +1,133 @@
+"""
+Асинхронный доступ к Supabase (PostgREST и Auth).
+
+Все запросы процесса идут через один httpx.AsyncClient с пулом keep-alive
+соединений и HTTP/2, поэтому .execute() не блокирует event loop и
+параллельные запросы действительно выполняются одновременно. Время
+каждого запроса попадает в supabase_request_duration_seconds (core.metrics):
+
+
+    from core.db import db
+
+    profile = await db.table("profiles") \\
+        .select("*") \\
+        .eq("user_id", user_id) \\
+        .single() \\
+        .execute()
+"""
+import time
+from typing import TYPE_CHECKING, Optional
+
+import httpx
+from postgrest import AsyncPostgrestClient
+from postgrest.constants import DEFAULT_POSTGREST_CLIENT_HEADERS
+
+from .config import setting, setting_float, setting_int
+from .metrics import observe_supabase
+
+if TYPE_CHECKING:
+    from gotrue import AsyncGoTrueClient
+
+_http_client: Optional[httpx.AsyncClient] = None
+_postgrest: Optional[AsyncPostgrestClient] = None
+_auth: Optional["AsyncGoTrueClient"] = None
+
+
+def _supabase_settings() -> tuple[str, str]:
+    return (setting("SUPABASE_URL") or "").rstrip("/"), setting("SUPABASE_KEY") or ""
+
+
+class MeteredTransport(httpx.AsyncHTTPTransport):
+    """Замеряет запрос до получения заголовков ответа: чтение тела — уже работа вызывающего."""
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = await super().handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            observe_supabase(request.method, request.url.path, status, time.perf_counter() - started)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Общий пул соединений к Supabase для PostgREST и Auth."""
+    global _http_client
+    if _http_client is None:
+        url, key = _supabase_settings()
+        _http_client = httpx.AsyncClient(
+            base_url=f"{url}/rest/v1",
+            headers={
+                **DEFAULT_POSTGREST_CLIENT_HEADERS,
+                "apikey": key,
+                "Authorization": f"Bearer {key}",
+                "Accept-Profile": "public",
+                "Content-Profile": "public",
+            },
+            follow_redirects=True,
+            timeout=httpx.Timeout(setting_float("DB_TIMEOUT", 10)),
+            # Пул и HTTP/2 задаются у транспорта: клиент с явным transport их не применяет
+            transport=MeteredTransport(
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=setting_int("DB_POOL_SIZE", 100),
+                    max_keepalive_connections=setting_int("DB_POOL_KEEPALIVE", 20),
+                    keepalive_expiry=30,
+                ),
+            ),
+        )
+    return _http_client
+
+
+class PooledPostgrestClient(AsyncPostgrestClient):
+    """AsyncPostgrestClient, который не создаёт свою сессию, а берёт общий пул."""
+
+    def create_session(self, base_url, headers, timeout, verify=True, proxy=None):
+        return get_http_client()
+
+
+def get_db() -> AsyncPostgrestClient:
+    global _postgrest
+    if _postgrest is None:
+        url, _ = _supabase_settings()
+        _postgrest = PooledPostgrestClient(f"{url}/rest/v1")
+    return _postgrest
+
+
+def get_auth() -> "AsyncGoTrueClient":
+    global _auth
+    if _auth is None:
+        # gotrue нужен только auth-service, остальным не тратим время на импорт
+        from gotrue import AsyncGoTrueClient, AsyncMemoryStorage
+
+        url, key = _supabase_settings()
+        _auth = AsyncGoTrueClient(
+            url=f"{url}/auth/v1",
+            headers={"apikey": key, "Authorization": f"Bearer {key}"},
+            http_client=get_http_client(),
+            auto_refresh_token=False,
+            storage=AsyncMemoryStorage(),
+        )
+    return _auth
+
+
+async def close_db() -> None:
+    global _http_client, _postgrest, _auth
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = _postgrest = _auth = None
+
+
+class _Lazy:
+    """Позволяет импортировать клиента на уровне модуля, а создавать при первом запросе."""
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+
+db: AsyncPostgrestClient = _Lazy(get_db)
+supabase_auth: "AsyncGoTrueClient" = _Lazy(get_auth)
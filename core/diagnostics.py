@@ -0,0 +1,36 @@
+"""
+Служебные счётчики кэшей и загрузок процесса.
+
+Маршрут /internal/... не проксируется шлюзом, он доступен только внутри
+сети docker-compose. Сервисы добавляют свои кэши через register_stats.
+Источники читаются на каждый сбор /metrics в цикле событий, поэтому
+возвращают только готовые счётчики и размеры, без обхода кэшей.
+"""
+from typing import Callable, Optional
+
+from fastapi import APIRouter
+
+from .auth import auth_cache_stats
+from .etag import etag_stats
+from .profiles import profile_cache_stats
+from .ratelimit import rate_limit_stats
+from .uploads import upload_stats
+
+router = APIRouter(prefix="/internal")
+
+_sources: dict[str, Callable[[], Optional[dict]]] = {
+    "auth": auth_cache_stats,
+    "etag": etag_stats,
+    "profiles": profile_cache_stats,
+    "rate_limit": rate_limit_stats,
+    "uploads": upload_stats,
+}
+
+
+def register_stats(name: str, source: Callable[[], Optional[dict]]) -> None:
+    _sources[name] = source
+
+
+@router.get("/cache-stats")
+async def cache_stats():
+    return {name: source() for name, source in _sources.items()}
@@ -0,0 +1,228 @@
+"""
+ETag и условные GET (If-None-Match -> 304 без тела) для списков, которые
+клиенты опрашивают по таймеру.
+
+ETagMiddleware считает сильный ETag как хэш тела ответа: так он верен для
+любого обработчика, а клиент, у которого данные не изменились, получает 304
+вместо всего JSON.
+
+Для ресурсов, одинаковых для всех пользователей и меняющихся только через
+известные обработчики (каналы сервера), есть быстрый путь: счётчик версии
+ресурса, который обработчики записи увеличивают через bump_version (и через
+core.pubsub в остальных репликах). Пока версия не изменилась, совпавший
+If-None-Match отвечается 304 без вызова обработчика — без запроса к БД и
+сериализации. Запомненный ETag живёт не дольше ETAG_VERSION_TTL секунд,
+так что пропущенное событие не оставит клиента со старыми данными надолго.
+"""
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from starlette.requests import HTTPConnection
+
+from .auth import trusted_identity, verifier
+from .config import setting_float, setting_int
+from .pubsub import get_broker
+
+VERSIONS_CHANNEL = "etag.versions"
+VERSION_TTL = setting_float("ETAG_VERSION_TTL", 60)
+REMEMBERED_SIZE = setting_int("ETAG_REMEMBERED_SIZE", 10000)
+
+
+def _matches(if_none_match: bytes, etag: str) -> bool:
+    # Для If-None-Match сравнение слабое: W/"x" совпадает с "x"
+    for candidate in if_none_match.decode("latin-1").split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class ETagStats:
+    def __init__(self):
+        self.responses = 0
+        self.not_modified = 0
+        self.not_modified_versioned = 0
+        self.bytes_saved = 0
+
+    def stats(self) -> dict:
+        return {
+            "responses": self.responses,
+            "not_modified": self.not_modified,
+            "not_modified_versioned": self.not_modified_versioned,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+class ResourceVersions:
+    """Версии ресурсов и ETag последнего ответа по каждому пути с версией."""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._versions: dict[str, int] = {}
+        # путь -> (ресурс, версия на момент запроса, ETag, хранится до, размер тела)
+        self._remembered: "OrderedDict[str, tuple[str, int, str, float, int]]" = OrderedDict()
+
+    def version(self, resource: str) -> int:
+        return self._versions.get(resource, 0)
+
+    def bump(self, resource: str) -> None:
+        self._versions[resource] = self._versions.get(resource, 0) + 1
+
+    def remember(self, path: str, resource: str, version: int, etag: str, size: int) -> None:
+        self._remembered[path] = (resource, version, etag, time.monotonic() + self.ttl, size)
+        self._remembered.move_to_end(path)
+        while len(self._remembered) > self.max_size:
+            self._remembered.popitem(last=False)
+
+    def current(self, path: str) -> Optional[tuple[str, int]]:
+        """ETag и размер тела, если ресурс с тех пор не менялся."""
+        entry = self._remembered.get(path)
+        if entry is None:
+            return None
+        resource, version, etag, expires, size = entry
+        if expires <= time.monotonic() or self._versions.get(resource, 0) != version:
+            del self._remembered[path]
+            return None
+        return etag, size
+
+
+_stats = ETagStats()
+_versions: Optional[ResourceVersions] = None
+
+
+def get_resource_versions() -> ResourceVersions:
+    global _versions
+    if _versions is None:
+        _versions = ResourceVersions(max_size=REMEMBERED_SIZE, ttl=VERSION_TTL)
+        get_broker().subscribe(VERSIONS_CHANNEL, _on_bump)
+    return _versions
+
+
+async def _on_bump(message: dict) -> None:
+    if _versions is not None:
+        _versions.bump(message["resource"])
+
+
+async def bump_version(kind: str, key: str) -> None:
+    """Вызывать после записи, меняющей ресурс kind:key (например, каналы сервера)."""
+    resource = f"{kind}:{key}"
+    get_resource_versions().bump(resource)
+    await get_broker().publish(VERSIONS_CHANNEL, {"resource": resource})
+
+
+class ETagMiddleware:
+    """
+    paths — регулярные выражения путей, для которых GET получает ETag.
+    versioned — {вид ресурса: выражение пути с группой (?P<key>...)}: такие
+    пути отдают одно и то же всем пользователям и получают быстрый путь.
+    """
+
+    def __init__(self, app, paths: tuple[str, ...] = (), versioned: Optional[dict[str, str]] = None):
+        self.app = app
+        self.versioned = [(kind, re.compile(pattern)) for kind, pattern in (versioned or {}).items()]
+        patterns = [*paths, *(pattern for pattern in (versioned or {}).values())]
+        self.paths = re.compile("|".join(f"(?:{pattern})" for pattern in patterns)) if patterns else None
+
+    def _resource(self, path: str) -> Optional[str]:
+        for kind, pattern in self.versioned:
+            match = pattern.fullmatch(path)
+            if match:
+                return f"{kind}:{match.group('key')}"
+        return None
+
+    @staticmethod
+    def _authenticated(scope, headers: dict) -> bool:
+        # Обработчик не вызывается, поэтому пользователь должен быть уже
+        # проверен: подпись шлюза или токен в кэше проверенных токенов
+        if trusted_identity(HTTPConnection(scope)) is not None:
+            return True
+        token = headers.get(b"authorization", b"").decode("latin-1").replace("Bearer ", "")
+        return bool(token) and verifier.cache.peek(token) is not None
+
+    async def _not_modified(self, send, etag: str) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": 304,
+            "headers": [(b"etag", etag.encode()), (b"cache-control", b"private, no-cache")],
+        })
+        await send({"type": "http.response.body", "body": b""})
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or self.paths is None
+            or not self.paths.fullmatch(scope["path"])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        headers = dict(scope["headers"])
+        if_none_match = headers.get(b"if-none-match")
+        resource = self._resource(path)
+        version = 0
+        if resource is not None:
+            versions = get_resource_versions()
+            version = versions.version(resource)
+            current = versions.current(path)
+            if (
+                current is not None
+                and if_none_match is not None
+                and _matches(if_none_match, current[0])
+                and self._authenticated(scope, headers)
+            ):
+                _stats.not_modified_versioned += 1
+                _stats.bytes_saved += current[1]
+                await self._not_modified(send, current[0])
+                return
+
+        start = None
+        chunks = []
+
+        async def buffered_send(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                if message["status"] != 200:
+                    start = False
+                    await send(message)
+                    return
+                start = message
+                return
+            if start is False or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            body = b"".join(chunks)
+            etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+            _stats.responses += 1
+            if resource is not None:
+                get_resource_versions().remember(path, resource, version, etag, len(body))
+
+            if if_none_match is not None and _matches(if_none_match, etag):
+                _stats.not_modified += 1
+                _stats.bytes_saved += len(body)
+                await self._not_modified(send, etag)
+                return
+
+            response_headers = [
+                (name, value) for name, value in start["headers"]
+                if name.lower() not in (b"etag", b"cache-control")
+            ]
+            response_headers += [(b"etag", etag.encode()), (b"cache-control", b"private, no-cache")]
+            await send({**start, "headers": response_headers})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, buffered_send)
+
+
+def etag_stats() -> dict:
+    return _stats.stats()
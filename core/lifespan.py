@@ -0,0 +1,41 @@
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable
+
+from fastapi import FastAPI
+
+from .clients import dispose_engine
+from .db import close_db
+from .pubsub import close_broker
+from .redis_client import close_redis
+from .uploads import shutdown_upload_pool
+
+Hook = Callable[[], Awaitable[None]]
+
+_startup_hooks: list[Hook] = []
+_shutdown_hooks: list[Hook] = []
+
+
+def on_startup(hook: Hook) -> Hook:
+    _startup_hooks.append(hook)
+    return hook
+
+
+def on_shutdown(hook: Hook) -> Hook:
+    _shutdown_hooks.append(hook)
+    return hook
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Клиенты создаются лениво при первом запросе, здесь только фоновые задачи
+    # сервисов и закрытие соединений
+    for hook in _startup_hooks:
+        await hook()
+    yield
+    for hook in reversed(_shutdown_hooks):
+        await hook()
+    await close_broker()
+    await close_db()
+    await close_redis()
+    dispose_engine()
+    shutdown_upload_pool()
@@ -0,0 +1,169 @@
+"""
+Метрики Prometheus: GET /metrics в каждом сервисе.
+
+  http_request_duration_seconds{method, route, status} — время ответа по
+    шаблону маршрута (/servers/{server_id}/textchannels), а не по пути;
+  supabase_request_duration_seconds{table, operation, status} — каждый
+    запрос к PostgREST и Auth (транспорт общего клиента core.db);
+  cloudinary_request_duration_seconds{operation, outcome} — загрузки и
+    удаления картинок;
+  service_stat{source, name} — числовые счётчики из /internal/cache-stats
+    (core.diagnostics), считываются только при сборе метрик.
+
+На горячем пути — два вызова perf_counter и observe() у заранее найденной
+гистограммы с нужными метками (без поиска по меткам на каждый запрос).
+"""
+import time
+from typing import Callable, Optional
+
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from starlette.routing import Match
+
+CLOUDINARY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HTTP_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    ("method", "route", "status"),
+)
+SUPABASE_DURATION = Histogram(
+    "supabase_request_duration_seconds",
+    "Время запроса к Supabase до получения заголовков ответа",
+    ("table", "operation", "status"),
+)
+CLOUDINARY_DURATION = Histogram(
+    "cloudinary_request_duration_seconds",
+    "Время вызова Cloudinary",
+    ("operation", "outcome"),
+    buckets=CLOUDINARY_BUCKETS,
+)
+
+# Запрос, не дошедший ни до одного маршрута (404)
+UNMATCHED = "<unmatched>"
+_SUPABASE_OPERATIONS = {"GET": "select", "HEAD": "select", "POST": "insert", "PATCH": "update", "DELETE": "delete"}
+
+
+def _route_template(scope) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # Ответ отдан до маршрутизации (304 из ETag, 429 из лимита): ищем шаблон сами,
+    # и предзапросы CORS (OPTIONS совпадает с маршрутом только по пути)
+    app = scope.get("app")
+    partial = UNMATCHED
+    for candidate in getattr(getattr(app, "router", None), "routes", ()):
+        match, _ = candidate.matches(scope)
+        if match is Match.FULL:
+            return getattr(candidate, "path", UNMATCHED)
+        if match is Match.PARTIAL and partial is UNMATCHED:
+            partial = getattr(candidate, "path", UNMATCHED)
+    return partial
+
+
+class MetricsMiddleware:
+    """
+    Подключается последним (снаружи остальных), чтобы учитывать и их ответы.
+    route — своя метка маршрута по scope (шлюзу шаблон "/{path:path}" ничего
+    не говорит); по умолчанию шаблон пути FastAPI.
+    """
+
+    def __init__(self, app, route: Optional[Callable[[dict], str]] = None):
+        self.app = app
+        self.route = route or _route_template
+        # (метод, шаблон, статус) -> гистограмма с этими метками
+        self._children: dict[tuple[str, str, int], Histogram] = {}
+
+    def _observe(self, method: str, route: str, status: int, seconds: float) -> None:
+        key = (method, route, status)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = HTTP_DURATION.labels(method, route, str(status))
+        child.observe(seconds)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self._observe(scope["method"], self.route(scope), status, time.perf_counter() - started)
+
+
+def supabase_labels(method: str, path: str) -> tuple[str, str]:
+    """(таблица или функция, операция) по запросу к Supabase."""
+    _, rest, tail = path.partition("/rest/v1/")
+    if rest:
+        if tail.startswith("rpc/"):
+            return tail[4:], "rpc"
+        return tail.split("/", 1)[0], _SUPABASE_OPERATIONS.get(method, method.lower())
+    _, auth, tail = path.partition("/auth/v1/")
+    if auth:
+        return "auth", tail.split("/", 1)[0]
+    return "other", method.lower()
+
+
+def observe_supabase(method: str, path: str, status: str, seconds: float) -> None:
+    SUPABASE_DURATION.labels(*supabase_labels(method, path), status).observe(seconds)
+
+
+def observe_cloudinary(operation: str, outcome: str, seconds: float) -> None:
+    CLOUDINARY_DURATION.labels(operation, outcome).observe(seconds)
+
+
+def _numeric(prefix: str, value, out: list) -> None:
+    # bool — подкласс int, попадает сюда же как 0/1
+    if isinstance(value, (int, float)):
+        out.append((prefix, float(value)))
+    elif isinstance(value, dict):
+        for key, nested in value.items():
+            _numeric(f"{prefix}.{key}" if prefix else str(key), nested, out)
+
+
+class DiagnosticsCollector:
+    """Счётчики core.diagnostics как gauge; строки и списки пропускаются."""
+
+    @staticmethod
+    def _family() -> GaugeMetricFamily:
+        return GaugeMetricFamily("service_stat", "Счётчики кэшей и фоновых задач сервиса", labels=("source", "name"))
+
+    def describe(self):
+        # Без describe регистрация вызвала бы collect, а diagnostics ещё не импортирован
+        yield self._family()
+
+    def collect(self):
+        from .diagnostics import _sources
+
+        family = self._family()
+        for source, read in list(_sources.items()):
+            try:
+                stats: Optional[dict] = read()
+            except Exception:
+                continue
+            values: list = []
+            _numeric("", stats or {}, values)
+            for name, value in values:
+                family.add_metric((source, name), value)
+        yield family
+
+
+REGISTRY.register(DiagnosticsCollector())
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
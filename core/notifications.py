@@ -0,0 +1,175 @@
+"""
+Поток уведомлений пользователя: заявки в друзья и приглашения на серверы.
+
+Обработчики friends-service и server-service вызывают notify после записи в
+БД. Событие уходит через core.pubsub, поэтому доходит до сокета пользователя
+в любой реплике (без REDIS_URL — только внутри процесса).
+
+WebSocket /notifications/ws при подключении присылает снимок
+{"type": "snapshot", "badges": {"friend_requests": n, "server_invites": m}} —
+одна строка notification_badges по ключу (её ведут триггеры, см. миграцию
+notification_badges). Дальше счётчики подключённых пользователей меняются
+в памяти по самим событиям, и каждое событие несёт актуальные "badges".
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+
+from .auth import authenticate_websocket
+from .broadcast import Broadcaster, receive_object
+from .config import setting_int
+from .db import db
+from .pubsub import get_broker
+
+logger = logging.getLogger(__name__)
+
+EVENTS_CHANNEL = "notifications"
+BADGES = ("friend_requests", "server_invites")
+# Сколько раз перечитывать счётчики, если во время чтения пришли события
+LOAD_ATTEMPTS = 3
+
+
+class NotificationHub:
+    def __init__(self, queue_size: int = 100):
+        self.events = Broadcaster(queue_size=queue_size)
+        # Только для пользователей с открытым сокетом
+        self._badges: dict[str, dict[str, int]] = {}
+        self._changes: dict[str, int] = {}
+        self.delivered = 0
+
+    async def _load(self, user_id: str) -> dict[str, int]:
+        response = await db.table("notification_badges") \
+            .select(", ".join(BADGES)) \
+            .eq("user_id", user_id) \
+            .maybe_single() \
+            .execute()
+        row = response.data if response and response.data else {}
+        return {badge: row.get(badge, 0) for badge in BADGES}
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        return self.events.subscribe(user_id)
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue) -> None:
+        self.events.unsubscribe(user_id, queue)
+        if not self.events.subscribers(user_id):
+            self._badges.pop(user_id, None)
+            self._changes.pop(user_id, None)
+
+    async def badges(self, user_id: str) -> dict[str, int]:
+        """Счётчики подписанного пользователя: из памяти или одним запросом."""
+        counters = self._badges.get(user_id)
+        if counters is not None:
+            return dict(counters)
+
+        for _ in range(LOAD_ATTEMPTS):
+            changes = self._changes.get(user_id, 0)
+            counters = await self._load(user_id)
+            # Событие во время чтения могло попасть в строку, а могло и нет
+            if self._changes.get(user_id, 0) == changes:
+                break
+        if self.events.subscribers(user_id):
+            self._badges[user_id] = counters
+        return dict(counters)
+
+    def deliver(self, user_id: str, event: dict, badge: Optional[str] = None, delta: int = 0) -> None:
+        if not self.events.subscribers(user_id):
+            return
+        self._changes[user_id] = self._changes.get(user_id, 0) + 1
+        counters = self._badges.get(user_id)
+        if counters is not None:
+            if badge is not None:
+                counters[badge] = max(counters[badge] + delta, 0)
+            event = {**event, "badges": dict(counters)}
+        self.events.publish(user_id, event)
+        self.delivered += 1
+
+    def stats(self) -> dict:
+        return {
+            "connected_users": len(self._badges),
+            "delivered": self.delivered,
+            "dropped": self.events.dropped,
+        }
+
+
+_hub: Optional[NotificationHub] = None
+
+
+def get_notification_hub() -> NotificationHub:
+    global _hub
+    if _hub is None:
+        _hub = NotificationHub(queue_size=setting_int("NOTIFICATIONS_QUEUE_SIZE", 100))
+        get_broker().subscribe(EVENTS_CHANNEL, _on_event)
+    return _hub
+
+
+async def _on_event(message: dict) -> None:
+    if _hub is not None:
+        _hub.deliver(message["user_id"], message["event"], message.get("badge"), message.get("delta", 0))
+
+
+async def notify(user_id: str, event: dict, badge: Optional[str] = None, delta: int = 0) -> None:
+    """
+    Отправляет событие пользователю. badge и delta — как событие меняет
+    счётчик получателя (сам счётчик в БД уже изменил триггер).
+    """
+    try:
+        await get_broker().publish(EVENTS_CHANNEL, {
+            "user_id": user_id,
+            "event": event,
+            "badge": badge,
+            "delta": delta,
+        })
+    except Exception:
+        # Уведомление не должно ломать уже выполненное действие
+        logger.exception("notification failed")
+
+
+def notification_stats() -> Optional[dict]:
+    return _hub.stats() if _hub is not None else None
+
+
+router = APIRouter(prefix="/notifications")
+
+
+@router.websocket("/ws")
+async def notifications_socket(websocket: WebSocket):
+    """
+    События: friend_request.new | accepted | rejected | cancelled и
+    server_invite.new | accepted | rejected | cancelled.
+    """
+    user = await authenticate_websocket(websocket)
+    if user is None:
+        await websocket.close(code=4401, reason="Invalid token")
+        return
+    user_id = user.user.id
+
+    await websocket.accept()
+    hub = get_notification_hub()
+    # Подписка раньше снимка: события, пришедшие во время чтения, не теряются
+    events = hub.subscribe(user_id)
+
+    async def push_events():
+        while True:
+            event = await events.get()
+            if event is None:
+                # Клиент не успевал читать — пусть переподключится за снимком
+                await websocket.close(code=4408, reason="Too slow")
+                return
+            await websocket.send_json(event)
+
+    try:
+        await websocket.send_json({"type": "snapshot", "badges": await hub.badges(user_id)})
+        pusher = asyncio.create_task(push_events())
+        try:
+            while True:
+                message = await receive_object(websocket)
+                if message is not None and message.get("type") == "ping":
+                    await websocket.send_json({"type": "pong"})
+        finally:
+            pusher.cancel()
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        hub.unsubscribe(user_id, events)
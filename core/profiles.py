@@ -0,0 +1,181 @@
+"""
+Общий read-through кэш профилей (таблица profiles) с LRU и TTL.
+
+Промахи по нескольким id догружаются одним запросом in_. Обработчики,
+меняющие профиль, вызывают invalidate_profile: запись удаляется локально и
+через core.pubsub во всех остальных процессах. Ответ запроса, во время
+которого пришла инвалидация, возвращается вызывающему, но в кэш не
+попадает — он мог прочитать строку до изменения.
+
+Объём кэша (memory_bytes в stats) считается при записи и удалении профиля,
+а не обходом кэша на каждый запрос /metrics.
+"""
+import sys
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from .config import setting_float, setting_int
+from .db import db
+from .pubsub import get_broker
+
+INVALIDATION_CHANNEL = "profiles.invalidate"
+
+
+def project(profile: Optional[dict], columns: Iterable[str]) -> Optional[dict]:
+    """Оставляет в профиле только нужные колонки (как select у PostgREST)."""
+    if profile is None:
+        return None
+    return {column: profile.get(column) for column in columns}
+
+
+class ProfileCache:
+    def __init__(self, max_size: int = 50000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        # user_id -> (истекает, профиль, его размер в байтах)
+        self._entries: "OrderedDict[str, tuple[float, dict, int]]" = OrderedDict()
+        self._by_username: dict[str, str] = {}
+        # Сумма размеров профилей в кэше
+        self._bytes = 0
+        # Растёт при каждой инвалидации: ответ БД, полученный после неё, устарел
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _lookup(self, user_id: str) -> Optional[dict]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self._drop(user_id)
+            return None
+        self._entries.move_to_end(user_id)
+        return entry[1]
+
+    def _store(self, profile: dict) -> None:
+        user_id = profile["user_id"]
+        self._drop(user_id)
+        size = self._size(user_id, profile)
+        self._entries[user_id] = (time.monotonic() + self.ttl, profile, size)
+        self._bytes += size
+        if profile.get("username"):
+            self._by_username[profile["username"]] = user_id
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, user_id: str) -> bool:
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return False
+        self._bytes -= entry[2]
+        username = entry[1].get("username")
+        if self._by_username.get(username) == user_id:
+            del self._by_username[username]
+        return True
+
+    async def get_many(self, user_ids: Iterable[str]) -> dict[str, dict]:
+        found, missing = {}, []
+        for user_id in dict.fromkeys(user_ids):
+            profile = self._lookup(user_id)
+            if profile is None:
+                missing.append(user_id)
+            else:
+                found[user_id] = profile
+        self.hits += len(found)
+        self.misses += len(missing)
+
+        if missing:
+            generation = self._generation
+            response = await db.table("profiles") \
+                .select("*") \
+                .in_("user_id", missing) \
+                .execute()
+            for profile in response.data:
+                if generation == self._generation:
+                    self._store(profile)
+                found[profile["user_id"]] = profile
+        return found
+
+    async def get(self, user_id: str) -> Optional[dict]:
+        return (await self.get_many([user_id])).get(user_id)
+
+    async def get_by_username(self, username: str) -> Optional[dict]:
+        user_id = self._by_username.get(username)
+        profile = self._lookup(user_id) if user_id else None
+        if profile is not None and profile.get("username") == username:
+            self.hits += 1
+            return profile
+
+        self.misses += 1
+        generation = self._generation
+        response = await db.table("profiles") \
+            .select("*") \
+            .eq("username", username) \
+            .maybe_single() \
+            .execute()
+        if not response or not response.data:
+            return None
+        if generation == self._generation:
+            self._store(response.data)
+        return response.data
+
+    def invalidate_local(self, user_id: str) -> None:
+        self._generation += 1
+        if self._drop(user_id):
+            self.invalidations += 1
+
+    @staticmethod
+    def _size(user_id: str, profile: dict) -> int:
+        size = sys.getsizeof(user_id) + sys.getsizeof(profile)
+        return size + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in profile.items())
+
+    def memory_bytes(self) -> int:
+        """Приблизительный объём кэша: контейнеры, словари профилей и их значения."""
+        return sys.getsizeof(self._entries) + sys.getsizeof(self._by_username) + self._bytes
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "memory_bytes": self.memory_bytes(),
+        }
+
+
+_cache: Optional[ProfileCache] = None
+
+
+def get_profile_cache() -> ProfileCache:
+    global _cache
+    if _cache is None:
+        _cache = ProfileCache(
+            max_size=setting_int("PROFILE_CACHE_SIZE", 50000),
+            ttl=setting_float("PROFILE_CACHE_TTL", 300),
+        )
+        get_broker().subscribe(INVALIDATION_CHANNEL, _on_invalidate)
+    return _cache
+
+
+async def _on_invalidate(message: dict) -> None:
+    if _cache is not None:
+        _cache.invalidate_local(message["user_id"])
+
+
+async def invalidate_profile(user_id: str) -> None:
+    """Сбрасывает профиль во всех процессах. Вызывать после записи в profiles."""
+    get_profile_cache().invalidate_local(user_id)
+    await get_broker().publish(INVALIDATION_CHANNEL, {"user_id": user_id})
+
+
+def profile_cache_stats() -> Optional[dict]:
+    return _cache.stats() if _cache is not None else None
@@ -0,0 +1,131 @@
+"""
+Лёгкий pub/sub между процессами сервисов.
+
+С REDIS_URL сообщения идут через Redis PUBLISH/SUBSCRIBE и доходят до всех
+реплик всех сервисов; без него LocalBroker доставляет их только внутри
+процесса (одна реплика, тесты). При обрыве соединения с Redis RedisBroker
+переподключается с растущей задержкой и заново подписывается на все
+каналы; сообщения, опубликованные за время обрыва, теряются (кэши
+догоняют по своему TTL).
+"""
+import asyncio
+import contextlib
+import json
+import logging
+from collections import defaultdict
+from typing import Awaitable, Callable, Optional
+
+from .config import setting
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+RECONNECT_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+class LocalBroker:
+    def __init__(self):
+        self._handlers: dict[str, list[Handler]] = defaultdict(list)
+
+    def subscribe(self, channel: str, handler: Handler) -> None:
+        self._handlers[channel].append(handler)
+
+    async def publish(self, channel: str, message: dict) -> None:
+        await _dispatch(self._handlers.get(channel, ()), message)
+
+    async def close(self) -> None:
+        self._handlers.clear()
+
+
+class RedisBroker:
+    def __init__(self, redis):
+        self.redis = redis
+        self._handlers: dict[str, list[Handler]] = defaultdict(list)
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def subscribe(self, channel: str, handler: Handler) -> None:
+        first = channel not in self._handlers
+        self._handlers[channel].append(handler)
+        if first:
+            asyncio.get_running_loop().create_task(self._subscribe(channel))
+
+    async def _subscribe(self, channel: str) -> None:
+        async with self._lock:
+            if self._pubsub is None:
+                self._pubsub = self.redis.pubsub()
+                await self._pubsub.subscribe(channel)
+                self._listener = asyncio.create_task(self._listen())
+            else:
+                await self._pubsub.subscribe(channel)
+
+    async def _listen(self) -> None:
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    delay = RECONNECT_DELAY
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        payload = json.loads(message["data"])
+                    except (TypeError, ValueError):
+                        continue
+                    await _dispatch(self._handlers.get(message["channel"], ()), payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("pubsub connection lost: %s, reconnecting in %.1fs", e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+            await self._resubscribe()
+
+    async def _resubscribe(self) -> None:
+        async with self._lock:
+            old, self._pubsub = self._pubsub, self.redis.pubsub()
+            with contextlib.suppress(Exception):
+                await old.aclose()
+            try:
+                await self._pubsub.subscribe(*self._handlers)
+            except Exception:
+                # listen() на неподписанном соединении сразу упадёт — следующая попытка
+                logger.exception("pubsub resubscribe failed")
+
+    async def publish(self, channel: str, message: dict) -> None:
+        await self.redis.publish(channel, json.dumps(message))
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        self._listener = self._pubsub = None
+
+
+async def _dispatch(handlers, message: dict) -> None:
+    for handler in list(handlers):
+        try:
+            await handler(message)
+        except Exception:
+            logger.exception("pubsub handler failed")
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = RedisBroker(get_redis()) if setting("REDIS_URL") else LocalBroker()
+    return _broker
+
+
+async def close_broker() -> None:
+    global _broker
+    if _broker is not None:
+        await _broker.close()
+    _broker = None
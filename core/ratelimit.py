@@ -0,0 +1,265 @@
+"""
+Ограничение частоты запросов: token bucket на пару (пользователь, класс
+маршрута), чтобы один клиент, опрашивающий API в цикле, не выбирал лимиты
+PostgREST и Cloudinary за всех.
+
+Ведро со скоростью rate и ёмкостью burst хранится как одно число — момент,
+когда оно снова станет полным (GCRA, эквивалент token bucket). Запрос
+разрешён, если после него ведро «переполнится» не дальше, чем на burst
+запросов вперёд; иначе 429 с Retry-After.
+
+MemoryBuckets держит вёдра в OrderedDict в порядке последнего обращения:
+проверка и обновление — O(1), а полные вёдра (с ними ничего не теряется)
+выселяются с начала словаря по ходу работы. RATE_LIMIT_BACKEND=redis
+переносит вёдра в Redis, общий для реплик (без REDIS_URL — LocalRedis).
+
+Пользователь определяется без проверки токена: подпись шлюза, токен из
+кэша проверенных токенов (core.auth) или, если их нет, IP клиента. За
+шлюзом IP берётся из последнего элемента X-Forwarded-For — только если
+запрос пришёл с адреса из RATE_LIMIT_TRUSTED_PROXIES. По умолчанию это
+только localhost: сервисы доступны и напрямую, поэтому целые частные сети
+доверять нельзя — в развёртывании сюда записывают адреса шлюза и nginx.
+"""
+import ipaddress
+import math
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+from starlette.requests import HTTPConnection
+
+from .auth import extract_token, trusted_identity, verifier
+from .config import setting, setting_bool, setting_float, setting_int
+from .redis_client import get_redis
+
+ENABLED = setting_bool("RATE_LIMIT_ENABLED", True)
+MAX_KEYS = setting_int("RATE_LIMIT_MAX_KEYS", 100_000)
+EXEMPT_PREFIXES = ("/internal/", "/metrics")
+TRUSTED_PROXIES = tuple(
+    ipaddress.ip_network(network.strip())
+    for network in setting("RATE_LIMIT_TRUSTED_PROXIES", "127.0.0.1/32,::1/128").split(",")
+    if network.strip()
+)
+
+
+@dataclass(frozen=True)
+class RouteClass:
+    name: str
+    # запросов в секунду в среднем и сколько можно подряд
+    rate: float
+    burst: int
+    # регулярное выражение пути (целиком); None — любой путь
+    pattern: Optional[str] = None
+    # None — любой метод
+    methods: Optional[frozenset] = None
+
+    @property
+    def interval(self) -> float:
+        return 1.0 / self.rate
+
+    @property
+    def window(self) -> float:
+        return self.burst / self.rate
+
+
+def route_class(name: str, rate: float, burst: int, pattern: Optional[str] = None, methods=None) -> RouteClass:
+    """Класс маршрутов; RATE_LIMIT_<NAME>_RATE и _BURST переопределяют значения."""
+    prefix = f"RATE_LIMIT_{name.upper()}"
+    return RouteClass(
+        name=name,
+        rate=setting_float(f"{prefix}_RATE", rate),
+        burst=setting_int(f"{prefix}_BURST", burst),
+        pattern=pattern,
+        methods=frozenset(methods) if methods else None,
+    )
+
+
+# Классы по умолчанию, после классов сервиса
+READ = route_class("read", 20, 60, methods=("GET", "HEAD"))
+WRITE = route_class("write", 5, 20)
+# Общие для нескольких сервисов
+UPLOADS = route_class("upload", 0.2, 5, r"/(?:servers/upload-image|profile/upload-avatar)")
+
+
+class MemoryBuckets:
+    def __init__(self, max_size: int = MAX_KEYS):
+        self.max_size = max_size
+        # ключ -> момент, когда ведро станет полным
+        self._full_at: "OrderedDict[str, float]" = OrderedDict()
+        self.evicted = 0
+
+    async def take(self, key: str, interval: float, window: float, now: float) -> float:
+        """0 — запрос разрешён, иначе через сколько секунд повторить."""
+        full_at = max(self._full_at.get(key, now), now) + interval
+        if full_at - now > window:
+            return full_at - now - window
+        self._full_at[key] = full_at
+        self._full_at.move_to_end(key)
+        self._evict(now)
+        return 0.0
+
+    def _evict(self, now: float) -> None:
+        # С начала — вёдра, к которым дольше всего не обращались. Полное ведро
+        # равно отсутствующему; при переполнении выселяются и неполные.
+        entries = self._full_at
+        while entries:
+            key, full_at = next(iter(entries.items()))
+            if full_at > now and len(entries) <= self.max_size:
+                return
+            del entries[key]
+            self.evicted += 1
+
+    def __len__(self) -> int:
+        return len(self._full_at)
+
+
+class RedisBuckets:
+    """
+    Вёдра в Redis без Lua: INCRBYFLOAT атомарен, поэтому одновременные
+    запросы с разных реплик не теряют друг друга. Неточность возможна только
+    у полного ведра (ключ истёк) — там гонка может пропустить лишний запрос.
+    Часы реплик должны быть синхронизированы (NTP).
+    """
+
+    def __init__(self, redis, prefix: str = "ratelimit:"):
+        self.redis = redis
+        self.prefix = prefix
+
+    async def take(self, key: str, interval: float, window: float, now: float) -> float:
+        name = self.prefix + key
+        full_at = float(await self.redis.incrbyfloat(name, interval))
+        if full_at - interval < now:
+            # Ключа не было или ведро успело наполниться: отсчёт от текущего момента
+            full_at = now + interval
+            await self.redis.set(name, repr(full_at), pxat=math.ceil(full_at * 1000))
+            return 0.0
+        if full_at - now > window:
+            await self.redis.incrbyfloat(name, -interval)
+            return full_at - now - window
+        await self.redis.pexpireat(name, math.ceil(full_at * 1000))
+        return 0.0
+
+
+class RateLimitStats:
+    def __init__(self):
+        # класс -> [пропущено, отклонено]
+        self.classes: dict[str, list[int]] = {}
+        self.backend = None
+
+    def record(self, name: str, throttled: bool) -> None:
+        counters = self.classes.get(name)
+        if counters is None:
+            counters = self.classes[name] = [0, 0]
+        counters[throttled] += 1
+
+    def stats(self) -> dict:
+        local = isinstance(self.backend, MemoryBuckets)
+        return {
+            "enabled": ENABLED,
+            "backend": "memory" if local else "redis" if self.backend is not None else None,
+            # Для Redis число ключей и выселения считает сам Redis
+            "keys": len(self.backend) if local else None,
+            "evicted": self.backend.evicted if local else None,
+            "allowed": {name: counters[0] for name, counters in self.classes.items()},
+            "throttled": {name: counters[1] for name, counters in self.classes.items()},
+        }
+
+
+_stats = RateLimitStats()
+_backend = None
+
+
+def get_buckets():
+    global _backend
+    if _backend is None:
+        if setting("RATE_LIMIT_BACKEND", "memory") == "redis":
+            _backend = RedisBuckets(get_redis())
+        else:
+            _backend = MemoryBuckets()
+        _stats.backend = _backend
+    return _backend
+
+
+@lru_cache(maxsize=1024)
+def _is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+
+def client_ip(connection: HTTPConnection) -> str:
+    host = connection.client.host if connection.client else "unknown"
+    forwarded = connection.headers.get("x-forwarded-for")
+    if forwarded and _is_trusted_proxy(host):
+        # Последний адрес дописал наш прокси, предыдущие мог прислать клиент
+        return forwarded.rsplit(",", 1)[-1].strip()
+    return host
+
+
+def client_key(connection: HTTPConnection) -> str:
+    identity = trusted_identity(connection)
+    if identity is None:
+        token = extract_token(connection)
+        identity = verifier.cache.peek(token) if token else None
+    if identity is not None:
+        return f"user:{identity.user.id}"
+    return f"ip:{client_ip(connection)}"
+
+
+class RateLimitMiddleware:
+    """
+    classes — классы маршрутов сервиса; первый подходящий по методу и пути
+    определяет ведро, остальные запросы попадают в READ или WRITE.
+    """
+
+    def __init__(self, app, classes: tuple[RouteClass, ...] = ()):
+        self.app = app
+        self.classes = [
+            (route, re.compile(route.pattern) if route.pattern else None)
+            for route in (*classes, READ, WRITE)
+        ]
+
+    def _classify(self, method: str, path: str) -> RouteClass:
+        for route, pattern in self.classes:
+            if route.methods is not None and method not in route.methods:
+                continue
+            if pattern is None or pattern.fullmatch(path):
+                return route
+        return WRITE  # недостижимо: WRITE подходит любому запросу
+
+    async def __call__(self, scope, receive, send):
+        if (
+            not ENABLED
+            or scope["type"] != "http"
+            or scope["method"] == "OPTIONS"
+            or scope["path"].startswith(EXEMPT_PREFIXES)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        route = self._classify(scope["method"], scope["path"])
+        key = f"{route.name}:{client_key(HTTPConnection(scope))}"
+        retry_after = await get_buckets().take(key, route.interval, route.window, time.time())
+        _stats.record(route.name, retry_after > 0)
+        if retry_after <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"retry-after", str(math.ceil(retry_after)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": b'{"detail":"Too many requests"}'})
+
+
+def rate_limit_stats() -> dict:
+    return _stats.stats()
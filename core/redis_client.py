@@ -0,0 +1,164 @@
+"""
+Подключение к Redis для состояния, общего между репликами.
+
+Если REDIS_URL не задан, используется LocalRedis — заглушка в памяти процесса
+с тем же подмножеством команд redis.asyncio. Она же подменяет Redis в тестах.
+"""
+import time
+from typing import Optional
+
+from .config import setting
+
+_redis = None
+
+
+class LocalRedis:
+    """Подмножество команд redis.asyncio (decode_responses=True) в памяти процесса."""
+
+    def __init__(self):
+        self._data: dict = {}
+        # ключ -> момент истечения (time.time(), секунды); только для строк
+        self._expires: dict = {}
+
+    def _expire_stale(self, name) -> None:
+        expires = self._expires.get(name)
+        if expires is not None and expires <= time.time():
+            self._data.pop(name, None)
+            del self._expires[name]
+
+    def _typed(self, name, factory):
+        value = self._data.get(name)
+        if value is None:
+            value = self._data[name] = factory()
+        return value
+
+    async def delete(self, *names) -> int:
+        for name in names:
+            self._expire_stale(name)
+            self._expires.pop(name, None)
+        return sum(self._data.pop(name, None) is not None for name in names)
+
+    # строки
+    async def get(self, name):
+        self._expire_stale(name)
+        return self._data.get(name)
+
+    async def set(self, name, value, px=None, pxat=None, nx=False) -> Optional[bool]:
+        self._expire_stale(name)
+        if nx and name in self._data:
+            return None
+        self._data[name] = str(value)
+        self._expires.pop(name, None)
+        if px is not None:
+            self._expires[name] = time.time() + px / 1000
+        elif pxat is not None:
+            self._expires[name] = pxat / 1000
+        return True
+
+    async def incrbyfloat(self, name, amount) -> float:
+        self._expire_stale(name)
+        value = float(self._data.get(name, 0)) + float(amount)
+        self._data[name] = repr(value)
+        return value
+
+    async def pexpireat(self, name, when) -> bool:
+        self._expire_stale(name)
+        if name not in self._data:
+            return False
+        self._expires[name] = when / 1000
+        return True
+
+    # хэши
+    async def hset(self, name, key, value) -> int:
+        hash_ = self._typed(name, dict)
+        added = key not in hash_
+        hash_[key] = str(value)
+        return int(added)
+
+    async def hget(self, name, key):
+        return (self._data.get(name) or {}).get(key)
+
+    async def hdel(self, name, *keys) -> int:
+        hash_ = self._data.get(name) or {}
+        return sum(hash_.pop(key, None) is not None for key in keys)
+
+    # множества
+    async def sadd(self, name, *values) -> int:
+        set_ = self._typed(name, set)
+        added = sum(v not in set_ for v in values)
+        set_.update(values)
+        return added
+
+    async def srem(self, name, *values) -> int:
+        set_ = self._data.get(name) or set()
+        removed = sum(v in set_ for v in values)
+        set_.difference_update(values)
+        return removed
+
+    async def smembers(self, name) -> set:
+        return set(self._data.get(name) or ())
+
+    # упорядоченные множества
+    async def zadd(self, name, mapping, nx=False, xx=False, ch=False) -> int:
+        zset = self._typed(name, dict)
+        added = changed = 0
+        for member, score in mapping.items():
+            exists = member in zset
+            if (nx and exists) or (xx and not exists):
+                continue
+            if not exists:
+                added += 1
+            elif zset[member] != float(score):
+                changed += 1
+            zset[member] = float(score)
+        return added + changed if ch else added
+
+    async def zrem(self, name, *members) -> int:
+        zset = self._data.get(name) or {}
+        return sum(zset.pop(m, None) is not None for m in members)
+
+    async def zscore(self, name, member) -> Optional[float]:
+        return (self._data.get(name) or {}).get(member)
+
+    async def zcard(self, name) -> int:
+        return len(self._data.get(name) or {})
+
+    async def zrangebyscore(self, name, min, max, withscores=False) -> list:
+        low, high = float(min), float(max)
+        items = sorted(
+            ((member, score) for member, score in (self._data.get(name) or {}).items() if low <= score <= high),
+            key=lambda item: (item[1], item[0]),
+        )
+        return items if withscores else [member for member, _ in items]
+
+    async def zremrangebyscore(self, name, min, max) -> int:
+        zset = self._data.get(name) or {}
+        low, high = float(min), float(max)
+        doomed = [member for member, score in zset.items() if low <= score <= high]
+        for member in doomed:
+            del zset[member]
+        return len(doomed)
+
+    async def aclose(self) -> None:
+        pass
+
+
+def get_redis():
+    """Общий клиент Redis (REDIS_URL) или LocalRedis, если Redis не настроен."""
+    global _redis
+    if _redis is None:
+        url = setting("REDIS_URL")
+        if url:
+            import redis.asyncio
+
+            _redis = redis.asyncio.from_url(url, decode_responses=True)
+        else:
+            _redis = LocalRedis()
+    return _redis
+
+
+async def close_redis() -> None:
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+    _redis = None
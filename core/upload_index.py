@@ -0,0 +1,124 @@
+"""
+Индекс загруженных изображений по содержимому: папка:SHA-256 -> secure_url.
+
+Повторная загрузка той же картинки отдаёт уже существующий URL без
+обращения к Cloudinary. Ключи индекса — хэш исходного файла (находит
+повтор ещё до перекодирования) и хэш нормализованного WebP (совпадает,
+когда один и тот же снимок пришёл в разной обёртке). Папка входит в ключ:
+аватар не получает URL картинки сервера и наоборот.
+
+UPLOAD_INDEX=postgrest — таблица upload_index в Supabase (по умолчанию),
+UPLOAD_INDEX=redis — хэш в Redis (REDIS_URL), UPLOAD_INDEX=memory — память
+процесса (по умолчанию при UPLOAD_STORAGE=local).
+
+forget(url) при удалении файла находит его хэши обратным поиском: в Redis —
+множество хэшей на каждый URL, в таблице — индекс по url.
+"""
+import json
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from .config import setting
+from .db import db
+from .redis_client import get_redis
+
+
+class UploadIndex(ABC):
+    @abstractmethod
+    async def get(self, digest: str) -> Optional[tuple[str, int]]:
+        """(url, размер загруженного файла) для хэша или None."""
+
+    @abstractmethod
+    async def put(self, digest: str, url: str, size: int) -> None:
+        """Запоминает URL для хэша; size — байты, которые сэкономит повтор."""
+
+    @abstractmethod
+    async def forget(self, url: str) -> None:
+        """Убирает все хэши, указывающие на url (файл удаляется из хранилища)."""
+
+
+class MemoryUploadIndex(UploadIndex):
+    def __init__(self):
+        self._entries: dict[str, tuple[str, int]] = {}
+        # url -> хэши, указывающие на него
+        self._digests: dict[str, set[str]] = {}
+
+    async def get(self, digest: str) -> Optional[tuple[str, int]]:
+        return self._entries.get(digest)
+
+    async def put(self, digest: str, url: str, size: int) -> None:
+        self._entries[digest] = (url, size)
+        self._digests.setdefault(url, set()).add(digest)
+
+    async def forget(self, url: str) -> None:
+        for digest in self._digests.pop(url, ()):
+            entry = self._entries.get(digest)
+            if entry is not None and entry[0] == url:
+                del self._entries[digest]
+
+
+class RedisUploadIndex(UploadIndex):
+    def __init__(self, redis, key: str = "uploads:index"):
+        self.redis = redis
+        self.key = key
+        # Множество хэшей каждого URL: "uploads:index:url:<url>"
+        self.url_prefix = f"{key}:url:"
+
+    async def get(self, digest: str) -> Optional[tuple[str, int]]:
+        value = await self.redis.hget(self.key, digest)
+        if value is None:
+            return None
+        entry = json.loads(value)
+        return entry["url"], entry["size"]
+
+    async def put(self, digest: str, url: str, size: int) -> None:
+        # Сначала обратная ссылка: если put оборвётся между командами, forget
+        # всё равно найдёт хэш
+        await self.redis.sadd(self.url_prefix + url, digest)
+        await self.redis.hset(self.key, digest, json.dumps({"url": url, "size": size}))
+
+    async def forget(self, url: str) -> None:
+        digests = await self.redis.smembers(self.url_prefix + url)
+        if digests:
+            await self.redis.hdel(self.key, *digests)
+        await self.redis.delete(self.url_prefix + url)
+
+
+class PostgrestUploadIndex(UploadIndex):
+    async def get(self, digest: str) -> Optional[tuple[str, int]]:
+        response = await db.table("upload_index") \
+            .select("url, size") \
+            .eq("sha256", digest) \
+            .maybe_single() \
+            .execute()
+        if not response or not response.data:
+            return None
+        return response.data["url"], response.data["size"]
+
+    async def put(self, digest: str, url: str, size: int) -> None:
+        await db.table("upload_index") \
+            .upsert({"sha256": digest, "url": url, "size": size}, ignore_duplicates=True) \
+            .execute()
+
+    async def forget(self, url: str) -> None:
+        await db.table("upload_index") \
+            .delete() \
+            .eq("url", url) \
+            .execute()
+
+
+_index: Optional[UploadIndex] = None
+
+
+def get_upload_index() -> UploadIndex:
+    global _index
+    if _index is None:
+        default = "memory" if setting("UPLOAD_STORAGE") == "local" else "postgrest"
+        backend = setting("UPLOAD_INDEX", default)
+        if backend == "redis":
+            _index = RedisUploadIndex(get_redis())
+        elif backend == "memory":
+            _index = MemoryUploadIndex()
+        else:
+            _index = PostgrestUploadIndex()
+    return _index
@@ -0,0 +1,402 @@
+"""
+Загрузка изображений (аватары пользователей и серверов).
+
+Тело читается порциями с жёстким лимитом, тип определяется по сигнатуре
+файла, а не по заголовку клиента. Картинка уменьшается до IMAGE_MAX_SIDE
+и перекодируется в WebP в пуле потоков (Pillow отпускает GIL на
+декодировании и ресемплинге), и только результат уходит в хранилище —
+тоже вне event loop.
+
+UPLOAD_STORAGE=cloudinary (по умолчанию) отправляет файлы в Cloudinary,
+UPLOAD_STORAGE=local — в LocalImageStorage в памяти процесса (тесты,
+локальный запуск без ключей Cloudinary). Повторы одной и той же картинки
+не загружаются заново — см. core.upload_index.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from .clients import get_cloudinary_uploader
+from .config import setting, setting_int
+from .metrics import observe_cloudinary
+from .upload_index import get_upload_index
+
+logger = logging.getLogger(__name__)
+
+MAX_BYTES = setting_int("UPLOAD_MAX_BYTES", 10 * 1024 * 1024)
+MAX_PIXELS = setting_int("UPLOAD_MAX_PIXELS", 40_000_000)
+IMAGE_MAX_SIDE = setting_int("UPLOAD_IMAGE_MAX_SIDE", 512)
+WEBP_QUALITY = setting_int("UPLOAD_WEBP_QUALITY", 85)
+CHUNK_SIZE = 64 * 1024
+# Запас на заголовки multipart сверх размера самого файла
+MULTIPART_OVERHEAD = 16 * 1024
+
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Тип изображения по первым байтам файла или None."""
+    for signature, image_type in _SIGNATURES:
+        if head.startswith(signature):
+            return image_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+async def read_limited(file: UploadFile, max_bytes: int = MAX_BYTES) -> bytes:
+    buffer = bytearray()
+    while chunk := await file.read(CHUNK_SIZE):
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Файл больше {max_bytes} байт")
+    return bytes(buffer)
+
+
+def transcode_image(data: bytes, max_side: int = IMAGE_MAX_SIDE) -> bytes:
+    """Уменьшает изображение до max_side по большей стороне и сохраняет в WebP."""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as source:
+        if source.width * source.height > MAX_PIXELS:
+            raise ValueError("image has too many pixels")
+        # JPEG сразу декодируется в уменьшенном масштабе
+        source.draft("RGB", (max_side, max_side))
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        if image.mode not in ("RGB", "RGBA"):
+            has_alpha = "A" in image.getbands() or "transparency" in image.info
+            image = image.convert("RGBA" if has_alpha else "RGB")
+
+        output = io.BytesIO()
+        image.save(output, "WEBP", quality=WEBP_QUALITY, method=4)
+        return output.getvalue()
+
+
+class CloudinaryImageStorage:
+    @staticmethod
+    async def _call(operation: str, method, *args, **kwargs) -> dict:
+        """Вызов SDK в потоке; время попадает в cloudinary_request_duration_seconds."""
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await asyncio.to_thread(method, *args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            observe_cloudinary(operation, outcome, time.perf_counter() - started)
+
+    async def upload(self, data: bytes, folder: str) -> str:
+        result = await self._call(
+            "upload",
+            get_cloudinary_uploader().upload,
+            io.BytesIO(data),
+            folder=folder,
+            resource_type="image",
+        )
+        return result["secure_url"]
+
+    @staticmethod
+    def public_id(url: str) -> Optional[str]:
+        """public_id файла из secure_url нашего облака или None."""
+        match = re.fullmatch(
+            rf"https?://res\.cloudinary\.com/{re.escape(setting('CLOUDINARY_CLOUD_NAME', ''))}"
+            r"/image/upload/(?:v\d+/)?(?P<id>[^?#]+?)(?:\.\w+)?",
+            url,
+        )
+        return match.group("id") if match else None
+
+    async def delete(self, url: str) -> bool:
+        """False — файл не из этого хранилища (например, внешняя ссылка)."""
+        public_id = self.public_id(url)
+        if public_id is None:
+            return False
+        result = await self._call(
+            "destroy",
+            get_cloudinary_uploader().destroy,
+            public_id,
+            resource_type="image",
+            invalidate=True,
+        )
+        if result.get("result") not in ("ok", "not found"):
+            raise RuntimeError(f"cloudinary destroy {public_id}: {result}")
+        return True
+
+
+class LocalImageStorage:
+    """Заглушка Cloudinary: хранит файлы в памяти процесса."""
+
+    def __init__(self):
+        self.files: dict[str, bytes] = {}
+
+    async def upload(self, data: bytes, folder: str) -> str:
+        name = f"{folder}/{hashlib.sha256(data).hexdigest()[:32]}.webp"
+        self.files[name] = data
+        return f"local://{name}"
+
+    async def delete(self, url: str) -> bool:
+        if not url.startswith("local://"):
+            return False
+        self.files.pop(url.removeprefix("local://"), None)
+        return True
+
+
+@dataclass
+class UploadResult:
+    url: str
+    image_type: str
+    bytes_received: int
+    bytes_uploaded: int
+    # Файл уже был загружен раньше, URL взят из индекса
+    deduplicated: bool = False
+    bytes_saved: int = 0
+    # Длительность стадий в миллисекундах: read, validate, lookup, transcode, upload
+    timings: dict[str, float] = field(default_factory=dict)
+
+    def report(self) -> dict:
+        return {
+            "image_type": self.image_type,
+            "bytes_received": self.bytes_received,
+            "bytes_uploaded": self.bytes_uploaded,
+            "deduplicated": self.deduplicated,
+            "timings_ms": {stage: round(ms, 2) for stage, ms in self.timings.items()},
+        }
+
+
+class UploadStats:
+    def __init__(self):
+        self.uploads = 0
+        self.rejected = 0
+        self.bytes_received = 0
+        self.bytes_uploaded = 0
+        self.dedup_hits = 0
+        self.bytes_saved = 0
+        # стадия -> (суммарное время, мс; сколько раз выполнялась)
+        self.stage_ms: dict[str, tuple[float, int]] = {}
+
+    def record(self, result: UploadResult) -> None:
+        self.uploads += 1
+        self.bytes_received += result.bytes_received
+        self.bytes_uploaded += result.bytes_uploaded
+        if result.deduplicated:
+            self.dedup_hits += 1
+            self.bytes_saved += result.bytes_saved
+        for stage, ms in result.timings.items():
+            total, count = self.stage_ms.get(stage, (0.0, 0))
+            self.stage_ms[stage] = (total + ms, count + 1)
+
+    def stats(self) -> dict:
+        return {
+            "uploads": self.uploads,
+            "rejected": self.rejected,
+            "bytes_received": self.bytes_received,
+            "bytes_uploaded": self.bytes_uploaded,
+            "dedup_hits": self.dedup_hits,
+            "dedup_hit_ratio": self.dedup_hits / self.uploads if self.uploads else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "avg_stage_ms": {
+                stage: total / count for stage, (total, count) in self.stage_ms.items()
+            },
+        }
+
+
+_storage = None
+_pool: Optional[ThreadPoolExecutor] = None
+_stats = UploadStats()
+# Загрузки, которые идут прямо сейчас, по ключу нормализованной картинки:
+# одновременные одинаковые запросы ждут одну и ту же загрузку
+_in_flight: dict[str, asyncio.Task] = {}
+
+
+def get_image_storage():
+    global _storage
+    if _storage is None:
+        if setting("UPLOAD_STORAGE", "cloudinary") == "local":
+            _storage = LocalImageStorage()
+        else:
+            _storage = CloudinaryImageStorage()
+    return _storage
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(
+            max_workers=setting_int("UPLOAD_WORKERS", os.cpu_count() or 1),
+            thread_name_prefix="image-transcode",
+        )
+    return _pool
+
+
+def _index_key(folder: str, data: bytes) -> str:
+    """Ключ индекса: папка и SHA-256. Одинаковый файл в разных папках — разные загрузки."""
+    return f"{folder}:{hashlib.sha256(data).hexdigest()}"
+
+
+async def _lookup(digest: str) -> Optional[tuple[str, int]]:
+    try:
+        return await get_upload_index().get(digest)
+    except Exception:
+        # Индекс — только оптимизация, без него просто загружаем заново
+        logger.exception("upload index lookup failed")
+        return None
+
+
+async def _remember(digests: tuple[str, ...], url: str, size: int) -> None:
+    try:
+        for digest in digests:
+            await get_upload_index().put(digest, url, size)
+    except Exception:
+        logger.exception("upload index update failed")
+
+
+async def _store(image: bytes, folder: str, digests: tuple[str, ...]) -> str:
+    url = await get_image_storage().upload(image, folder)
+    await _remember(digests, url, len(image))
+    return url
+
+
+async def delete_image(url: str) -> bool:
+    """
+    Удаляет загруженную картинку. Сначала она убирается из индекса, чтобы
+    новая загрузка того же файла не получила удаляемый URL.
+    """
+    await get_upload_index().forget(url)
+    return await get_image_storage().delete(url)
+
+
+async def process_image_upload(file: UploadFile, folder: str) -> UploadResult:
+    """
+    Полный путь загрузки: чтение с лимитом, проверка сигнатуры, поиск
+    повтора в индексе, уменьшение до WebP и отправка в хранилище.
+    413 — файл слишком большой, 415 — не изображение или повреждённый файл.
+    """
+    timings = {}
+
+    def finish(url: str, uploaded: int, saved: int = 0) -> UploadResult:
+        result = UploadResult(
+            url=url,
+            image_type=image_type,
+            bytes_received=len(data),
+            bytes_uploaded=uploaded,
+            deduplicated=saved > 0,
+            bytes_saved=saved,
+            timings=timings,
+        )
+        _stats.record(result)
+        return result
+
+    started = time.perf_counter()
+    try:
+        data = await read_limited(file)
+        timings["read"] = (time.perf_counter() - started) * 1000
+
+        mark = time.perf_counter()
+        image_type = sniff_image_type(data[:16])
+        timings["validate"] = (time.perf_counter() - mark) * 1000
+        if image_type is None:
+            raise HTTPException(status_code=415, detail="Поддерживаются только PNG, JPEG, GIF и WebP")
+
+        # Тот же самый файл уже загружали — не тратим время даже на перекодирование
+        mark = time.perf_counter()
+        raw_digest = _index_key(folder, data)
+        known = await _lookup(raw_digest)
+        timings["lookup"] = (time.perf_counter() - mark) * 1000
+        if known is not None:
+            return finish(known[0], 0, known[1])
+
+        mark = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            image = await loop.run_in_executor(_get_pool(), transcode_image, data)
+        except Exception:
+            raise HTTPException(status_code=415, detail="Не удалось прочитать изображение")
+        timings["transcode"] = (time.perf_counter() - mark) * 1000
+    except HTTPException:
+        _stats.rejected += 1
+        raise
+
+    mark = time.perf_counter()
+    digest = _index_key(folder, image)
+    known = await _lookup(digest)
+    timings["lookup"] += (time.perf_counter() - mark) * 1000
+    if known is not None:
+        await _remember((raw_digest,), *known)
+        return finish(known[0], 0, known[1])
+
+    mark = time.perf_counter()
+    task = _in_flight.get(digest)
+    shared = task is not None
+    if task is None:
+        task = asyncio.ensure_future(_store(image, folder, (digest, raw_digest)))
+        _in_flight[digest] = task
+        task.add_done_callback(lambda _: _in_flight.pop(digest, None))
+    url = await asyncio.shield(task)
+    timings["upload"] = (time.perf_counter() - mark) * 1000
+
+    if shared:
+        await _remember((raw_digest,), url, len(image))
+        return finish(url, 0, len(image))
+    return finish(url, len(image))
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Обрывает тело запроса на маршрутах загрузки, как только оно превышает
+    лимит, — до того как multipart-парсер сложит его на диск целиком.
+    """
+
+    def __init__(self, app, paths: tuple[str, ...], max_bytes: int = MAX_BYTES):
+        self.app = app
+        self.paths = frozenset(paths)
+        self.limit = max_bytes + MULTIPART_OVERHEAD
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.limit:
+            response = JSONResponse({"detail": "Файл слишком большой"}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    raise HTTPException(status_code=413, detail="Файл слишком большой")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def upload_stats() -> dict:
+    return _stats.stats()
+
+
+def shutdown_upload_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
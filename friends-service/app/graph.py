@@ -0,0 +1,255 @@
+"""
+Индекс графа дружбы в памяти процесса.
+
+Пользователи отображаются в целые числа (только id, полученные из БД, —
+строки из запросов клиентов не запоминаются), а друзья каждого загруженного
+пользователя хранятся отсортированным array("I") — 4 байта на ребро,
+проверка «дружат ли A и B» — бинарный поиск. Список друзей пользователя
+загружается из БД при первом обращении и живёт TTL секунд. Пользователи
+без друзей в номера не переводятся (их id мог прислать клиент), а
+запоминаются в отдельном ограниченном кэше «друзей нет» с тем же TTL.
+
+Обработчики, меняющие дружбу (respond, remove, cancel), вызывают
+add_friendship / remove_friendship: изменение применяется к индексу сразу
+и рассылается остальным репликам через core.pubsub.
+"""
+import sys
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Optional
+from uuid import UUID
+
+from core.config import setting_float, setting_int
+from core.db import db
+from core.pubsub import get_broker
+
+EVENTS_CHANNEL = "friends.graph"
+# Для memory_bytes без обхода графа: размер str с UUID и пустого array("I")
+UUID_STR_BYTES = sys.getsizeof("00000000-0000-0000-0000-000000000000")
+ARRAY_BYTES = sys.getsizeof(array("I"))
+
+
+def _contains(values: array, value: int) -> bool:
+    i = bisect_left(values, value)
+    return i < len(values) and values[i] == value
+
+
+def intersect_sorted(a: array, b: array) -> list[int]:
+    """
+    Пересечение двух отсортированных массивов. Если один сильно меньше
+    другого, элементы меньшего ищутся бинарным поиском (O(m log n)),
+    иначе — слияние двумя указателями (O(m + n)).
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    if not a:
+        return []
+    if len(a) * 8 < len(b):
+        result, low = [], 0
+        for value in a:
+            low = bisect_left(b, value, low)
+            if low == len(b):
+                break
+            if b[low] == value:
+                result.append(value)
+        return result
+
+    result, i, j = [], 0, 0
+    while i < len(a) and j < len(b):
+        if a[i] < b[j]:
+            i += 1
+        elif a[i] > b[j]:
+            j += 1
+        else:
+            result.append(a[i])
+            i += 1
+            j += 1
+    return result
+
+
+class FriendGraph:
+    def __init__(self, max_users: int = 100000, ttl: float = 300.0, max_empty: int = 10000):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.max_empty = max_empty
+        self._numbers: dict[str, int] = {}
+        self._ids: list[str] = []
+        # номер пользователя -> (загружено до, отсортированные номера друзей)
+        self._adjacency: "OrderedDict[int, tuple[float, array]]" = OrderedDict()
+        # Сумма длин загруженных списков: stats() не должен обходить граф
+        self._edges = 0
+        # id пользователей без друзей -> до какого момента это считается верным
+        self._empty: "OrderedDict[str, float]" = OrderedDict()
+        # Растёт при каждом изменении: список, загруженный во время изменения, не кэшируем
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _number(self, user_id: str) -> int:
+        number = self._numbers.get(user_id)
+        if number is None:
+            number = self._numbers[user_id] = len(self._ids)
+            self._ids.append(user_id)
+        return number
+
+    def _loaded(self, number: int) -> Optional[array]:
+        entry = self._adjacency.get(number)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self._forget(number)
+            return None
+        self._adjacency.move_to_end(number)
+        return entry[1]
+
+    async def _neighbours(self, user_id: str) -> array:
+        # id подставляется в фильтр or_: только UUID, в каноническом виде
+        user_id = str(UUID(user_id))
+        number = self._numbers.get(user_id)
+        friends = self._loaded(number) if number is not None else None
+        if friends is not None:
+            self.hits += 1
+            return friends
+        if self._known_empty(user_id):
+            self.hits += 1
+            return array("I")
+
+        self.misses += 1
+        generation = self._generation
+        response = await db.table("friends") \
+            .select("sender_id, receiver_id") \
+            .eq("status", "accepted") \
+            .or_(f"sender_id.eq.{user_id},receiver_id.eq.{user_id}") \
+            .execute()
+        friends = array("I", sorted({
+            self._number(row["receiver_id"] if row["sender_id"] == user_id else row["sender_id"])
+            for row in response.data
+        }))
+        if generation != self._generation:
+            return friends
+        # Без строк в БД id не подтверждён (или у пользователя нет друзей) —
+        # номер ему не выдаём, иначе случайные id из запросов копились бы вечно
+        if not response.data:
+            self._empty[user_id] = time.monotonic() + self.ttl
+            self._empty.move_to_end(user_id)
+            while len(self._empty) > self.max_empty:
+                self._empty.popitem(last=False)
+            return friends
+        number = self._number(user_id)
+        # Параллельный промах по тому же пользователю мог уже сохранить список
+        self._forget(number)
+        self._adjacency[number] = (time.monotonic() + self.ttl, friends)
+        self._edges += len(friends)
+        while len(self._adjacency) > self.max_users:
+            self._forget(next(iter(self._adjacency)))
+        return friends
+
+    def _known_empty(self, user_id: str) -> bool:
+        expires = self._empty.get(user_id)
+        if expires is None:
+            return False
+        if expires <= time.monotonic():
+            del self._empty[user_id]
+            return False
+        self._empty.move_to_end(user_id)
+        return True
+
+    def _forget(self, number: int) -> None:
+        entry = self._adjacency.pop(number, None)
+        if entry is not None:
+            self._edges -= len(entry[1])
+
+    async def friends(self, user_id: str) -> list[str]:
+        return [self._ids[number] for number in await self._neighbours(user_id)]
+
+    async def are_friends(self, user_id: str, other_id: str) -> bool:
+        other = self._numbers.get(other_id)
+        if other is None:
+            # Пользователь ни разу не встречался — догружаем список первого
+            return other_id in await self.friends(user_id)
+        return _contains(await self._neighbours(user_id), other)
+
+    async def mutual_friends(self, user_id: str, other_id: str) -> list[str]:
+        numbers = intersect_sorted(await self._neighbours(user_id), await self._neighbours(other_id))
+        return [self._ids[number] for number in numbers]
+
+    def apply(self, op: str, user_id: str, other_id: str) -> None:
+        """Применяет изменение к уже загруженным спискам обоих пользователей."""
+        self._generation += 1
+        if op == "add":
+            self._empty.pop(user_id, None)
+            self._empty.pop(other_id, None)
+        for owner_id, friend_id in ((user_id, other_id), (other_id, user_id)):
+            owner = self._numbers.get(owner_id)
+            friends = self._loaded(owner) if owner is not None else None
+            if friends is None:
+                continue
+            if op == "add":
+                # Событие отправляет обработчик после записи в БД — id настоящий
+                friend = self._number(friend_id)
+                if not _contains(friends, friend):
+                    insort(friends, friend)
+                    self._edges += 1
+            elif op == "remove":
+                friend = self._numbers.get(friend_id)
+                if friend is not None and _contains(friends, friend):
+                    friends.pop(bisect_left(friends, friend))
+                    self._edges -= 1
+
+    def memory_bytes(self) -> int:
+        """Оценка по счётчикам (id — строки UUID, 4 байта на ребро), без обхода графа."""
+        total = sys.getsizeof(self._numbers) + sys.getsizeof(self._ids) + sys.getsizeof(self._adjacency)
+        total += sys.getsizeof(self._empty) + UUID_STR_BYTES * (len(self._ids) + len(self._empty))
+        return total + ARRAY_BYTES * len(self._adjacency) + 4 * self._edges
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._adjacency),
+            "known_ids": len(self._ids),
+            "edges": self._edges,
+            "known_empty": len(self._empty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "memory_bytes": self.memory_bytes(),
+        }
+
+
+_graph: Optional[FriendGraph] = None
+
+
+def get_friend_graph() -> FriendGraph:
+    global _graph
+    if _graph is None:
+        _graph = FriendGraph(
+            max_users=setting_int("FRIEND_GRAPH_USERS", 100000),
+            ttl=setting_float("FRIEND_GRAPH_TTL", 300),
+            max_empty=setting_int("FRIEND_GRAPH_EMPTY_SIZE", 10000),
+        )
+        get_broker().subscribe(EVENTS_CHANNEL, _on_event)
+    return _graph
+
+
+async def _on_event(message: dict) -> None:
+    if _graph is not None:
+        _graph.apply(message["op"], message["user_id"], message["other_id"])
+
+
+async def _publish(op: str, user_id: str, other_id: str) -> None:
+    get_friend_graph().apply(op, user_id, other_id)
+    await get_broker().publish(EVENTS_CHANNEL, {"op": op, "user_id": user_id, "other_id": other_id})
+
+
+async def add_friendship(user_id: str, other_id: str) -> None:
+    await _publish("add", user_id, other_id)
+
+
+async def remove_friendship(user_id: str, other_id: str) -> None:
+    await _publish("remove", user_id, other_id)
+
+
+def friend_graph_stats() -> Optional[dict]:
+    return _graph.stats() if _graph is not None else None
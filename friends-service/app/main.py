@@ -1,8 +1,27 @@
 from fastapi import FastAPI
 from .routes.friends import router as friends_router
 from fastapi.middleware.cors import CORSMiddleware
+from core.diagnostics import register_stats, router as diagnostics_router
+from core.etag import ETagMiddleware
+from core.ratelimit import RateLimitMiddleware
+from core.metrics import MetricsMiddleware, router as metrics_router
+from core.lifespan import lifespan, on_startup, on_shutdown
+from core.notifications import notification_stats, router as notifications_router
+from .graph import friend_graph_stats
+from .suggestions import start_suggestions_job, stop_suggestions_job
 
-app = FastAPI()
+on_startup(start_suggestions_job)
+on_shutdown(stop_suggestions_job)
+register_stats("friend_graph", friend_graph_stats)
+register_stats("notifications", notification_stats)
+
+app = FastAPI(lifespan=lifespan)
+
+# ETag и 304 для списков, которые клиент опрашивает
+app.add_middleware(ETagMiddleware, paths=(r"/friends/friendsList", r"/friends/requests"))
+
+# Частые запросы одного клиента отклоняются 429 до обработчика (внутри CORS)
+app.add_middleware(RateLimitMiddleware)
 
 # Разрешаем CORS для фронтенда
 app.add_middleware(
@@ -13,4 +32,11 @@ app.add_middleware(
     allow_headers=["*"],  # Разрешаем все заголовки
 )
 
-app.include_router(friends_router)
\ No newline at end of file
+# Время ответов по шаблонам маршрутов для /metrics; снаружи всех, чтобы
+# учитывать и ответы CORS, лимита запросов и 304
+app.add_middleware(MetricsMiddleware)
+
+app.include_router(friends_router)
+app.include_router(notifications_router)
+app.include_router(diagnostics_router)
+app.include_router(metrics_router)
\ No newline at end of file
@@ -1,71 +1,56 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from uuid import uuid4
-from ..database import supabase
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from postgrest.exceptions import APIError
+from typing import Optional
+from uuid import UUID
+from core.db import db
+from core.auth import get_current_user
+from core.notifications import notify
+from core.profiles import get_profile_cache, project
+from ..graph import add_friendship, get_friend_graph, remove_friendship
 from ..schemas import FriendRequest
 
 router = APIRouter(prefix="/friends")
 
-async def get_current_user(request: Request):
-    token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    try:
-        return supabase.auth.get_user(token)
-    except:
-        raise HTTPException(status_code=401, detail="Invalid token")
+PROFILE_COLUMNS = ("user_id", "username", "first_name", "avatar_url")
 
 @router.post("/request")
-async def send_friend_request(data: FriendRequest, user=Depends(get_current_user)):
-    sender_id = user.user.id
-    profile = supabase.table("profiles") \
-            .select("*") \
-            .eq("user_id", sender_id) \
-            .single() \
-            .execute()
-    sender_username = profile.data.get("username")
-    receiver_username = data.receiver_username
-
-    # Получаем профиль по username
-    receiver_profile = supabase.table("profiles") \
-        .select("user_id") \
-        .eq("username", receiver_username) \
-        .maybe_single() \
-        .execute()
-    
-    if not receiver_profile:
-        raise HTTPException(status_code=404, detail="Пользователь не найден")
-
-    receiver_id = receiver_profile.data["user_id"]
-    
-    if sender_id == receiver_id:
-        raise HTTPException(status_code=400, detail="Нельзя добавить самого себя")
-
-    # Проверка на существующую заявку или дружбу
-    sent = supabase.table("friends") \
-        .select("id") \
-        .eq("sender_id", sender_id) \
-        .eq("receiver_id", receiver_id) \
-        .maybe_single() \
-        .execute()
-
-    received = supabase.table("friends") \
-        .select("id") \
-        .eq("sender_id", receiver_id) \
-        .eq("receiver_id", sender_id) \
-        .maybe_single() \
-        .execute()
-
-    if (sent and sent.data) or (received and received.data):
+async def send_friend_request(
+    data: FriendRequest,
+    user=Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None),
+):
+    """
+    Одна RPC: поиск получателя, проверка существующей заявки или дружбы и
+    вставка выполняются атомарно. Повтор с тем же заголовком Idempotency-Key
+    возвращает исходный результат, а не ошибку.
+    """
+    try:
+        response = await db.rpc("send_friend_request", {
+            "p_sender_id": user.user.id,
+            "p_receiver_username": data.receiver_username,
+            "p_idempotency_key": idempotency_key,
+        }).execute()
+    except APIError as e:
+        if e.code == "P0002":
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        if e.code == "22023":
+            raise HTTPException(status_code=400, detail="Нельзя добавить самого себя")
+        if e.code == "23505":
+            raise HTTPException(status_code=422, detail="Idempotency-Key уже использован для другой заявки")
+        raise HTTPException(status_code=500, detail=f"Ошибка при отправке заявки: {e.message}")
+
+    result = response.data
+    if result["result"] == "exists":
         raise HTTPException(status_code=400, detail="Вы уже отправили заявку или уже друзья")
 
-    supabase.table("friends").insert({
-        "id": str(uuid4()),
-        "sender_id": sender_id,
-        "receiver_id": receiver_id,
-        "status": "pending",
-        "sender_name": sender_username,
-        "receiver_name": receiver_username,
-    }).execute()
+    if result["result"] == "created":
+        await notify(
+            result["receiver_id"],
+            {"type": "friend_request.new", "request_id": result["id"], "user_id": user.user.id},
+            "friend_requests", 1,
+        )
 
-    return {"message": "Заявка отправлена"}
+    return {"message": "Заявка отправлена", "id": result["id"]}
 
 @router.patch("/respond")
 async def respond_to_request(data: FriendRequest, user=Depends(get_current_user)):
@@ -73,22 +58,18 @@ async def respond_to_request(data: FriendRequest, user=Depends(get_current_user)
     sender_username = data.receiver_username  # переворачиваем
 
     # Получаем профиль по username
-    sender_profile = supabase.table("profiles") \
-        .select("user_id") \
-        .eq("username", sender_username) \
-        .maybe_single() \
-        .execute()
+    sender_profile = await get_profile_cache().get_by_username(sender_username)
     
     if not sender_profile:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
-    sender_id = sender_profile.data["user_id"]
+    sender_id = sender_profile["user_id"]
 
     if data.status not in ["accepted", "rejected"]:
         raise HTTPException(status_code=400, detail="Неверный статус")
 
     # Проверка наличия заявки
-    request = supabase.table("friends") \
+    request = await db.table("friends") \
         .select("*") \
         .eq("sender_id", sender_id) \
         .eq("receiver_id", receiver_id) \
@@ -99,48 +80,39 @@ async def respond_to_request(data: FriendRequest, user=Depends(get_current_user)
     if not request.data:
         raise HTTPException(status_code=404, detail="Заявка не найдена")
 
-    supabase.table("friends") \
+    await db.table("friends") \
         .update({"status": data.status}) \
         .eq("id", request.data["id"]) \
         .execute()
 
+    if data.status == "accepted":
+        await add_friendship(sender_id, receiver_id)
+
+    event = {"type": f"friend_request.{data.status}", "request_id": request.data["id"]}
+    await notify(sender_id, {**event, "user_id": receiver_id})
+    await notify(receiver_id, {**event, "user_id": sender_id}, "friend_requests", -1)
+
     return {"message": f"Заявка {data.status}"}
 
 @router.get("/friendsList")
 async def get_friends(user=Depends(get_current_user)):
-    user_id = user.user.id
-
-    # Друзья = где accepted и user — участник
-    friends = supabase.table("friends") \
-        .select("*") \
-        .or_(
-            f"and(sender_id.eq.{user_id},status.eq.accepted),and(receiver_id.eq.{user_id},status.eq.accepted)"
-        ) \
-        .execute()
-
-    friend_ids = [
-        f["receiver_id"] if f["sender_id"] == user_id else f["sender_id"]
-        for f in friends.data
-    ]
+    # Друзья берутся из индекса графа, профили — одним запросом к кэшу
+    friend_ids = await get_friend_graph().friends(user.user.id)
+    profiles = await get_profile_cache().get_many(friend_ids)
 
-    profiles = supabase.table("profiles") \
-        .select("user_id, username, first_name, avatar_url") \
-        .in_("user_id", friend_ids) \
-        .execute()
-
-    return profiles.data
+    return [project(profiles[friend_id], PROFILE_COLUMNS) for friend_id in friend_ids if friend_id in profiles]
 
 @router.get("/requests")
 async def get_friend_requests(user=Depends(get_current_user)):
     user_id = user.user.id
 
-    incoming = supabase.table("friends") \
+    incoming = await db.table("friends") \
         .select("*") \
         .eq("receiver_id", user_id) \
         .eq("status", "pending") \
         .execute()
 
-    outgoing = supabase.table("friends") \
+    outgoing = await db.table("friends") \
         .select("*") \
         .eq("sender_id", user_id) \
         .or_("status.eq.pending,status.eq.rejected") \
@@ -153,46 +125,94 @@ async def get_friend_requests(user=Depends(get_current_user)):
 
 @router.delete("/cancel-request/{requestId}")
 async def cancel_friend_request(requestId: str, user=Depends(get_current_user)):
-    supabase.table("friends") \
+    deleted = await db.table("friends") \
         .delete() \
         .eq("id", requestId) \
         .execute()
 
+    for row in deleted.data:
+        if row["status"] == "accepted":
+            await remove_friendship(row["sender_id"], row["receiver_id"])
+        elif row["status"] == "pending":
+            await notify(
+                row["receiver_id"],
+                {"type": "friend_request.cancelled", "request_id": row["id"], "user_id": row["sender_id"]},
+                "friend_requests", -1,
+            )
+
     return {"message": "Заявка отменена"}
 
-@router.get("/{user_id}")
-async def get_profile(user_id: str):
-    profile = supabase.table("profiles") \
-        .select("user_id, username, first_name, avatar_url") \
+@router.get("/suggestions")
+async def get_suggestions(limit: int = Query(10, ge=1, le=50), user=Depends(get_current_user)):
+    """
+    Возможные друзья из friend_suggestions (их пересчитывает app.suggestions).
+    Те, с кем пользователь подружился уже после расчёта, отбрасываются.
+    """
+    user_id = user.user.id
+
+    response = await db.table("friend_suggestions") \
+        .select("candidates, mutual_counts") \
         .eq("user_id", user_id) \
-        .single() \
+        .maybe_single() \
         .execute()
 
-    if not profile.data:
+    if not response or not response.data:
+        return []
+
+    friends = set(await get_friend_graph().friends(user_id))
+    picked = [
+        (candidate, count)
+        for candidate, count in zip(response.data["candidates"], response.data["mutual_counts"])
+        if candidate not in friends
+    ][:limit]
+
+    profiles = await get_profile_cache().get_many(candidate for candidate, _ in picked)
+    return [
+        {**project(profiles[candidate], PROFILE_COLUMNS), "mutual_count": count}
+        for candidate, count in picked
+        if candidate in profiles
+    ]
+
+@router.get("/mutual/{user_id}")
+async def get_mutual_friends(user_id: UUID, user=Depends(get_current_user)):
+    mutual = await get_friend_graph().mutual_friends(user.user.id, str(user_id))
+    profiles = await get_profile_cache().get_many(mutual)
+
+    return {
+        "count": len(mutual),
+        "friends": [project(profiles[friend_id], PROFILE_COLUMNS) for friend_id in mutual if friend_id in profiles],
+    }
+
+@router.get("/{user_id}")
+async def get_profile(user_id: UUID):
+    profile = await get_profile_cache().get(str(user_id))
+
+    if not profile:
         raise HTTPException(status_code=404, detail="Профиль не найден")
 
-    return profile.data
+    return project(profile, PROFILE_COLUMNS)
 
 @router.delete("/remove/{friend_id}")
-async def remove_friend(friend_id: str, user=Depends(get_current_user)):
+async def remove_friend(friend_id: UUID, user=Depends(get_current_user)):
     user_id = user.user.id
+    # UUID из пути подставляется в фильтр or_ — произвольная строка изменила бы сам фильтр
+    friend_id = str(friend_id)
 
-    friendship = supabase.table("friends") \
-        .select("*") \
+    if not await get_friend_graph().are_friends(user_id, friend_id):
+        raise HTTPException(status_code=404, detail="Дружба не найдена")
+
+    # Удаляем дружбу сразу, без отдельного поиска строки
+    deleted = await db.table("friends") \
+        .delete() \
         .or_(
             f"and(sender_id.eq.{user_id},receiver_id.eq.{friend_id},status.eq.accepted)," +
             f"and(sender_id.eq.{friend_id},receiver_id.eq.{user_id},status.eq.accepted)"
         ) \
-        .maybe_single() \
         .execute()
 
-    if not friendship or not friendship.data:
-        raise HTTPException(status_code=404, detail="Дружба не найдена")
+    await remove_friendship(user_id, friend_id)
 
-    # Удаляем найденную заявку
-    supabase.table("friends") \
-        .delete() \
-        .eq("id", friendship.data["id"]) \
-        .execute()
+    if not deleted.data:
+        raise HTTPException(status_code=404, detail="Дружба не найдена")
 
-    return {"message": "Друг удалён"}
\ No newline at end of file
+    return {"message": "Друг удалён"}
@@ -0,0 +1,245 @@
+"""
+«Возможные друзья»: пакетный расчёт по всему графу дружбы.
+
+Задача периодически выгружает принятые дружбы, строит разреженную матрицу
+смежности A (CSR) и считает A @ A по блокам строк: значение в ячейке
+(u, v) — число общих друзей. Из строки убираются сам пользователь и его
+текущие друзья, остаются top-K кандидатов. Результат хранится одной
+строкой на пользователя в friend_suggestions (массивы candidates и
+mutual_counts), поэтому GET /friends/suggestions — один запрос по ключу.
+
+SUGGESTIONS_INTERVAL задаёт период в секундах; по умолчанию 0 — задача
+не запускается. Включённая на нескольких репликах, она выполняется раз в
+период только на одной: право на запуск — ключ в Redis (SET NX), живущий
+весь период, поэтому и перезапуск сервиса не пересчитывает граф заново.
+Без REDIS_URL ключ виден только своему процессу — тогда включайте задачу
+на одной реплике. Разовый запуск:
+    python -m app.suggestions
+
+numpy и scipy импортируются при первом расчёте, а не при старте сервиса.
+"""
+import asyncio
+import contextlib
+import logging
+import time
+from array import array
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Optional
+
+from core.config import setting_float, setting_int
+from core.db import db
+from core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+if TYPE_CHECKING:
+    import numpy as np
+    import scipy.sparse as sp
+
+TOP_K = setting_int("SUGGESTIONS_TOP_K", 20)
+INTERVAL = setting_float("SUGGESTIONS_INTERVAL", 0)
+LOCK_KEY = "friends:suggestions:lock"
+# Как часто реплика проверяет, не пора ли ей выполнить расчёт
+LOCK_POLL = 60.0
+PAGE_SIZE = 10000
+WRITE_BATCH = 1000
+# Строк матрицы на один блок произведения: ограничивает пиковую память
+CHUNK_ROWS = 50000
+
+
+def adjacency_matrix(rows: "np.ndarray", cols: "np.ndarray", n_users: int) -> "sp.csr_matrix":
+    """Симметричная 0/1-матрица смежности по списку рёбер (каждое ребро один раз)."""
+    import numpy as np
+    import scipy.sparse as sp
+
+    adjacency = sp.csr_matrix(
+        (
+            np.ones(2 * len(rows), dtype=np.int32),
+            (np.concatenate([rows, cols]), np.concatenate([cols, rows])),
+        ),
+        shape=(n_users, n_users),
+    )
+    adjacency.sum_duplicates()
+    adjacency.data[:] = 1
+    return adjacency
+
+
+def top_k_suggestions(
+    adjacency: "sp.csr_matrix",
+    top_k: int = TOP_K,
+    chunk_rows: int = CHUNK_ROWS,
+) -> tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """
+    Для каждого пользователя — до top_k не-друзей с наибольшим числом общих
+    друзей. Результат в виде CSR: indptr (n_users + 1), candidates, mutual_counts.
+    """
+    import numpy as np
+
+    n_users = adjacency.shape[0]
+    counts_per_row = np.zeros(n_users, dtype=np.int64)
+    candidates, scores = [], []
+
+    for start in range(0, n_users, chunk_rows):
+        stop = min(start + chunk_rows, n_users)
+        block = adjacency[start:stop]
+        mutual = (block @ adjacency).tocsr()
+
+        # Убираем текущих друзей и самого пользователя
+        mutual = mutual - mutual.multiply(block)
+        row_of = np.repeat(np.arange(stop - start), np.diff(mutual.indptr))
+        mutual.data[mutual.indices == row_of + start] = 0
+        mutual.eliminate_zeros()
+
+        # top-K в каждой строке без цикла по строкам: сортируем все ячейки
+        # блока по (строка, -общих друзей, кандидат) и берём первые K в строке.
+        # Три ключа упаковываются в одно int64 — argsort так в разы быстрее lexsort
+        row_of = np.repeat(np.arange(stop - start), np.diff(mutual.indptr))
+        top = int(mutual.data.max()) if mutual.nnz else 0
+        if (stop - start) * (top + 1) * n_users < 2 ** 62:
+            order = np.argsort((row_of.astype(np.int64) * (top + 1) + (top - mutual.data)) * n_users + mutual.indices)
+        else:
+            order = np.lexsort((mutual.indices, -mutual.data, row_of))
+        rank = np.arange(len(order)) - mutual.indptr[row_of[order]]
+        keep = order[rank < top_k]
+
+        counts_per_row[start:stop] = np.bincount(row_of[keep], minlength=stop - start)
+        candidates.append(mutual.indices[keep].astype(np.int32))
+        scores.append(mutual.data[keep].astype(np.int32))
+
+    indptr = np.zeros(n_users + 1, dtype=np.int64)
+    np.cumsum(counts_per_row, out=indptr[1:])
+    empty = [np.empty(0, dtype=np.int32)]
+    return indptr, np.concatenate(candidates or empty), np.concatenate(scores or empty)
+
+
+async def load_friend_edges() -> tuple[list[str], "np.ndarray", "np.ndarray"]:
+    """Принятые дружбы постранично (keyset по id): id пользователей и рёбра в их номерах."""
+    import numpy as np
+
+    numbers: dict[str, int] = {}
+    ids: list[str] = []
+    rows, cols = array("I"), array("I")
+
+    def number(user_id: str) -> int:
+        value = numbers.get(user_id)
+        if value is None:
+            value = numbers[user_id] = len(ids)
+            ids.append(user_id)
+        return value
+
+    last_id = None
+    while True:
+        query = db.table("friends") \
+            .select("id, sender_id, receiver_id") \
+            .eq("status", "accepted") \
+            .order("id") \
+            .limit(PAGE_SIZE)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        page = (await query.execute()).data
+
+        for row in page:
+            rows.append(number(row["sender_id"]))
+            cols.append(number(row["receiver_id"]))
+        if len(page) < PAGE_SIZE:
+            break
+        last_id = page[-1]["id"]
+
+    return ids, np.frombuffer(rows, dtype=np.uint32), np.frombuffer(cols, dtype=np.uint32)
+
+
+async def store_suggestions(ids: list[str], indptr: "np.ndarray", candidates: "np.ndarray", scores: "np.ndarray") -> int:
+    import numpy as np
+
+    computed_at = datetime.now(timezone.utc).isoformat()
+    batch, written = [], 0
+    for user in np.flatnonzero(np.diff(indptr)):
+        begin, end = indptr[user], indptr[user + 1]
+        batch.append({
+            "user_id": ids[user],
+            "candidates": [ids[c] for c in candidates[begin:end]],
+            "mutual_counts": scores[begin:end].tolist(),
+            "computed_at": computed_at,
+        })
+        if len(batch) >= WRITE_BATCH:
+            await db.table("friend_suggestions").upsert(batch).execute()
+            written += len(batch)
+            batch = []
+    if batch:
+        await db.table("friend_suggestions").upsert(batch).execute()
+        written += len(batch)
+
+    # У кого кандидатов больше нет — старые строки удаляем
+    await db.table("friend_suggestions") \
+        .delete() \
+        .lt("computed_at", computed_at) \
+        .execute()
+    return written
+
+
+async def refresh_suggestions() -> dict:
+    started = time.perf_counter()
+    ids, rows, cols = await load_friend_edges()
+    loaded = time.perf_counter()
+
+    def compute():
+        return top_k_suggestions(adjacency_matrix(rows, cols, len(ids)))
+
+    # Произведение матриц считается в потоке, event loop продолжает отвечать
+    indptr, candidates, scores = await asyncio.to_thread(compute)
+    computed = time.perf_counter()
+    written = await store_suggestions(ids, indptr, candidates, scores)
+
+    return {
+        "users": len(ids),
+        "edges": len(rows),
+        "users_with_suggestions": written,
+        "load_s": loaded - started,
+        "compute_s": computed - loaded,
+        "store_s": time.perf_counter() - computed,
+    }
+
+
+_task: Optional[asyncio.Task] = None
+
+
+async def _acquire_period() -> bool:
+    """True — в этом периоде расчёт выполняет эта реплика."""
+    return bool(await get_redis().set(LOCK_KEY, "1", px=int(INTERVAL * 1000), nx=True))
+
+
+async def _refresh_forever() -> None:
+    while True:
+        try:
+            if await _acquire_period():
+                logger.info("friend suggestions refreshed: %s", await refresh_suggestions())
+        except Exception:
+            logger.exception("friend suggestions refresh failed")
+        await asyncio.sleep(min(INTERVAL, LOCK_POLL))
+
+
+async def start_suggestions_job() -> None:
+    global _task
+    if INTERVAL > 0:
+        _task = asyncio.create_task(_refresh_forever())
+
+
+async def stop_suggestions_job() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _task
+    _task = None
+
+
+if __name__ == "__main__":
+    from core.db import close_db
+
+    async def main():
+        try:
+            print(await refresh_suggestions())
+        finally:
+            await close_db()
+
+    asyncio.run(main())
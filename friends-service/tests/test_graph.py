@@ -0,0 +1,115 @@
+import uuid
+from array import array
+
+import pytest
+
+from app import graph
+from app.graph import FriendGraph, intersect_sorted
+
+pytestmark = pytest.mark.anyio
+
+ALICE, BOB, CAROL, DAVE = (str(uuid.uuid4()) for _ in range(4))
+
+
+class FakeFriends:
+    """Таблица friends: принятые дружбы, фильтр or_ по одному пользователю."""
+
+    def __init__(self, pairs):
+        self.pairs = list(pairs)
+        self.queries = 0
+
+    def table(self, name):
+        assert name == "friends"
+        return self
+
+    def select(self, *columns):
+        return self
+
+    def eq(self, column, value):
+        return self
+
+    def or_(self, condition):
+        self._user = condition.split(",")[0].split(".eq.")[1]
+        return self
+
+    async def execute(self):
+        self.queries += 1
+        result = type("Response", (), {})()
+        result.data = [
+            {"sender_id": a, "receiver_id": b} for a, b in self.pairs if self._user in (a, b)
+        ]
+        return result
+
+
+@pytest.fixture
+def table(monkeypatch):
+    table = FakeFriends([(ALICE, BOB), (CAROL, ALICE), (BOB, CAROL)])
+    monkeypatch.setattr(graph, "db", table)
+    return table
+
+
+async def test_friends_are_loaded_once(table):
+    friends = FriendGraph()
+
+    assert set(await friends.friends(ALICE)) == {BOB, CAROL}
+    assert await friends.are_friends(ALICE, BOB)
+    assert not await friends.are_friends(ALICE, DAVE)
+    assert table.queries == 1
+    assert friends.stats()["edges"] == 2
+
+
+async def test_mutual_friends(table):
+    assert await FriendGraph().mutual_friends(ALICE, BOB) == [CAROL]
+
+
+async def test_user_without_friends_is_cached_without_number(table):
+    friends = FriendGraph()
+
+    assert await friends.friends(DAVE) == []
+    assert await friends.friends(DAVE) == []
+    assert table.queries == 1
+    assert DAVE not in friends._numbers
+    assert friends.stats()["known_empty"] == 1
+
+
+async def test_empty_cache_is_bounded(table):
+    friends = FriendGraph(max_empty=2)
+    for _ in range(3):
+        await friends.friends(str(uuid.uuid4()))
+    assert friends.stats()["known_empty"] == 2
+
+
+async def test_new_friendship_clears_empty_entry(table):
+    friends = FriendGraph()
+    await friends.friends(DAVE)
+
+    table.pairs.append((DAVE, ALICE))
+    friends.apply("add", DAVE, ALICE)
+
+    assert await friends.friends(DAVE) == [ALICE]
+
+
+async def test_apply_updates_loaded_lists(table):
+    friends = FriendGraph()
+    await friends.friends(ALICE)
+    await friends.friends(BOB)
+
+    friends.apply("remove", ALICE, BOB)
+    assert not await friends.are_friends(ALICE, BOB)
+    assert not await friends.are_friends(BOB, ALICE)
+    assert friends.stats()["edges"] == 2
+    assert table.queries == 2
+
+
+async def test_memory_bytes_in_stats(table):
+    friends = FriendGraph()
+    empty = friends.stats()["memory_bytes"]
+    await friends.friends(ALICE)
+    assert friends.stats()["memory_bytes"] > empty
+
+
+def test_intersect_sorted():
+    small, large = array("I", [3, 50, 99]), array("I", range(0, 100, 3))
+    assert intersect_sorted(small, large) == [3, 99]
+    assert intersect_sorted(array("I", [1, 2, 3]), array("I", [2, 3, 4])) == [2, 3]
+    assert intersect_sorted(array("I"), large) == []
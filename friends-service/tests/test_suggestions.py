@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from app import suggestions
+from app.suggestions import adjacency_matrix, top_k_suggestions
+from core.redis_client import LocalRedis
+
+pytestmark = pytest.mark.anyio
+
+# 0 - 1 - 2 - 3,  0 - 4 - 2,  0 - 5,  1 - 0 (дубль в обратную сторону)
+EDGES = [(0, 1), (1, 2), (2, 3), (0, 4), (4, 2), (0, 5), (1, 0)]
+
+
+def suggestions_by_user(top_k: int, chunk_rows: int = 2) -> dict[int, list[tuple[int, int]]]:
+    rows = np.array([a for a, _ in EDGES], dtype=np.uint32)
+    cols = np.array([b for _, b in EDGES], dtype=np.uint32)
+    indptr, candidates, scores = top_k_suggestions(adjacency_matrix(rows, cols, 6), top_k, chunk_rows)
+    return {
+        user: list(zip(candidates[indptr[user]:indptr[user + 1]].tolist(), scores[indptr[user]:indptr[user + 1]].tolist()))
+        for user in range(6)
+    }
+
+
+def test_top_k_suggestions_on_toy_graph():
+    assert suggestions_by_user(top_k=10) == {
+        # у 0 и 2 двое общих друзей (1 и 4), друзья 0 не предлагаются
+        0: [(2, 2)],
+        1: [(4, 2), (3, 1), (5, 1)],
+        2: [(0, 2)],
+        3: [(1, 1), (4, 1)],
+        4: [(1, 2), (3, 1), (5, 1)],
+        5: [(1, 1), (4, 1)],
+    }
+
+
+def test_top_k_limits_and_breaks_ties_by_number():
+    found = suggestions_by_user(top_k=2)
+    assert found[1] == [(4, 2), (3, 1)]
+    assert all(len(candidates) <= 2 for candidates in found.values())
+
+
+def test_chunking_does_not_change_result():
+    assert suggestions_by_user(top_k=10, chunk_rows=1) == suggestions_by_user(top_k=10, chunk_rows=100)
+
+
+async def test_one_replica_runs_per_period(monkeypatch):
+    monkeypatch.setattr(suggestions, "INTERVAL", 3600.0)
+    redis = LocalRedis()
+    monkeypatch.setattr(suggestions, "get_redis", lambda: redis)
+
+    assert await suggestions._acquire_period()
+    assert not await suggestions._acquire_period()
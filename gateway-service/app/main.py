@@ -0,0 +1,128 @@
+"""
+Шлюз перед сервисами (замена gateway/default.conf).
+
+Токен проверяется здесь один раз (core.auth, локально по JWT и с кэшем),
+сервис получает подписанный заголовок X-Internal-Identity и не проверяет
+токен повторно. Нужен общий INTERNAL_IDENTITY_SECRET у шлюза и сервисов.
+"""
+import logging
+
+from fastapi import FastAPI, HTTPException, Request, WebSocket
+from fastapi.responses import JSONResponse, Response
+from starlette.requests import HTTPConnection
+
+from core.auth import IDENTITY_HEADER, extract_token, sign_identity, verifier
+from core.config import setting, setting_float
+from core.diagnostics import register_stats, router as diagnostics_router
+from core.lifespan import lifespan, on_shutdown
+from core.metrics import UNMATCHED, MetricsMiddleware, router as metrics_router
+from .microcache import CachedResponse, MicroCache, cache_key
+from .proxy import (
+    UPSTREAMS,
+    UpstreamError,
+    UpstreamTimeout,
+    Upstreams,
+    forward_headers,
+    forward_http,
+    forward_websocket,
+    request_target,
+    upstream_for,
+)
+
+logger = logging.getLogger(__name__)
+
+IDENTITY_SECRET = setting("INTERNAL_IDENTITY_SECRET")
+METHODS = ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEAD"]
+
+upstreams = Upstreams(UPSTREAMS)
+microcache = MicroCache(routes=(
+    # Публичный профиль: GET /friends/{user_id}
+    (r"/friends/[^/]+", setting_float("GATEWAY_MICROCACHE_TTL", 2)),
+))
+
+on_shutdown(upstreams.close)
+register_stats("gateway", upstreams.stats)
+register_stats("microcache", microcache.stats)
+
+if not IDENTITY_SECRET:
+    logger.warning("INTERNAL_IDENTITY_SECRET is not set: services will verify tokens themselves")
+
+
+def metrics_route(scope) -> str:
+    """Метка для /metrics: сервис, к которому ушёл запрос, а не "/{path:path}"."""
+    name = upstream_for(scope["path"])
+    if name is not None:
+        return f"upstream:{name}"
+    # Собственные маршруты шлюза (/metrics, /internal/...); остальное ушло в proxy как 404
+    route = scope.get("route")
+    return route.path if route is not None and route.endpoint is not proxy else UNMATCHED
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware, route=metrics_route)
+app.include_router(diagnostics_router)
+app.include_router(metrics_router)
+
+
+async def identity_headers(connection: HTTPConnection, token: str) -> dict[str, str]:
+    """
+    Подпись личности для сервиса. С невалидным токеном запрос уходит без
+    неё: сервис сам ответит 401 там, где авторизация нужна, а анонимные
+    маршруты продолжат работать.
+    """
+    if not token or not IDENTITY_SECRET:
+        return {}
+    try:
+        identity = await verifier.verify(token)
+    except HTTPException:
+        return {}
+    return {IDENTITY_HEADER.lower(): sign_identity(identity, IDENTITY_SECRET)}
+
+
+async def cached_get(name: str, request: Request, ttl: float) -> Response:
+    async def fetch() -> CachedResponse:
+        response = await upstreams.send(
+            name,
+            "GET",
+            request_target(request),
+            forward_headers(request.headers, request.client.host if request.client else None, {}),
+        )
+        return CachedResponse(response.status, response.headers, await response.read())
+
+    try:
+        cached, hit = await microcache.get(cache_key(request_target(request), request.headers), ttl, fetch)
+    except UpstreamTimeout:
+        return JSONResponse({"detail": "Gateway timeout"}, status_code=504)
+    except UpstreamError:
+        return JSONResponse({"detail": "Bad gateway"}, status_code=502)
+
+    response = Response(cached.body, status_code=cached.status)
+    response.raw_headers = cached.headers + [(b"x-cache", b"HIT" if hit else b"MISS")]
+    return response
+
+
+@app.api_route("/{path:path}", methods=METHODS)
+async def proxy(request: Request, path: str):
+    name = upstream_for(request.url.path)
+    if name is None:
+        return JSONResponse({"detail": "Not Found"}, status_code=404)
+
+    token = extract_token(request)
+    if request.method == "GET" and not token:
+        ttl = microcache.ttl_for(request.url.path)
+        if ttl is not None:
+            return await cached_get(name, request, ttl)
+
+    return await forward_http(upstreams, name, request, await identity_headers(request, token))
+
+
+@app.websocket("/{path:path}")
+async def proxy_socket(websocket: WebSocket, path: str):
+    name = upstream_for(websocket.url.path)
+    if name is None:
+        await websocket.close(code=1008)
+        return
+
+    # Браузер передаёт токен WebSocket в ?token=, заголовок — только не-браузерные клиенты
+    token = websocket.query_params.get("token") or extract_token(websocket)
+    await forward_websocket(UPSTREAMS[name], websocket, await identity_headers(websocket, token))
@@ -0,0 +1,121 @@
+"""
+Микрокэш анонимных GET на шлюзе.
+
+Ответ 200 на анонимный GET подходящего маршрута (например, GET
+/friends/{user_id}) хранится несколько секунд; одновременные промахи по
+одному ключу ждут один запрос к сервису, а не идут к нему все сразу.
+Запросы с Authorization и ответы с Set-Cookie или Cache-Control: private /
+no-store не кэшируются.
+
+Ключ — путь с query-строкой и заголовки запроса из VARY_ON: ответ с
+Access-Control-Allow-Origin одного сайта или сжатый gzip не должен уйти
+другому клиенту. Ответ с Vary по другим заголовкам не кэшируется.
+"""
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+NOT_CACHEABLE = (b"private", b"no-store", b"no-cache")
+# Заголовки запроса, входящие в ключ кэша
+VARY_ON = ("origin", "accept-encoding")
+
+
+def cache_key(target: str, request_headers) -> str:
+    return "\0".join([target, *(request_headers.get(name, "") for name in VARY_ON)])
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    status: int
+    headers: list[tuple[bytes, bytes]]
+    body: bytes
+
+    def cacheable(self) -> bool:
+        if self.status != 200:
+            return False
+        for name, value in self.headers:
+            name = name.lower()
+            if name == b"set-cookie":
+                return False
+            if name == b"cache-control" and any(word in value.lower() for word in NOT_CACHEABLE):
+                return False
+            if name == b"vary" and any(
+                field.strip().decode("latin-1") not in VARY_ON for field in value.lower().split(b",")
+            ):
+                return False
+        return True
+
+
+class MicroCache:
+    def __init__(self, routes: tuple[tuple[str, float], ...], max_size: int = 10000, max_body: int = 256 * 1024):
+        self.routes = [(re.compile(pattern), ttl) for pattern, ttl in routes if ttl > 0]
+        self.max_size = max_size
+        self.max_body = max_body
+        # ключ -> (истекает, ответ)
+        self._entries: "OrderedDict[str, tuple[float, CachedResponse]]" = OrderedDict()
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def ttl_for(self, path: str) -> Optional[float]:
+        for pattern, ttl in self.routes:
+            if pattern.fullmatch(path):
+                return ttl
+        return None
+
+    def _lookup(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def get(self, key: str, ttl: float, fetch: Callable[[], Awaitable[CachedResponse]]) -> tuple[CachedResponse, bool]:
+        """Ответ и признак попадания в кэш."""
+        cached = self._lookup(key)
+        if cached is not None:
+            self.hits += 1
+            return cached, True
+
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending), True
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            response = await fetch()
+        except BaseException as e:
+            future.set_exception(e)
+            # Ошибку ждавших запросов тоже нужно «получить», иначе asyncio ругается
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+        future.set_result(response)
+        if response.cacheable() and len(response.body) <= self.max_body:
+            self._entries[key] = (time.monotonic() + ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return response, False
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
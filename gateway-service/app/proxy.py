@@ -0,0 +1,316 @@
+"""
+Проксирование HTTP и WebSocket к сервисам.
+
+На каждый сервис — свой пул keep-alive соединений (nginx из
+gateway/default.conf открывает к сервису новое соединение на каждый
+запрос). По умолчанию это aiohttp с HTTP/1.1: uvicorn говорит только
+HTTP/1.1, а разбор ответов в aiohttp на C. GATEWAY_HTTP2=1 переключает пул
+на httpx с HTTP/2 (одно мультиплексированное соединение на сервис), если
+перед сервисами стоит сервер с h2c.
+
+Тела запросов передаются потоком. Ответы с Content-Length до
+GATEWAY_BUFFER_SIZE читаются целиком (как proxy_buffering в nginx) —
+StreamingResponse на каждый короткий JSON заметно дороже; остальные
+передаются потоком.
+"""
+import asyncio
+import contextlib
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+import aiohttp
+import httpx
+from starlette.background import BackgroundTask
+from starlette.requests import HTTPConnection, Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.websockets import WebSocket, WebSocketDisconnect
+from yarl import URL
+
+from core.auth import IDENTITY_HEADER
+from core.config import setting, setting_bool, setting_float, setting_int
+
+# Заголовки одного соединения (RFC 9110, 7.6.1) — дальше не передаются
+HOP_BY_HOP = frozenset((
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade",
+))
+HOP_BY_HOP_RAW = frozenset(name.encode() for name in HOP_BY_HOP)
+# Клиент не может прислать их сам: X-Forwarded-For дописывается, а подпись
+# личности ставит только шлюз
+DROPPED = HOP_BY_HOP | {"x-forwarded-for", IDENTITY_HEADER.lower()}
+# Маршрутизация как в gateway/default.conf: префикс пути -> сервис
+ROUTES = (
+    ("/auth/", "auth"),
+    ("/profile/", "auth"),
+    ("/servers/", "server"),
+    ("/friends/", "friends"),
+    ("/notifications/", "friends"),
+    ("/chat/", "chat"),
+)
+UPSTREAMS = {
+    "auth": setting("AUTH_SERVICE_URL", "http://auth-service:8000"),
+    "server": setting("SERVER_SERVICE_URL", "http://server-service:8000"),
+    "friends": setting("FRIENDS_SERVICE_URL", "http://friends-service:8000"),
+    "chat": setting("CHAT_SERVICE_URL", "http://chat-service:8000"),
+}
+
+
+def upstream_for(path: str) -> Optional[str]:
+    for prefix, upstream in ROUTES:
+        if path.startswith(prefix):
+            return upstream
+    return None
+
+
+class UpstreamError(Exception):
+    """Сервис недоступен или оборвал ответ."""
+
+
+class UpstreamTimeout(UpstreamError):
+    pass
+
+
+@dataclass
+class UpstreamResponse:
+    status: int
+    # Без заголовков соединения
+    headers: list[tuple[bytes, bytes]]
+    length: Optional[int]
+    chunks: AsyncIterator[bytes]
+    # Возвращает соединение в пул (или закрывает, если тело не дочитано)
+    close: Callable[[], Awaitable[None]]
+
+    async def read(self) -> bytes:
+        try:
+            return b"".join([chunk async for chunk in self.chunks])
+        except (aiohttp.ClientError, httpx.HTTPError, asyncio.TimeoutError) as e:
+            raise UpstreamError(str(e)) from e
+        finally:
+            await self.close()
+
+
+def _end_to_end(raw_headers) -> list[tuple[bytes, bytes]]:
+    return [(name, value) for name, value in raw_headers if name.lower() not in HOP_BY_HOP_RAW]
+
+
+def _content_length(headers: list[tuple[bytes, bytes]]) -> Optional[int]:
+    for name, value in headers:
+        if name.lower() == b"content-length" and value.isdigit():
+            return int(value)
+    return None
+
+
+class Upstreams:
+    def __init__(self, urls: dict[str, str]):
+        self.urls = urls
+        self.http2 = setting_bool("GATEWAY_HTTP2")
+        self.timeout = setting_float("GATEWAY_TIMEOUT", 30)
+        self.pool_size = setting_int("GATEWAY_POOL_SIZE", 200)
+        self.buffer_size = setting_int("GATEWAY_BUFFER_SIZE", 64 * 1024)
+        self._sessions: dict[str, aiohttp.ClientSession] = {}
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self.requests = 0
+        self.errors = 0
+
+    def _session(self, name: str) -> aiohttp.ClientSession:
+        session = self._sessions.get(name)
+        if session is None:
+            session = self._sessions[name] = aiohttp.ClientSession(
+                self.urls[name],
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=None, connect=self.timeout, sock_read=self.timeout),
+                # Тело и Content-Encoding уходят клиенту как есть
+                auto_decompress=False,
+            )
+        return session
+
+    def _client(self, name: str) -> httpx.AsyncClient:
+        client = self._clients.get(name)
+        if client is None:
+            client = self._clients[name] = httpx.AsyncClient(
+                base_url=self.urls[name],
+                http1=False,
+                http2=True,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.pool_size, keepalive_expiry=60),
+            )
+        return client
+
+    async def send(
+        self,
+        name: str,
+        method: str,
+        target: str,
+        headers: list[tuple[str, str]],
+        body: Optional[AsyncIterator[bytes]] = None,
+    ) -> UpstreamResponse:
+        """target — путь с query-строкой; ответ нужно прочитать или закрыть."""
+        self.requests += 1
+        try:
+            if self.http2:
+                return await self._send_http2(name, method, target, headers, body)
+            return await self._send_http1(name, method, target, headers, body)
+        except UpstreamError:
+            self.errors += 1
+            raise
+
+    async def _send_http1(self, name, method, target, headers, body) -> UpstreamResponse:
+        try:
+            response = await self._session(name).request(
+                method,
+                # encoded: путь уходит байт в байт, без повторного кодирования
+                URL(target, encoded=True),
+                headers=headers,
+                data=body,
+                allow_redirects=False,
+                # Иначе aiohttp добавит свои User-Agent и Accept-Encoding
+                skip_auto_headers=("User-Agent", "Accept-Encoding"),
+            )
+        except asyncio.TimeoutError as e:
+            raise UpstreamTimeout(str(e)) from e
+        except aiohttp.ClientError as e:
+            raise UpstreamError(str(e)) from e
+
+        async def close() -> None:
+            response.release()
+
+        headers = _end_to_end(response.raw_headers)
+        return UpstreamResponse(response.status, headers, _content_length(headers), response.content.iter_any(), close)
+
+    async def _send_http2(self, name, method, target, headers, body) -> UpstreamResponse:
+        client = self._client(name)
+        try:
+            response = await client.send(
+                client.build_request(method, target, headers=headers, content=body),
+                stream=True,
+            )
+        except httpx.TimeoutException as e:
+            raise UpstreamTimeout(str(e)) from e
+        except httpx.HTTPError as e:
+            raise UpstreamError(str(e)) from e
+        headers = _end_to_end(response.headers.raw)
+        return UpstreamResponse(response.status_code, headers, _content_length(headers), response.aiter_raw(), response.aclose)
+
+    async def close(self) -> None:
+        for session in self._sessions.values():
+            await session.close()
+        for client in self._clients.values():
+            await client.aclose()
+        self._sessions.clear()
+        self._clients.clear()
+
+    def stats(self) -> dict:
+        return {
+            "protocol": "HTTP/2" if self.http2 else "HTTP/1.1",
+            "requests": self.requests,
+            "errors": self.errors,
+            "pools": list(self._clients or self._sessions),
+        }
+
+
+def forward_headers(request_headers, client_host: Optional[str], extra: dict[str, str]) -> list[tuple[str, str]]:
+    headers = [(name, value) for name, value in request_headers.items() if name not in DROPPED]
+    if client_host:
+        forwarded = request_headers.get("x-forwarded-for")
+        headers.append(("x-forwarded-for", f"{forwarded}, {client_host}" if forwarded else client_host))
+    headers += extra.items()
+    return headers
+
+
+def request_target(connection: HTTPConnection) -> str:
+    """
+    Путь и query-строка в том виде, в каком их прислал клиент: раскодированный
+    путь превратил бы %2F в "/" и сервис увидел бы другой адрес.
+    """
+    raw_path = connection.scope.get("raw_path")
+    path = raw_path.decode("latin-1") if raw_path else connection.scope["path"]
+    query = connection.scope.get("query_string", b"").decode("latin-1")
+    return f"{path}?{query}" if query else path
+
+
+async def forward_http(upstreams: Upstreams, name: str, request: Request, extra: dict[str, str]) -> Response:
+    try:
+        response = await upstreams.send(
+            name,
+            request.method,
+            request_target(request),
+            forward_headers(request.headers, request.client.host if request.client else None, extra),
+            request.stream() if request.method not in ("GET", "HEAD", "OPTIONS") else None,
+        )
+    except UpstreamTimeout:
+        return JSONResponse({"detail": "Gateway timeout"}, status_code=504)
+    except UpstreamError:
+        return JSONResponse({"detail": "Bad gateway"}, status_code=502)
+
+    if response.length is not None and response.length <= upstreams.buffer_size:
+        try:
+            proxied = Response(await response.read(), status_code=response.status)
+        except UpstreamError:
+            upstreams.errors += 1
+            return JSONResponse({"detail": "Bad gateway"}, status_code=502)
+        proxied.raw_headers = response.headers
+        return proxied
+
+    proxied = StreamingResponse(
+        response.chunks,
+        status_code=response.status,
+        # Соединение возвращается в пул, когда тело передано клиенту
+        background=BackgroundTask(response.close),
+    )
+    proxied.raw_headers = response.headers
+    return proxied
+
+
+async def forward_websocket(upstream_url: str, websocket: WebSocket, extra: dict[str, str]) -> None:
+    from websockets.asyncio.client import connect
+    from websockets.exceptions import ConnectionClosed, InvalidStatus
+
+    url = upstream_url.replace("http", "ws", 1) + request_target(websocket)
+    headers = [
+        (name, value) for name, value in forward_headers(websocket.headers, None, extra)
+        if not name.startswith("sec-websocket") and name != "host"
+    ]
+
+    try:
+        upstream = await connect(url, additional_headers=headers, open_timeout=10)
+    except InvalidStatus:
+        # Сервис отказал в рукопожатии (нет токена, нет доступа) — отказываем так же
+        await websocket.close(code=1008)
+        return
+    except (OSError, asyncio.TimeoutError):
+        await websocket.close(code=1011)
+        return
+
+    await websocket.accept()
+
+    async def client_to_upstream():
+        with contextlib.suppress(WebSocketDisconnect, ConnectionClosed, RuntimeError):
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                if message.get("text") is not None:
+                    await upstream.send(message["text"])
+                elif message.get("bytes") is not None:
+                    await upstream.send(message["bytes"])
+
+    async def upstream_to_client():
+        with contextlib.suppress(WebSocketDisconnect, ConnectionClosed, RuntimeError):
+            async for message in upstream:
+                if isinstance(message, str):
+                    await websocket.send_text(message)
+                else:
+                    await websocket.send_bytes(message)
+        # Код закрытия сервиса (4401, 4408 и т.п.) передаём клиенту;
+        # 1005/1006 по сети не отправляются
+        code = upstream.close_code if upstream.close_code not in (None, 1005, 1006) else 1000
+        with contextlib.suppress(RuntimeError):
+            await websocket.close(code=code, reason=upstream.close_reason or "")
+
+    tasks = [asyncio.create_task(client_to_upstream()), asyncio.create_task(upstream_to_client())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await upstream.close()
@@ -0,0 +1,160 @@
+"""
+Фоновое удаление серверов (см. миграцию server_deletion).
+
+DELETE /servers/{id} кладёт задание в server_deletions и сразу отвечает
+202; эта задача удаляет сервер каскадом одной RPC, сбрасывает кэши списков
+серверов, каналов и голосового присутствия, а затем удаляет картинку из
+хранилища. Задания хранятся в БД: после перезапуска ничего не теряется, а
+неудачный шаг повторяется с задержкой RETRY_BASE, 2*RETRY_BASE, ... до
+MAX_ATTEMPTS раз.
+"""
+import asyncio
+import contextlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from core.config import setting_float, setting_int
+from core.db import db
+from core.etag import bump_version
+from core.uploads import delete_image
+from .presence import get_presence
+from .server_list import invalidate_server_lists
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = setting_int("SERVER_DELETION_BATCH", 10)
+POLL_INTERVAL = setting_float("SERVER_DELETION_INTERVAL", 10)
+MAX_ATTEMPTS = setting_int("SERVER_DELETION_MAX_ATTEMPTS", 6)
+RETRY_BASE = setting_float("SERVER_DELETION_RETRY_BASE", 5)
+RETRY_DELAY = 1.0
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class ServerDeletionWorker:
+    def __init__(self, batch_size: int = BATCH_SIZE, poll_interval: float = POLL_INTERVAL):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.deleted = 0
+        self.media_deleted = 0
+        self.retries = 0
+        self.failed = 0
+
+    def notify(self) -> None:
+        """Новое задание в очереди — обработать его, не дожидаясь опроса."""
+        self._wakeup.set()
+
+    async def drain(self) -> int:
+        total = 0
+        while True:
+            response = await db.rpc("claim_server_deletions", {"p_limit": self.batch_size}).execute()
+            jobs = response.data or []
+            if not jobs:
+                return total
+            for job in jobs:
+                await self.process(job)
+            total += len(jobs)
+
+    async def process(self, job: dict) -> None:
+        try:
+            if job["status"] == "pending":
+                await self.cascade(job["server_id"])
+            else:
+                await self.cleanup(job)
+        except Exception as e:
+            await self.retry(job, e)
+
+    async def cascade(self, server_id: str) -> None:
+        response = await db.rpc("delete_server_cascade", {"p_server_id": server_id}).execute()
+        result = response.data
+        self.deleted += 1
+
+        await invalidate_server_lists(result["members"])
+        await bump_version("channels", server_id)
+        presence = get_presence()
+        for channel_id in result["voice_channels"]:
+            for user_id in await presence.members(channel_id):
+                await presence.leave(channel_id, user_id)
+        # Картинку удалит следующий шаг (статус cleanup), его задание уже в очереди
+
+    async def cleanup(self, job: dict) -> None:
+        if job["media_url"] and await delete_image(job["media_url"]):
+            self.media_deleted += 1
+        await db.table("server_deletions") \
+            .update({"status": "done", "finished_at": _now().isoformat(), "last_error": None}) \
+            .eq("server_id", job["server_id"]) \
+            .execute()
+
+    async def retry(self, job: dict, error: Exception) -> None:
+        logger.warning("server deletion %s (%s) failed: %s", job["server_id"], job["status"], error, exc_info=error)
+        if job["attempts"] >= MAX_ATTEMPTS:
+            self.failed += 1
+            update = {"status": "failed", "finished_at": _now().isoformat(), "last_error": str(error)}
+        else:
+            self.retries += 1
+            delay = RETRY_BASE * 2 ** (job["attempts"] - 1)
+            update = {"run_after": (_now() + timedelta(seconds=delay)).isoformat(), "last_error": str(error)}
+        # Если не удалось и это, задание вернётся в очередь по истечении аренды
+        with contextlib.suppress(Exception):
+            await db.table("server_deletions") \
+                .update(update) \
+                .eq("server_id", job["server_id"]) \
+                .execute()
+
+    async def run(self) -> None:
+        while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            self._wakeup.clear()
+            try:
+                await self.drain()
+            except Exception:
+                logger.exception("server deletion queue failed")
+                await asyncio.sleep(RETRY_DELAY)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+        # Задания, оставшиеся с прошлого запуска
+        self.notify()
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "deleted": self.deleted,
+            "media_deleted": self.media_deleted,
+            "retries": self.retries,
+            "failed": self.failed,
+        }
+
+
+_worker: Optional[ServerDeletionWorker] = None
+
+
+def get_deletion_worker() -> ServerDeletionWorker:
+    global _worker
+    if _worker is None:
+        _worker = ServerDeletionWorker()
+    return _worker
+
+
+async def start_deletion_worker() -> None:
+    await get_deletion_worker().start()
+
+
+async def stop_deletion_worker() -> None:
+    await get_deletion_worker().stop()
+
+
+def deletion_worker_stats() -> dict:
+    return get_deletion_worker().stats()
@@ -1,8 +1,42 @@
 from fastapi import FastAPI
 from .routes.server import router as server_router
 from fastapi.middleware.cors import CORSMiddleware
+from core.diagnostics import register_stats, router as diagnostics_router
+from core.etag import ETagMiddleware
+from core.uploads import UploadSizeLimitMiddleware
+from core.ratelimit import UPLOADS, RateLimitMiddleware, route_class
+from core.metrics import MetricsMiddleware, router as metrics_router
+from core.lifespan import lifespan, on_startup, on_shutdown
+from .presence import start_presence_sweeper, stop_presence_sweeper
+from .server_list import server_list_cache_stats
+from .deletion import deletion_worker_stats, start_deletion_worker, stop_deletion_worker
 
-app = FastAPI()
+on_startup(start_presence_sweeper)
+on_shutdown(stop_presence_sweeper)
+on_startup(start_deletion_worker)
+on_shutdown(stop_deletion_worker)
+register_stats("my_servers", server_list_cache_stats)
+register_stats("server_deletions", deletion_worker_stats)
+
+app = FastAPI(lifespan=lifespan)
+
+# Лимит тела на загрузку картинок (внутри CORS, чтобы 413 тоже получал CORS-заголовки)
+app.add_middleware(UploadSizeLimitMiddleware, paths=("/servers/upload-image",))
+
+# ETag и 304 для списков, которые клиент опрашивает; каналы одинаковы для
+# всех участников и сбрасываются через bump_version
+app.add_middleware(
+    ETagMiddleware,
+    paths=(r"/servers/my-servers", r"/servers/[^/]+/member"),
+    versioned={"channels": r"/servers/(?P<key>[^/]+)/(?:text|voice)channels"},
+)
+
+# Частые запросы одного клиента отклоняются 429 до обработчика (внутри CORS)
+app.add_middleware(RateLimitMiddleware, classes=(
+    # Участники голосового канала клиенты опрашивают по таймеру
+    route_class("voice_members", 1, 10, r"/servers/[^/]+/voicechannels/[^/]+/members", methods=("GET",)),
+    UPLOADS,
+))
 
 # Разрешаем CORS для фронтенда
 app.add_middleware(
@@ -13,4 +47,10 @@ app.add_middleware(
     allow_headers=["*"],  # Разрешаем все заголовки
 )
 
-app.include_router(server_router)
\ No newline at end of file
+# Время ответов по шаблонам маршрутов для /metrics; снаружи всех, чтобы
+# учитывать и ответы CORS, лимита запросов и 304
+app.add_middleware(MetricsMiddleware)
+
+app.include_router(server_router)
+app.include_router(diagnostics_router)
+app.include_router(metrics_router)
\ No newline at end of file
@@ -0,0 +1,78 @@
+"""
+Присутствие пользователей в голосовых каналах без обращений к БД.
+
+PRESENCE_BACKEND=memory (по умолчанию) хранит состояние в процессе,
+PRESENCE_BACKEND=redis — в Redis (REDIS_URL), общем для всех реплик;
+события join/leave/timeout идут через core.pubsub и доходят до сокетов
+всех реплик. Истёкшие сессии убирает фоновая задача, запущенная в lifespan.
+"""
+import asyncio
+import contextlib
+import logging
+from typing import Optional
+
+from core.config import setting, setting_float
+from core.pubsub import get_broker
+from core.redis_client import get_redis
+
+from .backends import MemoryPresenceBackend, PresenceBackend, RedisPresenceBackend
+from .engine import EVENTS_CHANNEL, VoicePresence
+
+logger = logging.getLogger(__name__)
+
+SWEEP_INTERVAL = 0.5
+
+_presence: Optional[VoicePresence] = None
+_sweeper: Optional[asyncio.Task] = None
+
+
+def get_presence() -> VoicePresence:
+    global _presence
+    if _presence is None:
+        if setting("PRESENCE_BACKEND", "memory") == "redis":
+            backend = RedisPresenceBackend(get_redis())
+        else:
+            backend = MemoryPresenceBackend()
+        broker = get_broker()
+        _presence = VoicePresence(backend, ttl=setting_float("VOICE_PRESENCE_TTL", 6), broker=broker)
+        broker.subscribe(EVENTS_CHANNEL, _on_event)
+    return _presence
+
+
+async def _on_event(message: dict) -> None:
+    if _presence is not None:
+        _presence.deliver(message)
+
+
+async def _sweep_forever() -> None:
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        try:
+            await get_presence().sweep()
+        except Exception:
+            logger.exception("presence sweep failed")
+
+
+async def start_presence_sweeper() -> None:
+    global _sweeper
+    _sweeper = asyncio.create_task(_sweep_forever())
+
+
+async def stop_presence_sweeper() -> None:
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _sweeper
+    _sweeper = None
+
+
+__all__ = [
+    "MemoryPresenceBackend",
+    "PresenceBackend",
+    "RedisPresenceBackend",
+    "VoicePresence",
+    "get_presence",
+    "start_presence_sweeper",
+    "stop_presence_sweeper",
+]
@@ -0,0 +1,161 @@
+"""Хранилища присутствия в голосовых каналах."""
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from .timer_wheel import TimerWheel
+
+
+class PresenceBackend(ABC):
+    @abstractmethod
+    async def join(self, server_id: str, channel_id: str, user_id: str, expires_at: float) -> bool:
+        """Добавляет участника, True — если его в канале ещё не было."""
+
+    @abstractmethod
+    async def touch(self, channel_id: str, user_id: str, expires_at: float) -> bool:
+        """Продлевает присутствие, False — если участника в канале нет."""
+
+    @abstractmethod
+    async def leave(self, channel_id: str, user_id: str) -> bool:
+        """Убирает участника, True — если он был в канале."""
+
+    @abstractmethod
+    async def members(self, channel_id: str, now: float) -> list[str]:
+        """Участники канала, чьё присутствие не истекло к моменту now."""
+
+    @abstractmethod
+    async def server_of(self, channel_id: str):
+        """Сервер, которому принадлежит канал (известен после первого входа)."""
+
+    @abstractmethod
+    async def expire(self, now: float) -> list[tuple[str, str, Optional[str]]]:
+        """
+        Удаляет истёкшие записи и возвращает их как (channel_id, user_id,
+        server_id). Запись возвращает только тот вызов, который её удалил.
+        """
+
+
+class MemoryPresenceBackend(PresenceBackend):
+    """
+    Присутствие в памяти процесса. Подходит, пока server-service запущен
+    в одном экземпляре; для нескольких реплик — RedisPresenceBackend.
+    """
+
+    def __init__(self, tick: float = 0.25):
+        # channel_id -> {user_id: expires_at}, dict сохраняет порядок входа
+        self._channels: dict[str, dict[str, float]] = {}
+        # channel_id -> server_id, пока в канале кто-то есть
+        self._servers: dict[str, str] = {}
+        self._wheel = TimerWheel(tick=tick, now=time.time())
+
+    async def join(self, server_id, channel_id, user_id, expires_at):
+        self._servers[channel_id] = server_id
+        members = self._channels.setdefault(channel_id, {})
+        added = user_id not in members
+        members[user_id] = expires_at
+        self._wheel.schedule((channel_id, user_id), expires_at)
+        return added
+
+    async def touch(self, channel_id, user_id, expires_at):
+        members = self._channels.get(channel_id)
+        if not members or user_id not in members:
+            return False
+        members[user_id] = expires_at
+        self._wheel.schedule((channel_id, user_id), expires_at)
+        return True
+
+    async def leave(self, channel_id, user_id):
+        self._wheel.cancel((channel_id, user_id))
+        return self._remove(channel_id, user_id)
+
+    async def members(self, channel_id, now):
+        # Истёкшие, но ещё не убранные колесом участники просто не показываются;
+        # удаляет их (и сообщает о таймауте) только expire
+        members = self._channels.get(channel_id, {})
+        return [user_id for user_id, expires_at in members.items() if expires_at > now]
+
+    async def server_of(self, channel_id):
+        return self._servers.get(channel_id)
+
+    async def expire(self, now):
+        expired = []
+        for channel_id, user_id in self._wheel.advance(now):
+            server_id = self._servers.get(channel_id)
+            if self._remove(channel_id, user_id):
+                expired.append((channel_id, user_id, server_id))
+        return expired
+
+    def _remove(self, channel_id, user_id) -> bool:
+        members = self._channels.get(channel_id)
+        if not members or user_id not in members:
+            return False
+        del members[user_id]
+        if not members:
+            del self._channels[channel_id]
+            del self._servers[channel_id]
+        return True
+
+
+class RedisPresenceBackend(PresenceBackend):
+    """
+    Присутствие в Redis: на канал один ZSET user_id -> время истечения,
+    множество каналов, где кто-то есть, для фоновой очистки и хэш
+    channel_id -> server_id для рассылки событий. Хэш не очищается: запись
+    из него может понадобиться входу другой реплики в тот же момент, а
+    размер ограничен числом голосовых каналов (вход проверяет канал по БД).
+    """
+
+    def __init__(self, redis, prefix: str = "voice"):
+        self.redis = redis
+        self.prefix = prefix
+
+    def _channel_key(self, channel_id: str) -> str:
+        return f"{self.prefix}:channel:{channel_id}"
+
+    @property
+    def _index_key(self) -> str:
+        return f"{self.prefix}:channels"
+
+    @property
+    def _servers_key(self) -> str:
+        return f"{self.prefix}:servers"
+
+    async def join(self, server_id, channel_id, user_id, expires_at):
+        added = await self.redis.zadd(self._channel_key(channel_id), {user_id: expires_at})
+        await self.redis.sadd(self._index_key, channel_id)
+        await self.redis.hset(self._servers_key, channel_id, server_id)
+        return bool(added)
+
+    async def touch(self, channel_id, user_id, expires_at):
+        changed = await self.redis.zadd(
+            self._channel_key(channel_id), {user_id: expires_at}, xx=True, ch=True
+        )
+        return bool(changed)
+
+    async def leave(self, channel_id, user_id):
+        return bool(await self.redis.zrem(self._channel_key(channel_id), user_id))
+
+    async def members(self, channel_id, now):
+        return await self.redis.zrangebyscore(self._channel_key(channel_id), now, "+inf")
+
+    async def server_of(self, channel_id):
+        return await self.redis.hget(self._servers_key, channel_id)
+
+    async def expire(self, now):
+        # Очистку выполняет каждая реплика: запись достаётся той, чей ZREM её
+        # удалил, поэтому о таймауте сообщается один раз
+        expired = []
+        for channel_id in await self.redis.smembers(self._index_key):
+            key = self._channel_key(channel_id)
+            stale = await self.redis.zrangebyscore(key, "-inf", now)
+            if stale:
+                server_id = await self.redis.hget(self._servers_key, channel_id)
+                for user_id in stale:
+                    if await self.redis.zrem(key, user_id):
+                        expired.append((channel_id, user_id, server_id))
+            if not await self.redis.zcard(key):
+                await self.redis.srem(self._index_key, channel_id)
+                # Вход между zcard и srem: канал возвращается в индекс
+                if await self.redis.zcard(key):
+                    await self.redis.sadd(self._index_key, channel_id)
+        return expired
@@ -0,0 +1,79 @@
+import logging
+import time
+from typing import Callable, Optional
+
+from core.broadcast import Broadcaster
+
+from .backends import PresenceBackend
+
+logger = logging.getLogger(__name__)
+
+EVENTS_CHANNEL = "voice_presence"
+
+
+class VoicePresence:
+    """
+    Кто сейчас в голосовых каналах. Участник считается присутствующим,
+    пока не вышел сам и пока с последнего сигнала прошло меньше ttl секунд.
+    Изменения (join/leave/timeout) рассылаются через hub подписчикам сервера.
+
+    С broker (core.pubsub) события идут через него и доставляются в hub
+    каждой реплики вызовом deliver; без него — сразу в hub этого процесса.
+    """
+
+    def __init__(
+        self,
+        backend: PresenceBackend,
+        ttl: float = 6.0,
+        clock: Callable[[], float] = time.time,
+        hub: Optional[Broadcaster] = None,
+        broker=None,
+    ):
+        self.backend = backend
+        self.ttl = ttl
+        self.clock = clock
+        self.hub = hub or Broadcaster()
+        self.broker = broker
+
+    async def join(self, server_id: str, channel_id: str, user_id: str) -> bool:
+        added = await self.backend.join(server_id, channel_id, user_id, self.clock() + self.ttl)
+        if added:
+            await self._publish(server_id, "join", channel_id, user_id)
+        return added
+
+    async def heartbeat(self, channel_id: str, user_id: str) -> bool:
+        return await self.backend.touch(channel_id, user_id, self.clock() + self.ttl)
+
+    async def leave(self, channel_id: str, user_id: str) -> bool:
+        # Сервер узнаём до выхода: опустевший канал забывает свой сервер
+        server_id = await self.backend.server_of(channel_id)
+        removed = await self.backend.leave(channel_id, user_id)
+        if removed:
+            await self._publish(server_id, "leave", channel_id, user_id)
+        return removed
+
+    async def members(self, channel_id: str) -> list[str]:
+        return await self.backend.members(channel_id, self.clock())
+
+    async def sweep(self) -> list[tuple[str, str]]:
+        expired = await self.backend.expire(self.clock())
+        for channel_id, user_id, server_id in expired:
+            await self._publish(server_id, "timeout", channel_id, user_id)
+        return [(channel_id, user_id) for channel_id, user_id, _ in expired]
+
+    def deliver(self, message: dict) -> None:
+        """Событие от broker — подписчикам сервера в этом процессе."""
+        self.hub.publish(message["server_id"], message["event"])
+
+    async def _publish(self, server_id: Optional[str], event: str, channel_id: str, user_id: str) -> None:
+        if server_id is None:
+            return
+        message = {"server_id": server_id, "event": {"type": event, "channel_id": channel_id, "user_id": user_id}}
+        if self.broker is None:
+            self.deliver(message)
+            return
+        try:
+            await self.broker.publish(EVENTS_CHANNEL, message)
+        except Exception:
+            # Состояние уже изменено; клиенты сверятся по снимку при переподключении
+            logger.exception("presence event failed")
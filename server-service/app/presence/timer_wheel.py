@@ -0,0 +1,79 @@
+"""
+Иерархическое колесо таймеров.
+
+Постановка, перенос и отмена таймера — O(1), продвижение времени — O(1)
+на тик плюс число сработавших таймеров. Уровень L колеса покрывает
+slots ** (L + 1) тиков; когда нижний уровень делает полный оборот,
+таймеры из очередного слота верхнего уровня спускаются ниже.
+"""
+import math
+from typing import Hashable
+
+
+class TimerWheel:
+    def __init__(self, tick: float = 0.25, slots: int = 64, levels: int = 3, now: float = 0.0):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        # key -> (тик срабатывания, уровень, слот)
+        self._timers: dict[Hashable, tuple[int, int, int]] = {}
+        self._current = int(now // tick)
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._timers
+
+    def schedule(self, key: Hashable, deadline: float) -> None:
+        """Ставит (или переносит) таймер key на момент deadline."""
+        self.cancel(key)
+        expires = max(math.ceil(deadline / self.tick), self._current + 1)
+        self._place(key, expires)
+
+    def cancel(self, key: Hashable) -> bool:
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        _, level, slot = timer
+        self._wheels[level][slot].discard(key)
+        return True
+
+    def advance(self, now: float) -> list:
+        """Продвигает время до now и возвращает ключи сработавших таймеров."""
+        target = int(now // self.tick)
+        expired = []
+        while self._current < target:
+            self._current += 1
+            self._cascade()
+
+            bucket = self._wheels[0][self._current % self.slots]
+            if bucket:
+                self._wheels[0][self._current % self.slots] = set()
+                for key in bucket:
+                    del self._timers[key]
+                expired.extend(bucket)
+        return expired
+
+    def _place(self, key: Hashable, expires: int) -> None:
+        delta = expires - self._current
+        level = 0
+        while level < self.levels - 1 and delta >= self.slots ** (level + 1):
+            level += 1
+        slot = (expires // self.slots ** level) % self.slots
+        self._wheels[level][slot].add(key)
+        self._timers[key] = (expires, level, slot)
+
+    def _cascade(self) -> None:
+        for level in range(1, self.levels):
+            span = self.slots ** level
+            if self._current % span:
+                break
+            slot = (self._current // span) % self.slots
+            bucket = self._wheels[level][slot]
+            if not bucket:
+                continue
+            self._wheels[level][slot] = set()
+            for key in bucket:
+                self._place(key, self._timers[key][0])
@@ -1,31 +1,20 @@
-from fastapi import APIRouter, UploadFile, HTTPException, Depends, Request
-from ..database import supabase
-from ..schemas import ServerCreate, InviteResponse, InviteCreate, TextChannel, TextChannelCreate, VoiceChannel, VoiceChannelCreate
+from fastapi import APIRouter, UploadFile, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect
+from core.db import db
+from postgrest.exceptions import APIError
+from core.auth import get_current_user, authenticate_websocket
+from core.broadcast import receive_object
+from core.uploads import process_image_upload
+from core.profiles import get_profile_cache, project
+from core.notifications import notify
+from core.etag import bump_version
+from ..presence import get_presence
+from ..server_list import get_server_list_cache, invalidate_server_lists
+from ..deletion import get_deletion_worker
+from ..schemas import ServerCreate, InviteResponse, InviteCreate, TextChannel, TextChannelCreate, VoiceChannel, VoiceChannelCreate, ChannelBulk
 from uuid import UUID
-from typing import List
-import os
-import cloudinary
-import cloudinary.uploader
-from cloudinary.utils import cloudinary_url
-from dotenv import load_dotenv
-from datetime import datetime, timedelta
-
-load_dotenv()
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET"),
-    secure=True
-)
-
-async def get_current_user(request: Request):
-    token = request.headers.get("Authorization", "").replace("Bearer ", "")
-    
-    try:
-        user = supabase.auth.get_user(token)
-        return user
-    except Exception as e:
-        raise HTTPException(status_code=401, detail="Invalid token")
+from datetime import datetime, timezone
+from typing import List, Literal
+import asyncio
 
 router = APIRouter(prefix="/servers")
 
@@ -42,7 +31,7 @@ async def create_server(
             "owner_id": user.user.id
         }
         
-        result = supabase.table("servers").insert(server_data).execute()
+        result = await db.table("servers").insert(server_data).execute()
         new_server = result.data[0]
         
         # Добавляем владельца как участника
@@ -51,7 +40,8 @@ async def create_server(
             "server_id": new_server["id"],
             "role": "owner"
         }
-        supabase.table("server_members").insert(member_data).execute()
+        await db.table("server_members").insert(member_data).execute()
+        await invalidate_server_lists([user.user.id])
         
         return new_server
         
@@ -60,61 +50,42 @@ async def create_server(
 
 @router.get("/my-servers")
 async def get_user_servers(user = Depends(get_current_user)):
-    try:
-        # 1. Получаем все серверы, где пользователь является участником
-        memberships = supabase.table("server_members") \
-            .select("server_id, role") \
-            .eq("user_id", user.user.id) \
-            .execute()
-        
-        if not memberships.data:
-            return []
-        
-        # 2. Получаем полные данные этих серверов
-        server_ids = [m["server_id"] for m in memberships.data]
-        servers = supabase.table("servers") \
-            .select("id, name, image_url, owner_id") \
-            .in_("id", server_ids) \
+    user_id = user.user.id
+
+    async def load():
+        # Членство и данные серверов одним запросом через встроенный join
+        memberships = await db.table("server_members") \
+            .select("role, servers(id, name, image_url, owner_id)") \
+            .eq("user_id", user_id) \
             .execute()
-        
-        # 3. Добавляем роль пользователя в каждом сервере
-        servers_with_role = []
-        for server in servers.data:
-            membership = next(m for m in memberships.data if m["server_id"] == server["id"])
-            servers_with_role.append({
-                **server,
-                "user_role": membership["role"]
-            })
-        
-        return servers_with_role
-        
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    
-async def upload_to_cloudinary(file: UploadFile):
+
+        return [
+            {**m["servers"], "user_role": m["role"]}
+            for m in memberships.data
+            if m.get("servers")
+        ]
+
     try:
-        result = cloudinary.uploader.upload(
-            file.file,
-            folder="avatar_servers",
-            resource_type="auto",
-        )
-        return result["secure_url"]
+        return await get_server_list_cache().get(user_id, load)
+
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Cloudinary upload error: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/upload-image")
 async def upload_image(file: UploadFile):
     try:
-        image_url = await upload_to_cloudinary(file)
-        return {"url": image_url}
+        result = await process_image_upload(file, folder="avatar_servers")
+        return {"url": result.url, "upload": result.report()}
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise HTTPException(status_code=500, detail=f"Cloudinary upload error: {str(e)}")
 
 @router.get("/{server_id}")
 async def get_server(server_id: str, user = Depends(get_current_user)):
     # 1. Проверяем существование сервера
     try:
-        server_exists = supabase.table("servers") \
+        server_exists = await db.table("servers") \
             .select("id", count="exact") \
             .eq("id", server_id) \
             .execute()
@@ -126,7 +97,7 @@ async def get_server(server_id: str, user = Depends(get_current_user)):
 
     # 2. Проверяем права доступа
     try:
-        member = supabase.table("server_members") \
+        member = await db.table("server_members") \
             .select("role") \
             .eq("user_id", user.user.id) \
             .eq("server_id", server_id) \
@@ -140,7 +111,7 @@ async def get_server(server_id: str, user = Depends(get_current_user)):
 
     # 3. Если все проверки пройдены - получаем данные
     try:
-        server = supabase.table("servers") \
+        server = await db.table("servers") \
             .select("*") \
             .eq("id", server_id) \
             .single() \
@@ -159,18 +130,14 @@ async def create_invite(
     invite: InviteCreate,
     user = Depends(get_current_user)
 ):
-    recipient_profile = supabase.table("profiles") \
-        .select("user_id, username") \
-        .eq("username", invite.recipient_username) \
-        .maybe_single() \
-        .execute()
+    recipient_profile = await get_profile_cache().get_by_username(invite.recipient_username)
     
     if not recipient_profile:
         raise HTTPException(status_code=404, detail="User not found")
     
-    recipient_id = recipient_profile.data["user_id"]
+    recipient_id = recipient_profile["user_id"]
     # Проверяем, что пользователь не уже участник
-    existing_member = supabase.table("server_members") \
+    existing_member = await db.table("server_members") \
         .select("*") \
         .eq("server_id", server_id) \
         .eq("user_id", recipient_id) \
@@ -180,7 +147,7 @@ async def create_invite(
     if existing_member:
         raise HTTPException(status_code=400, detail="The user is already on the server")
     
-    existing_invite = supabase.table("server_invites") \
+    existing_invite = await db.table("server_invites") \
         .select("*") \
         .eq("server_id", server_id) \
         .eq("recipient_username", invite.recipient_username) \
@@ -202,7 +169,12 @@ async def create_invite(
         "status": "pending",
     }
 
-    result = supabase.table("server_invites").insert(new_invite).execute()
+    result = await db.table("server_invites").insert(new_invite).execute()
+    await notify(
+        recipient_id,
+        {"type": "server_invite.new", "invite_id": result.data[0]["id"], "server_id": server_id, "user_id": user.user.id},
+        "server_invites", 1,
+    )
     return result.data[0]
 
 @router.get("/{server_id}/textchannels")
@@ -211,7 +183,7 @@ async def get_text_channels(
     user = Depends(get_current_user)
 ):
     try:
-        response = supabase.table("text_channels") \
+        response = await db.table("text_channels") \
             .select("*") \
             .eq("server_id", server_id) \
             .order("position") \
@@ -230,7 +202,7 @@ async def del_text_channels(
 ):
     try:
         # 1. Проверяем права пользователя (только owner/admin могут удалять каналы)
-        member = supabase.table("server_members") \
+        member = await db.table("server_members") \
             .select("role") \
             .eq("server_id", server_id) \
             .eq("user_id", user.user.id) \
@@ -242,10 +214,11 @@ async def del_text_channels(
             raise HTTPException(status_code=403, detail="Нет прав")
         
         # 3. Удаляем канал
-        supabase.table("text_channels") \
+        deleted = await db.table("text_channels") \
             .delete() \
             .eq("id", channel_id) \
             .execute()
+        await channels_changed(c["server_id"] for c in deleted.data)
         return {"message": "Канал успешно удален"}
 
     except HTTPException:
@@ -264,7 +237,7 @@ async def create_text_channel(
 ):
     try:
         # Проверяем права пользователя (только owner/admin могут создавать каналы)
-        member = supabase.table("server_members") \
+        member = await db.table("server_members") \
             .select("role") \
             .eq("server_id", server_id) \
             .eq("user_id", user.user.id) \
@@ -275,29 +248,10 @@ async def create_text_channel(
         if not member:
             raise HTTPException(status_code=403, detail="Нет прав")
         
-        position_res = supabase.from_("text_channels") \
-            .select("position") \
-            .eq("server_id", server_id) \
-            .order("position", desc=True) \
-            .limit(1) \
-            .execute()
-        
-        max_position = position_res.data[0].get("position", 0) if position_res.data else 0
-        
-        # Создаем канал
-        new_channel = {
-            "server_id": server_id,
-            "name": channel_data.name,
-            "description": channel_data.description,
-            "position": max_position + 1,
-            "is_private": channel_data.is_private or False,
-        }
-    
-        response = supabase.from_("text_channels") \
-            .insert(new_channel, returning="representation") \
-            .execute()
+        # Позицию (в конец списка) выдаёт БД атомарно
+        result = await apply_channel_changes(server_id, "text", create=[channel_data.model_dump()])
 
-        return response.data[0]
+        return result["created"][0]
         
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -306,7 +260,7 @@ async def create_text_channel(
 @router.get("/{server_id}/voicechannels")
 async def get_voice_channels(server_id: str, user=Depends(get_current_user)):
     try:
-        response = supabase.table("voice_channels") \
+        response = await db.table("voice_channels") \
             .select("*") \
             .eq("server_id", server_id) \
             .order("position") \
@@ -318,7 +272,7 @@ async def get_voice_channels(server_id: str, user=Depends(get_current_user)):
 @router.post("/{server_id}/add/voicechannels")
 async def create_voice_channel(server_id: str, channel_data: VoiceChannelCreate, user=Depends(get_current_user)):
     try:
-        member = supabase.table("server_members") \
+        member = await db.table("server_members") \
             .select("role") \
             .eq("server_id", server_id) \
             .eq("user_id", user.user.id) \
@@ -328,28 +282,10 @@ async def create_voice_channel(server_id: str, channel_data: VoiceChannelCreate,
         if not member or not member.data:
             raise HTTPException(status_code=403, detail="Нет прав")
 
-        # Определяем позицию
-        last = supabase.table("voice_channels") \
-            .select("position") \
-            .eq("server_id", server_id) \
-            .order("position", desc=True) \
-            .limit(1) \
-            .execute()
-        max_pos = last.data[0]["position"] if last.data else 0
-
-        new_channel = {
-            "server_id": server_id,
-            "name": channel_data.name,
-            "description": channel_data.description,
-            "is_private": channel_data.is_private,
-            "position": max_pos + 1
-        }
+        # Позицию (в конец списка) выдаёт БД атомарно
+        result = await apply_channel_changes(server_id, "voice", create=[channel_data.model_dump()])
 
-        result = supabase.table("voice_channels") \
-            .insert(new_channel, returning="representation") \
-            .execute()
-
-        return result.data[0]
+        return result["created"][0]
 
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -357,7 +293,7 @@ async def create_voice_channel(server_id: str, channel_data: VoiceChannelCreate,
 @router.delete("/{server_id}/del/voicechannels/{channel_id}")
 async def delete_voice_channel(server_id: str, channel_id: str, user=Depends(get_current_user)):
     try:
-        member = supabase.table("server_members") \
+        member = await db.table("server_members") \
             .select("role") \
             .eq("server_id", server_id) \
             .eq("user_id", user.user.id) \
@@ -367,27 +303,63 @@ async def delete_voice_channel(server_id: str, channel_id: str, user=Depends(get
         if not member or not member.data:
             raise HTTPException(status_code=403, detail="Нет прав")
 
-        supabase.table("voice_channels") \
+        deleted = await db.table("voice_channels") \
             .delete() \
             .eq("id", channel_id) \
             .execute()
+        await channels_changed(c["server_id"] for c in deleted.data)
 
         return {"message": "Голосовой канал удалён"}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при удалении: {str(e)}")
 
-@router.delete("/{server_id}")
+@router.post("/{server_id}/bulk/{kind}channels")
+async def bulk_channels(
+    server_id: str,
+    kind: Literal["text", "voice"],
+    changes: ChannelBulk,
+    user=Depends(get_current_user)
+):
+    """
+    Создание, перестановка и удаление многих каналов одним запросом и одной
+    транзакцией. Перемещение {"id", "after"} ставит канал сразу после
+    канала after (null — в начало) и переписывает только его строку.
+    Возвращает созданные каналы и весь новый список по порядку.
+    """
+    member = await db.table("server_members") \
+        .select("role") \
+        .eq("server_id", server_id) \
+        .eq("user_id", user.user.id) \
+        .in_("role", ["owner", "admin"]) \
+        .maybe_single() \
+        .execute()
+    if not member or not member.data:
+        raise HTTPException(status_code=403, detail="Нет прав")
+
+    body = changes.model_dump(mode="json")
+    try:
+        return await apply_channel_changes(server_id, kind, body["create"], body["move"], body["delete"])
+    except APIError as e:
+        if e.code == "P0002":
+            raise HTTPException(status_code=404, detail="Сервер или канал не найден")
+        if e.code == "22023":
+            raise HTTPException(status_code=400, detail="Канал нельзя поставить после самого себя")
+        raise HTTPException(status_code=500, detail=f"Ошибка при изменении каналов: {e.message}")
+
+@router.delete("/{server_id}", status_code=202)
 async def delete_server(
     server_id: str,
     user = Depends(get_current_user)
 ):
     """
-    Удаляет сервер и все связанные данные (каналы, участники и т.д.)
+    Ставит удаление сервера в очередь и сразу отвечает 202. Сервер со всеми
+    каналами, сообщениями, участниками и приглашениями удаляется одной
+    транзакцией в фоне (app.deletion), затем удаляется его картинка.
     Только владелец сервера может удалить сервер
     """
     try:
-        member = supabase.table("server_members") \
+        member = await db.table("server_members") \
             .select("role") \
             .eq("server_id", server_id) \
             .eq("user_id", user.user.id) \
@@ -397,21 +369,21 @@ async def delete_server(
         
         if not member:
             raise HTTPException(status_code=403, detail="Нет прав")
-        
-        # Удаляем текстовые каналы
-        supabase.table("text_channels") \
-            .delete() \
-            .eq("server_id", server_id) \
-            .execute()
-        # Удаляем сам сервер
-        supabase.table("servers") \
-            .delete() \
-            .eq("id", server_id) \
-            .execute()
 
-        # 3. Очищаем связанные данные в Cloudinary (если есть аватар)
+        # Повторный запрос после неудачи (status = failed) начинает заново
+        await db.table("server_deletions") \
+            .upsert({
+                "server_id": server_id,
+                "requested_by": user.user.id,
+                "status": "pending",
+                "attempts": 0,
+                "run_after": datetime.now(timezone.utc).isoformat(),
+                "last_error": None,
+            }) \
+            .execute()
+        get_deletion_worker().notify()
 
-        return None
+        return {"status": "pending", "status_url": f"/servers/{server_id}/deletion"}
 
     except HTTPException:
         raise
@@ -421,11 +393,24 @@ async def delete_server(
             detail=f"Ошибка при удалении сервера: {str(e)}"
         )
 
+@router.get("/{server_id}/deletion")
+async def get_server_deletion(server_id: str, user = Depends(get_current_user)):
+    """Состояние удаления: pending, cleanup (сервер удалён, чистится картинка), done, failed."""
+    job = await db.table("server_deletions") \
+        .select("status, requested_at, finished_at, attempts, last_error") \
+        .eq("server_id", server_id) \
+        .eq("requested_by", user.user.id) \
+        .maybe_single() \
+        .execute()
+    if not job or not job.data:
+        raise HTTPException(status_code=404, detail="Удаление не найдено")
+    return job.data
+
 @router.get("/invites/received")
 async def get_received_invites(user = Depends(get_current_user)):
     try:
         # Получаем приглашения где текущий пользователь - получатель
-        invites = supabase.table("server_invites") \
+        invites = await db.table("server_invites") \
         .select("*, servers!fk_server(name), sender:profiles!fk_sender(username)") \
         .eq("recipient_id", user.user.id) \
         .eq("status", "pending") \
@@ -439,7 +424,7 @@ async def get_received_invites(user = Depends(get_current_user)):
 async def get_sent_invites(user = Depends(get_current_user)):
     try:
         # Получаем приглашения где текущий пользователь - отправитель
-        invites = supabase.table("server_invites") \
+        invites = await db.table("server_invites") \
             .select("*, servers!fk_server(name), profiles!recipient_id(username)") \
             .eq("sender_id", user.user.id) \
             .execute()
@@ -454,7 +439,7 @@ async def respond_to_invite(invite_id: UUID, response: InviteResponse, user=Depe
     try:
         if response.status not in ("accepted", "rejected"):
             raise HTTPException(status_code=400, detail="Недопустимый статус")
-        invite_response = supabase.table("server_invites") \
+        invite_response = await db.table("server_invites") \
             .select("*") \
             .eq("id", str(invite_id)) \
             .eq("recipient_id", user.user.id) \
@@ -466,18 +451,27 @@ async def respond_to_invite(invite_id: UUID, response: InviteResponse, user=Depe
             raise HTTPException(status_code=404, detail="Приглашение не найдено")
 
         # Обновляем статус
-        supabase.table("server_invites") \
+        await db.table("server_invites") \
             .update({"status": response.status}) \
             .eq("id", str(invite_id)) \
             .execute()
             
         if response.status == "accepted":
-            supabase.table("server_members") \
+            await db.table("server_members") \
                 .insert({
                     "server_id": invite["server_id"],
                     "user_id": user.user.id
                 }) \
                 .execute()
+            await invalidate_server_lists([user.user.id])
+
+        event = {"type": f"server_invite.{response.status}", "invite_id": invite["id"], "server_id": invite["server_id"]}
+        await notify(invite["sender_id"], {**event, "user_id": user.user.id})
+        await notify(
+            user.user.id,
+            {**event, "user_id": invite["sender_id"]},
+            "server_invites", -1 if invite["status"] == "pending" else 0,
+        )
 
         return {"message": f"Приглашение {response.status}"}
     
@@ -487,11 +481,19 @@ async def respond_to_invite(invite_id: UUID, response: InviteResponse, user=Depe
 async def cancel_invite(invite_id: UUID, user=Depends(get_current_user)):
     try:
         # Удаляем приглашение
-        supabase.table("server_invites") \
+        deleted = await db.table("server_invites") \
             .delete() \
             .eq("id", str(invite_id)) \
             .execute()
 
+        for invite in deleted.data:
+            if invite["status"] == "pending":
+                await notify(
+                    invite["recipient_id"],
+                    {"type": "server_invite.cancelled", "invite_id": invite["id"], "server_id": invite["server_id"], "user_id": invite["sender_id"]},
+                    "server_invites", -1,
+                )
+
         return {"message": "Приглашение отменено"}
 
     except Exception as e:
@@ -499,7 +501,7 @@ async def cancel_invite(invite_id: UUID, user=Depends(get_current_user)):
 @router.get("/invites/requests")
 async def check_incoming_requests(user=Depends(get_current_user)):
     try:
-        response = supabase.table("server_invites") \
+        response = await db.table("server_invites") \
             .select("id") \
             .eq("recipient_id", user.user.id) \
             .eq("status", "pending") \
@@ -514,84 +516,255 @@ async def check_incoming_requests(user=Depends(get_current_user)):
 @router.get("/{server_id}/member")
 async def check_incoming_requests(server_id: str, user=Depends(get_current_user)):
     try:
-        response = supabase.table("server_members") \
-            .select("*, profiles!user_id(username, avatar_url)") \
+        response = await db.table("server_members") \
+            .select("*") \
             .eq("server_id", server_id) \
             .execute()
 
-        return response.data
+        profiles = await get_profile_cache().get_many(m["user_id"] for m in response.data)
+        return with_member_profiles(response.data, profiles)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при загрузке members")
 
-#Сессии голосовых каналов (пока БД, потом Redis или иное)
-@router.post("/{server_id}/voicechannels/{channel_id}/join")
-async def join_voice_channel(channel_id: str, user=Depends(get_current_user)):
+async def apply_channel_changes(server_id: str, kind: str, create=(), move=(), delete=()) -> dict:
+    """
+    RPC apply_channel_changes: позиции новых каналов выдаются под блокировкой
+    сервера, без чтения max(position) отдельным запросом.
+    """
+    response = await db.rpc("apply_channel_changes", {
+        "p_server_id": server_id,
+        "p_kind": kind,
+        "p_create": list(create),
+        "p_move": list(move),
+        "p_delete": list(delete),
+    }).execute()
+    await channels_changed([server_id])
+    return response.data
+
+async def channels_changed(server_ids) -> None:
+    # Сбрасывает быстрый путь ETag для списков каналов (core.etag)
+    for server_id in set(server_ids):
+        await bump_version("channels", server_id)
+
+def with_member_profiles(members: list, profiles: dict) -> list:
+    # Профили берём из общего кэша, форма ответа как у embedded select
+    return [
+        {**member, "profiles": project(profiles.get(member["user_id"]), ("username", "avatar_url"))}
+        for member in members
+    ]
+
+def voice_member_profiles(user_ids: list, profiles: dict) -> list:
+    return [
+        project(profiles[user_id], ("user_id", "username", "avatar_url"))
+        for user_id in user_ids
+        if user_id in profiles
+    ]
+
+@router.get("/{server_id}/bootstrap")
+async def get_server_bootstrap(server_id: str, user=Depends(get_current_user)):
+    """
+    Всё, что нужно клиенту для открытия сервера, одним ответом: сервер с ролью
+    пользователя, текстовые и голосовые каналы, участники и кто сейчас в
+    голосовых каналах. Запросы к БД идут параллельно, поэтому время ответа
+    близко к самому медленному из них, а не к их сумме.
+    """
     try:
-        supabase.table("voice_sessions").insert({
-            "channel_id": channel_id,
-            "user_id": user.user.id
-        }).execute()
-        return {"message": "User joined voice channel"}
+        membership, text_channels, voice_channels, members = await asyncio.gather(
+            db.table("server_members")
+                .select("role, servers(*)")
+                .eq("server_id", server_id)
+                .eq("user_id", user.user.id)
+                .maybe_single()
+                .execute(),
+            db.table("text_channels")
+                .select("*")
+                .eq("server_id", server_id)
+                .order("position")
+                .execute(),
+            db.table("voice_channels")
+                .select("*")
+                .eq("server_id", server_id)
+                .order("position")
+                .execute(),
+            db.table("server_members")
+                .select("*")
+                .eq("server_id", server_id)
+                .execute(),
+        )
     except Exception as e:
-        if "duplicate key" in str(e):
-            return {"message": "Already in voice channel"}
-        raise HTTPException(status_code=400, detail=str(e))
+        raise HTTPException(status_code=500, detail=f"Ошибка при загрузке сервера: {e}")
+
+    if not membership or not membership.data:
+        raise HTTPException(status_code=403, detail="Access denied")
+    if not membership.data.get("servers"):
+        raise HTTPException(status_code=404, detail="Server not found")
+
+    # Присутствие в голосовых каналах хранится в app.presence, без запросов к БД
+    presence = get_presence()
+    occupants = await asyncio.gather(*(presence.members(c["id"]) for c in voice_channels.data))
+    voice_members = dict(zip((c["id"] for c in voice_channels.data), occupants))
+
+    # Профили участников и тех, кто в голосе, — одним обращением к кэшу
+    profiles = await get_profile_cache().get_many([
+        *(m["user_id"] for m in members.data),
+        *(user_id for user_ids in occupants for user_id in user_ids),
+    ])
+
+    return {
+        "server": {**membership.data["servers"], "user_role": membership.data["role"]},
+        "text_channels": text_channels.data,
+        "voice_channels": voice_channels.data,
+        "members": with_member_profiles(members.data, profiles),
+        "voice_members": {
+            channel_id: voice_member_profiles(user_ids, profiles)
+            for channel_id, user_ids in voice_members.items()
+        },
+    }
+
+async def is_voice_channel(server_id: str, channel_id: str) -> bool:
+    """Канал существует и принадлежит серверу: присутствие запоминает сервер канала."""
+    try:
+        UUID(channel_id)
+    except ValueError:
+        return False
+    channel = await db.table("voice_channels") \
+        .select("id") \
+        .eq("id", channel_id) \
+        .eq("server_id", server_id) \
+        .maybe_single() \
+        .execute()
+    return bool(channel and channel.data)
+
+# Сессии голосовых каналов: хранятся в app.presence, а не в БД
+@router.post("/{server_id}/voicechannels/{channel_id}/join")
+async def join_voice_channel(server_id: UUID, channel_id: str, user=Depends(get_current_user)):
+    server_id = str(server_id)
+    if not await is_voice_channel(server_id, channel_id):
+        raise HTTPException(status_code=404, detail="Voice channel not found")
+    if not await get_presence().join(server_id, channel_id, user.user.id):
+        return {"message": "Already in voice channel"}
+    return {"message": "User joined voice channel"}
 
 @router.post("/{server_id}/voicechannels/{channel_id}/leave")
 async def leave_voice_channel(channel_id: str, user=Depends(get_current_user)):
-    try:
-        supabase.table("voice_sessions") \
-            .delete() \
-            .eq("channel_id", channel_id) \
-            .eq("user_id", user.user.id) \
-            .execute()
-        return {"message": "Left voice channel"}
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    await get_presence().leave(channel_id, user.user.id)
+    return {"message": "Left voice channel"}
 
 @router.get("/{server_id}/voicechannels/{channel_id}/members")
 async def get_voice_members(channel_id: str):
     try:
-        threshold = (datetime.utcnow() - timedelta(seconds=6)).isoformat()
-
-        # Удаляем "мертвые" сессии
-        supabase.table("voice_sessions") \
-            .delete() \
-            .lt("last_seen", threshold) \
-            .eq("channel_id", channel_id) \
-            .execute()
-        
-        # Получаем всех user_id из voice_sessions
-        response = supabase.table("voice_sessions") \
-            .select("user_id") \
-            .eq("channel_id", channel_id) \
-            .execute()
-
-        user_ids = [entry["user_id"] for entry in response.data]
+        user_ids = await get_presence().members(channel_id)
+        if not user_ids:
+            return []
 
-        # Получаем профили по этим user_id
-        profiles = supabase.table("profiles") \
-            .select("user_id, username, avatar_url") \
-            .in_("user_id", user_ids) \
-            .execute()
+        profiles = await get_profile_cache().get_many(user_ids)
 
-        return profiles.data
+        return voice_member_profiles(user_ids, profiles)
 
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.patch("/{server_id}/voicechannels/{channel_id}/heartbeat")
 async def heartbeat(channel_id: str, user=Depends(get_current_user)):
+    if not await get_presence().heartbeat(channel_id, user.user.id):
+        # Сессия уже истекла — клиенту нужно заново зайти в канал
+        return {"status": "not_in_channel"}
+    return {"status": "updated"}
+
+@router.websocket("/{server_id}/voice/ws")
+async def voice_presence_socket(websocket: WebSocket, server_id: str):
+    """
+    Подписка на голосовые каналы сервера. Сразу после подключения приходит
+    снимок {"type": "snapshot", "channels": {channel_id: [user_id, ...]}},
+    дальше — изменения {"type": "join" | "leave" | "timeout", "channel_id", "user_id"}.
+
+    Клиент входит и выходит сообщениями {"type": "join", "channel_id"} и
+    {"type": "leave"}. Открытый сокет сам считается сигналом присутствия:
+    heartbeat не нужен, а при разрыве соединения пользователь выходит из канала.
+    """
+    user = await authenticate_websocket(websocket)
+    if user is None:
+        await websocket.close(code=4401, reason="Invalid token")
+        return
+    user_id = user.user.id
+
+    member = await db.table("server_members") \
+        .select("role") \
+        .eq("server_id", server_id) \
+        .eq("user_id", user_id) \
+        .maybe_single() \
+        .execute()
+    if not member or not member.data:
+        await websocket.close(code=4403, reason="Access denied")
+        return
+
+    await websocket.accept()
+    presence = get_presence()
+    events = presence.hub.subscribe(server_id)
+    current_channel = None
+
+    async def push_events():
+        while True:
+            event = await events.get()
+            if event is None:
+                # Клиент не успевал читать события — пусть переподключится за снимком
+                await websocket.close(code=4408, reason="Too slow")
+                return
+            await websocket.send_json(event)
+
+    async def keep_alive():
+        while True:
+            await asyncio.sleep(presence.ttl / 3)
+            if current_channel is not None:
+                await presence.heartbeat(current_channel, user_id)
+
     try:
-        supabase.table("voice_sessions") \
-            .update({"last_seen": "now()"}) \
-            .eq("channel_id", channel_id) \
-            .eq("user_id", user.user.id) \
+        channels = await db.table("voice_channels") \
+            .select("id") \
+            .eq("server_id", server_id) \
             .execute()
-        return {"status": "updated"}
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        # Каналы сервера; созданные после подключения проверяются по БД при входе
+        known_channels = {channel["id"] for channel in channels.data}
+        await websocket.send_json({
+            "type": "snapshot",
+            "channels": {
+                channel["id"]: await presence.members(channel["id"])
+                for channel in channels.data
+            },
+        })
+
+        tasks = [asyncio.create_task(push_events()), asyncio.create_task(keep_alive())]
+        try:
+            while True:
+                message = await receive_object(websocket)
+                if message is None:
+                    continue
+                if message.get("type") == "join" and message.get("channel_id"):
+                    channel_id = str(message["channel_id"])
+                    if channel_id not in known_channels:
+                        if not await is_voice_channel(server_id, channel_id):
+                            await websocket.send_json({"type": "error", "detail": "Voice channel not found"})
+                            continue
+                        known_channels.add(channel_id)
+                    if current_channel is not None and current_channel != channel_id:
+                        await presence.leave(current_channel, user_id)
+                    current_channel = channel_id
+                    await presence.join(server_id, current_channel, user_id)
+                elif message.get("type") == "leave" and current_channel is not None:
+                    await presence.leave(current_channel, user_id)
+                    current_channel = None
+                elif message.get("type") == "ping":
+                    await websocket.send_json({"type": "pong"})
+        finally:
+            for task in tasks:
+                task.cancel()
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        presence.hub.unsubscribe(server_id, events)
+        if current_channel is not None:
+            await presence.leave(current_channel, user_id)
 
 # @router.put("/{server_id}")
 # async def update_server(
@@ -601,7 +774,7 @@ async def heartbeat(channel_id: str, user=Depends(get_current_user)):
 # ):
 #     try:
 #         # Проверяем права (только owner/admin могут редактировать)
-#         member = supabase.table("server_members") \
+#         member = await db.table("server_members") \
 #             .select("role") \
 #             .eq("user_id", user.user.id) \
 #             .eq("server_id", server_id) \
@@ -614,7 +787,7 @@ async def heartbeat(channel_id: str, user=Depends(get_current_user)):
         
 #         # Обновляем сервер
 #         update_data = {k: v for k, v in server.dict().items() if v is not None}
-#         result = supabase.table("servers") \
+#         result = await db.table("servers") \
 #             .update(update_data) \
 #             .eq("id", server_id) \
 #             .execute()
@@ -1,6 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import date
 from typing import Optional
+from uuid import UUID
 
 class ServerCreate(BaseModel):
     name: str
@@ -22,7 +23,7 @@ class TextChannel(BaseModel):
     server_id: str
     name: str
     description: str | None
-    position: str
+    position: float
     is_private: bool
     created_at: str
     updated_at: str
@@ -36,7 +37,7 @@ class VoiceChannel(BaseModel):
     server_id: str
     name: str
     description: str | None
-    position: int
+    position: float
     is_private: bool
     created_at: str
     updated_at: str
@@ -46,6 +47,17 @@ class VoiceChannelCreate(BaseModel):
     description: Optional[str] = None
     is_private: bool = False
 
+class ChannelMove(BaseModel):
+    id: UUID
+    # Канал, после которого встаёт перемещаемый; None — в начало списка
+    after: Optional[UUID] = None
+
+class ChannelBulk(BaseModel):
+    # Применяются одной транзакцией: удаления, создания (в конец), перемещения
+    create: list[TextChannelCreate] = Field(default_factory=list, max_length=100)
+    move: list[ChannelMove] = Field(default_factory=list, max_length=100)
+    delete: list[UUID] = Field(default_factory=list, max_length=100)
+
 class InviteResponse(BaseModel):
     status: str  # 'pending', 'accepted', 'rejected'
 class InviteCreate(BaseModel):
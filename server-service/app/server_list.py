@@ -0,0 +1,95 @@
+"""
+Кэш списка серверов пользователя (GET /servers/my-servers).
+
+Список меняется только когда пользователь создаёт сервер, вступает в него,
+выходит или сервер удаляют; эти обработчики вызывают invalidate_server_lists,
+и запись сбрасывается во всех репликах через core.pubsub.
+MY_SERVERS_CACHE_TTL=0 отключает кэш.
+"""
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Iterable, Optional
+
+from core.config import setting_float, setting_int
+from core.pubsub import get_broker
+
+INVALIDATION_CHANNEL = "servers.my.invalidate"
+
+
+class ServerListCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        # user_id -> (истекает, список серверов)
+        self._entries: "OrderedDict[str, tuple[float, list]]" = OrderedDict()
+        # Растёт при каждой инвалидации: ответ, начатый до неё, не кэшируем
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def get(self, user_id: str, load: Callable[[], Awaitable[list]]) -> list:
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        generation = self._generation
+        servers = await load()
+        if self.ttl > 0 and generation == self._generation:
+            self._entries[user_id] = (time.monotonic() + self.ttl, servers)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return servers
+
+    def invalidate_local(self, user_ids: Iterable[str]) -> None:
+        self._generation += 1
+        for user_id in user_ids:
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_cache: Optional[ServerListCache] = None
+
+
+def get_server_list_cache() -> ServerListCache:
+    global _cache
+    if _cache is None:
+        _cache = ServerListCache(
+            max_size=setting_int("MY_SERVERS_CACHE_SIZE", 10000),
+            ttl=setting_float("MY_SERVERS_CACHE_TTL", 300),
+        )
+        get_broker().subscribe(INVALIDATION_CHANNEL, _on_invalidate)
+    return _cache
+
+
+async def _on_invalidate(message: dict) -> None:
+    if _cache is not None:
+        _cache.invalidate_local(message["user_ids"])
+
+
+async def invalidate_server_lists(user_ids: Iterable[str]) -> None:
+    """Сбрасывает кэш my-servers у пользователей во всех репликах."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    get_server_list_cache().invalidate_local(user_ids)
+    await get_broker().publish(INVALIDATION_CHANNEL, {"user_ids": user_ids})
+
+
+def server_list_cache_stats() -> Optional[dict]:
+    return _cache.stats() if _cache is not None else None
@@ -0,0 +1,143 @@
+import time
+from functools import partial
+
+import pytest
+
+from app.presence import MemoryPresenceBackend, RedisPresenceBackend, VoicePresence
+from app.presence.engine import EVENTS_CHANNEL
+from core.pubsub import LocalBroker
+from core.redis_client import LocalRedis
+
+pytestmark = pytest.mark.anyio
+
+TTL = 6.0
+
+
+class Clock:
+    def __init__(self):
+        # Колесо таймеров MemoryPresenceBackend отсчитывает тики от time.time()
+        self.now = time.time()
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request):
+    if request.param == "memory":
+        return MemoryPresenceBackend()
+    return RedisPresenceBackend(LocalRedis())
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def presence(backend, clock):
+    return VoicePresence(backend, ttl=TTL, clock=clock)
+
+
+async def test_join_adds_member_once(presence):
+    events = presence.hub.subscribe("server")
+
+    assert await presence.join("server", "channel", "alice")
+    assert not await presence.join("server", "channel", "alice")
+
+    assert await presence.members("channel") == ["alice"]
+    assert events.get_nowait() == {"type": "join", "channel_id": "channel", "user_id": "alice"}
+    assert events.empty()
+
+
+async def test_leave_removes_member(presence):
+    await presence.join("server", "channel", "alice")
+    await presence.join("server", "channel", "bob")
+    events = presence.hub.subscribe("server")
+
+    assert await presence.leave("channel", "alice")
+    assert not await presence.leave("channel", "alice")
+
+    assert await presence.members("channel") == ["bob"]
+    assert events.get_nowait() == {"type": "leave", "channel_id": "channel", "user_id": "alice"}
+    assert events.empty()
+
+
+async def test_timeout_expires_silent_member(presence, clock):
+    await presence.join("server", "channel", "alice")
+    events = presence.hub.subscribe("server")
+
+    clock.advance(TTL - 1)
+    assert await presence.sweep() == []
+    assert await presence.members("channel") == ["alice"]
+
+    clock.advance(2)
+    assert await presence.members("channel") == []
+    assert await presence.sweep() == [("channel", "alice")]
+    assert await presence.sweep() == []
+    assert events.get_nowait() == {"type": "timeout", "channel_id": "channel", "user_id": "alice"}
+    assert not await presence.leave("channel", "alice")
+
+
+async def test_heartbeat_extends_presence(presence, clock):
+    await presence.join("server", "channel", "alice")
+
+    clock.advance(TTL - 1)
+    assert await presence.heartbeat("channel", "alice")
+    clock.advance(TTL - 1)
+    assert await presence.sweep() == []
+    assert await presence.members("channel") == ["alice"]
+
+    clock.advance(2)
+    assert await presence.sweep() == [("channel", "alice")]
+
+
+async def test_heartbeat_after_leave_is_rejected(presence):
+    await presence.join("server", "channel", "alice")
+    await presence.leave("channel", "alice")
+
+    assert not await presence.heartbeat("channel", "alice")
+    assert await presence.members("channel") == []
+
+
+async def test_empty_channel_forgets_server(clock):
+    backend = MemoryPresenceBackend()
+    presence = VoicePresence(backend, ttl=TTL, clock=clock)
+    events = presence.hub.subscribe("server")
+    await presence.join("server", "left", "alice")
+    await presence.join("server", "idle", "bob")
+
+    await presence.leave("left", "alice")
+    clock.advance(TTL + 1)
+    await presence.sweep()
+
+    assert await backend.server_of("left") is None
+    assert await backend.server_of("idle") is None
+    assert [events.get_nowait()["type"] for _ in range(4)] == ["join", "join", "leave", "timeout"]
+
+
+async def test_replicas_share_events_and_time_out_once(clock):
+    redis, broker = LocalRedis(), LocalBroker()
+    replicas = [
+        VoicePresence(RedisPresenceBackend(redis), ttl=TTL, clock=clock, broker=broker)
+        for _ in range(2)
+    ]
+    for replica in replicas:
+        broker.subscribe(EVENTS_CHANNEL, partial(_deliver, replica))
+    first, second = (replica.hub.subscribe("server") for replica in replicas)
+
+    await replicas[0].join("server", "channel", "alice")
+    clock.advance(TTL + 1)
+    swept = [await replica.sweep() for replica in replicas]
+
+    assert swept == [[("channel", "alice")], []]
+    for events in (first, second):
+        assert [events.get_nowait()["type"] for _ in range(2)] == ["join", "timeout"]
+        assert events.empty()
+
+
+async def _deliver(presence, message):
+    presence.deliver(message)
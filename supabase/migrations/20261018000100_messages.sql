@@ -0,0 +1,17 @@
+-- Сообщения текстовых каналов (chat-service)
+create table if not exists public.messages (
+    id uuid primary key,
+    channel_id uuid not null references public.text_channels(id) on delete cascade,
+    author_id uuid not null references public.profiles(user_id) on delete cascade,
+    content text not null,
+    created_at timestamptz not null default now(),
+    edited_at timestamptz
+);
+
+-- История канала читается от новых к старым
+create index if not exists messages_channel_created_idx
+    on public.messages (channel_id, created_at desc, id desc);
+
+-- Сообщения читает и пишет только chat-service (ключ service_role обходит RLS);
+-- без политик anon и authenticated не видят таблицу через PostgREST
+alter table public.messages enable row level security;
@@ -0,0 +1,14 @@
+-- Индекс загруженных изображений по SHA-256 содержимого (core.upload_index).
+-- Ключ — "папка:sha256", одинаковые файлы в разных папках хранятся отдельно.
+create table if not exists public.upload_index (
+    sha256 text primary key,
+    url text not null,
+    size integer not null,
+    created_at timestamptz not null default now()
+);
+
+-- forget(url) при удалении картинки
+create index if not exists upload_index_url_idx on public.upload_index (url);
+
+-- Индекс ведут только сервисы (ключ service_role обходит RLS)
+alter table public.upload_index enable row level security;
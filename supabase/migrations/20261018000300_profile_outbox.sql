@@ -0,0 +1,130 @@
+-- Изменение полей профиля с отложенным обновлением денормализованных копий
+-- (friends.sender_name / receiver_name и т.п.).
+--
+-- set_profile_field в одной транзакции меняет строку profiles и кладёт
+-- задание в profile_outbox; process_profile_outbox (вызывает фоновая задача
+-- auth-service) переносит новое значение во все колонки-копии из
+-- profile_fanout_targets. Чтобы денормализовать ещё одно поле, достаточно
+-- добавить строку в profile_fanout_targets.
+
+create table if not exists public.profile_fanout_targets (
+    field text not null,
+    target_table text not null,
+    key_column text not null,
+    target_column text not null,
+    primary key (field, target_table, key_column, target_column)
+);
+
+insert into public.profile_fanout_targets (field, target_table, key_column, target_column) values
+    ('username', 'friends', 'sender_id', 'sender_name'),
+    ('username', 'friends', 'receiver_id', 'receiver_name')
+on conflict do nothing;
+
+create table if not exists public.profile_outbox (
+    id bigserial primary key,
+    user_id uuid not null,
+    field text not null,
+    value text,
+    created_at timestamptz not null default now(),
+    processed_at timestamptz,
+    attempts integer not null default 0,
+    last_error text
+);
+
+create index if not exists profile_outbox_pending_idx
+    on public.profile_outbox (id) where processed_at is null;
+
+create index if not exists profile_outbox_user_field_idx
+    on public.profile_outbox (user_id, field, id);
+
+
+create or replace function public.set_profile_field(p_user_id uuid, p_field text, p_value text)
+returns void
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    updated integer;
+begin
+    if p_field not in ('username', 'first_name', 'avatar_url') then
+        raise exception 'field % cannot be updated', p_field using errcode = '22023';
+    end if;
+
+    if p_field = 'username' then
+        -- Две одновременные попытки занять одно имя выполняются по очереди
+        perform pg_advisory_xact_lock(hashtext('profiles.username:' || p_value));
+        if exists (select 1 from profiles where username = p_value and user_id <> p_user_id) then
+            raise exception 'username % is already taken', p_value using errcode = '23505';
+        end if;
+    end if;
+
+    execute format('update profiles set %I = $1 where user_id = $2', p_field)
+        using p_value, p_user_id;
+    get diagnostics updated = row_count;
+    if updated = 0 then
+        raise exception 'profile % not found', p_user_id using errcode = 'P0002';
+    end if;
+
+    if exists (select 1 from profile_fanout_targets where field = p_field) then
+        insert into profile_outbox (user_id, field, value) values (p_user_id, p_field, p_value);
+    end if;
+end;
+$$;
+
+
+create or replace function public.process_profile_outbox(p_limit integer default 100)
+returns integer
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    job record;
+    target record;
+    processed integer := 0;
+begin
+    for job in
+        select * from profile_outbox
+        where processed_at is null and attempts < 10
+        order by id
+        limit p_limit
+        for update skip locked
+    loop
+        begin
+            -- Если поле с тех пор менялось ещё раз, копии обновит более новое задание
+            if not exists (
+                select 1 from profile_outbox newer
+                where newer.user_id = job.user_id and newer.field = job.field and newer.id > job.id
+            ) then
+                for target in select * from profile_fanout_targets where field = job.field loop
+                    execute format(
+                        'update %I set %I = $1 where %I = $2 and %I is distinct from $1',
+                        target.target_table, target.target_column, target.key_column, target.target_column
+                    ) using job.value, job.user_id;
+                end loop;
+            end if;
+            update profile_outbox set processed_at = now(), attempts = attempts + 1 where id = job.id;
+        exception when others then
+            update profile_outbox set attempts = attempts + 1, last_error = sqlerrm where id = job.id;
+        end;
+        processed := processed + 1;
+    end loop;
+
+    delete from profile_outbox where processed_at < now() - interval '7 days';
+    return processed;
+end;
+$$;
+
+
+-- Функции принимают p_user_id от вызывающего и работают в обход RLS:
+-- вызывать их может только сервис (ключ service_role), не клиенты с anon
+-- или пользовательским токеном
+revoke execute on function public.set_profile_field(uuid, text, text) from public, anon, authenticated;
+revoke execute on function public.process_profile_outbox(integer) from public, anon, authenticated;
+grant execute on function public.set_profile_field(uuid, text, text) to service_role;
+grant execute on function public.process_profile_outbox(integer) to service_role;
+
+-- Таблицы читает и пишет только сервис (service_role обходит RLS)
+alter table public.profile_fanout_targets enable row level security;
+alter table public.profile_outbox enable row level security;
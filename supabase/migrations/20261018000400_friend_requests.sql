@@ -0,0 +1,93 @@
+-- Заявки в друзья одной операцией на стороне БД.
+--
+-- Пара пользователей хранится в каноническом виде (user_low, user_high) =
+-- (min(id), max(id)) с уникальным индексом, поэтому две одновременные
+-- заявки между одними и теми же людьми (в любую сторону) не могут обе
+-- вставиться. idempotency_key делает повтор запроса клиентом безопасным.
+
+alter table public.friends
+    add column if not exists user_low uuid generated always as (least(sender_id, receiver_id)) stored,
+    add column if not exists user_high uuid generated always as (greatest(sender_id, receiver_id)) stored,
+    add column if not exists idempotency_key text;
+
+-- Дубликаты, которые успела создать гонка, мешают уникальному индексу:
+-- оставляем по одной строке на пару, предпочитая принятую дружбу
+delete from public.friends f
+using (
+    select id, row_number() over (
+        partition by least(sender_id, receiver_id), greatest(sender_id, receiver_id)
+        order by (status = 'accepted') desc, (status = 'pending') desc, id
+    ) as rank
+    from public.friends
+) ranked
+where f.id = ranked.id and ranked.rank > 1;
+
+create unique index if not exists friends_pair_key
+    on public.friends (user_low, user_high);
+
+create unique index if not exists friends_idempotency_key
+    on public.friends (sender_id, idempotency_key) where idempotency_key is not null;
+
+
+-- Результат: {"result": "created" | "replayed" | "exists", "id", "status",
+-- "receiver_id"} — receiver_id нужен сервису для уведомления получателя.
+-- Ошибки: P0002 — получатель не найден, 22023 — заявка самому себе,
+-- 23505 — ключ идемпотентности уже использован для другой заявки.
+create or replace function public.send_friend_request(
+    p_sender_id uuid,
+    p_receiver_username text,
+    p_idempotency_key text default null
+)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    receiver profiles%rowtype;
+    sender_name text;
+    existing friends%rowtype;
+    new_id uuid;
+begin
+    select * into receiver from profiles where username = p_receiver_username;
+    if not found then
+        raise exception 'user % not found', p_receiver_username using errcode = 'P0002';
+    end if;
+    if receiver.user_id = p_sender_id then
+        raise exception 'cannot send a friend request to yourself' using errcode = '22023';
+    end if;
+
+    select username into sender_name from profiles where user_id = p_sender_id;
+
+    insert into friends (id, sender_id, receiver_id, status, sender_name, receiver_name, idempotency_key)
+    values (gen_random_uuid(), p_sender_id, receiver.user_id, 'pending', sender_name, receiver.username, p_idempotency_key)
+    on conflict do nothing
+    returning id into new_id;
+
+    if new_id is not null then
+        return jsonb_build_object('result', 'created', 'id', new_id, 'status', 'pending', 'receiver_id', receiver.user_id);
+    end if;
+
+    -- Вставка не прошла: это повтор того же запроса или пара уже связана
+    if p_idempotency_key is not null then
+        select * into existing from friends
+        where sender_id = p_sender_id and idempotency_key = p_idempotency_key;
+        if found then
+            if existing.receiver_id <> receiver.user_id then
+                raise exception 'idempotency key was used for another request' using errcode = '23505';
+            end if;
+            return jsonb_build_object('result', 'replayed', 'id', existing.id, 'status', existing.status, 'receiver_id', receiver.user_id);
+        end if;
+    end if;
+
+    select * into existing from friends
+    where user_low = least(p_sender_id, receiver.user_id)
+      and user_high = greatest(p_sender_id, receiver.user_id);
+    return jsonb_build_object('result', 'exists', 'id', existing.id, 'status', existing.status, 'receiver_id', receiver.user_id);
+end;
+$$;
+
+-- p_sender_id передаёт friends-service после проверки токена; клиент не должен
+-- вызывать функцию напрямую и подставлять чужой id
+revoke execute on function public.send_friend_request(uuid, text, text) from public, anon, authenticated;
+grant execute on function public.send_friend_request(uuid, text, text) to service_role;
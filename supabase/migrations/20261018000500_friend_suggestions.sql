@@ -0,0 +1,14 @@
+-- Предрасчитанные «возможные друзья» (friends-service, app.suggestions).
+-- Одна строка на пользователя: кандидаты по убыванию числа общих друзей.
+create table if not exists public.friend_suggestions (
+    user_id uuid primary key,
+    candidates uuid[] not null,
+    mutual_counts integer[] not null,
+    computed_at timestamptz not null default now()
+);
+
+create index if not exists friend_suggestions_computed_idx
+    on public.friend_suggestions (computed_at);
+
+-- Таблицу ведёт и читает только friends-service (service_role обходит RLS)
+alter table public.friend_suggestions enable row level security;
@@ -0,0 +1,113 @@
+-- Счётчики для значков уведомлений: входящие заявки в друзья и приглашения
+-- на серверы в статусе pending.
+--
+-- Счётчики ведут триггеры на friends и server_invites, поэтому они верны при
+-- любом способе записи (RPC send_friend_request, каскадное удаление сервера
+-- и т.п.). Поток уведомлений (core.notifications) при подключении клиента
+-- читает одну строку по ключу вместо подсчёта заявок.
+
+create table if not exists public.notification_badges (
+    user_id uuid primary key,
+    friend_requests integer not null default 0,
+    server_invites integer not null default 0
+);
+
+-- Счётчики читают только сервисы (service_role обходит RLS)
+alter table public.notification_badges enable row level security;
+
+
+create or replace function public.friends_badge_trigger()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') and old.status = 'pending' then
+        update notification_badges
+        set friend_requests = greatest(friend_requests - 1, 0)
+        where user_id = old.receiver_id;
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') and new.status = 'pending' then
+        insert into notification_badges (user_id, friend_requests)
+        values (new.receiver_id, 1)
+        on conflict (user_id) do update
+        set friend_requests = notification_badges.friend_requests + 1;
+    end if;
+    return null;
+end;
+$$;
+
+create or replace function public.server_invites_badge_trigger()
+returns trigger
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') and old.status = 'pending' then
+        update notification_badges
+        set server_invites = greatest(server_invites - 1, 0)
+        where user_id = old.recipient_id;
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') and new.status = 'pending' then
+        insert into notification_badges (user_id, server_invites)
+        values (new.recipient_id, 1)
+        on conflict (user_id) do update
+        set server_invites = notification_badges.server_invites + 1;
+    end if;
+    return null;
+end;
+$$;
+
+
+-- Заявки, созданные между подсчётом и созданием триггеров, не должны потеряться
+begin;
+
+lock table public.friends, public.server_invites in share row exclusive mode;
+
+delete from public.notification_badges;
+insert into public.notification_badges (user_id, friend_requests, server_invites)
+select user_id, sum(friend_requests), sum(server_invites)
+from (
+    select receiver_id as user_id, count(*) as friend_requests, 0 as server_invites
+    from public.friends
+    where status = 'pending' and receiver_id is not null
+    group by receiver_id
+    union all
+    select recipient_id, 0, count(*)
+    from public.server_invites
+    where status = 'pending' and recipient_id is not null
+    group by recipient_id
+) pending
+group by user_id
+on conflict (user_id) do update
+set friend_requests = excluded.friend_requests,
+    server_invites = excluded.server_invites;
+
+drop trigger if exists friends_badge_insert_delete on public.friends;
+create trigger friends_badge_insert_delete
+    after insert or delete on public.friends
+    for each row execute function public.friends_badge_trigger();
+
+-- Обновления имён (profile_outbox) и прочих колонок счётчик не трогают
+drop trigger if exists friends_badge_update on public.friends;
+create trigger friends_badge_update
+    after update on public.friends
+    for each row
+    when (old.status is distinct from new.status or old.receiver_id is distinct from new.receiver_id)
+    execute function public.friends_badge_trigger();
+
+drop trigger if exists server_invites_badge_insert_delete on public.server_invites;
+create trigger server_invites_badge_insert_delete
+    after insert or delete on public.server_invites
+    for each row execute function public.server_invites_badge_trigger();
+
+drop trigger if exists server_invites_badge_update on public.server_invites;
+create trigger server_invites_badge_update
+    after update on public.server_invites
+    for each row
+    when (old.status is distinct from new.status or old.recipient_id is distinct from new.recipient_id)
+    execute function public.server_invites_badge_trigger();
+
+commit;
@@ -0,0 +1,179 @@
+-- Позиции каналов выделяются на стороне БД, перестановка — дробными позициями.
+--
+-- Раньше создание канала читало max(position) и вставляло max+1 вторым
+-- запросом: два обращения к БД, а два одновременных создания получали одну
+-- и ту же позицию. apply_channel_changes блокирует строку сервера и
+-- выполняет удаления, создания и перестановки одной транзакцией.
+--
+-- Перемещённый канал получает позицию посередине между соседями, поэтому
+-- перестановка переписывает одну строку. Когда промежуток между соседями
+-- становится меньше точности double, позиции сервера перенумеровываются
+-- (1, 2, 3, ...) — это случается только после десятков перемещений в одно
+-- и то же место подряд.
+
+alter table public.text_channels
+    alter column position type double precision using position::double precision;
+alter table public.voice_channels
+    alter column position type double precision using position::double precision;
+
+-- Дубли позиций, которые успела создать гонка max+1, и пустые позиции
+-- мешают вставке посередине: перенумеровываем по текущему порядку
+update public.text_channels c
+set position = ranked.rank
+from (
+    select id, row_number() over (
+        partition by server_id order by position nulls last, created_at, id
+    ) as rank
+    from public.text_channels
+) ranked
+where c.id = ranked.id and c.position is distinct from ranked.rank;
+
+update public.voice_channels c
+set position = ranked.rank
+from (
+    select id, row_number() over (
+        partition by server_id order by position nulls last, created_at, id
+    ) as rank
+    from public.voice_channels
+) ranked
+where c.id = ranked.id and c.position is distinct from ranked.rank;
+
+create index if not exists text_channels_server_position_idx
+    on public.text_channels (server_id, position);
+create index if not exists voice_channels_server_position_idx
+    on public.voice_channels (server_id, position);
+
+
+-- p_kind: 'text' | 'voice'.
+-- p_create: [{"name", "description", "is_private"}] — добавляются в конец
+--   списка в указанном порядке.
+-- p_move: [{"id", "after"}] — канал ставится сразу после канала "after"
+--   (null — в начало списка); применяются по очереди.
+-- p_delete: id удаляемых каналов.
+-- Порядок: удаления, создания, перемещения.
+-- Результат: {"created": [каналы], "deleted": [id], "channels": [все каналы по position]}.
+-- Ошибки: P0002 — сервер или канал не найден, 22023 — неверный p_kind или
+-- перемещение канала после самого себя.
+create or replace function public.apply_channel_changes(
+    p_server_id uuid,
+    p_kind text,
+    p_create jsonb default '[]'::jsonb,
+    p_move jsonb default '[]'::jsonb,
+    p_delete uuid[] default '{}'::uuid[]
+)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    tbl text;
+    next_position double precision;
+    created jsonb;
+    deleted jsonb;
+    channels jsonb;
+    move jsonb;
+    moved_id uuid;
+    after_id uuid;
+    anchor double precision;
+    following double precision;
+    new_position double precision;
+    updated integer;
+begin
+    if p_kind not in ('text', 'voice') then
+        raise exception 'unknown channel kind %', p_kind using errcode = '22023';
+    end if;
+    tbl := p_kind || '_channels';
+
+    -- Одновременные изменения каналов одного сервера выполняются по очереди
+    perform 1 from servers where id = p_server_id for update;
+    if not found then
+        raise exception 'server % not found', p_server_id using errcode = 'P0002';
+    end if;
+
+    execute format(
+        'with gone as (delete from %I where server_id = $1 and id = any($2) returning id)
+         select coalesce(jsonb_agg(id), ''[]''::jsonb) from gone',
+        tbl
+    ) into deleted using p_server_id, p_delete;
+
+    execute format('select coalesce(max(position), 0) from %I where server_id = $1', tbl)
+        into next_position using p_server_id;
+
+    execute format(
+        'with added as (
+             insert into %I (server_id, name, description, is_private, position)
+             select $1, c.value->>''name'', c.value->>''description'',
+                    coalesce((c.value->>''is_private'')::boolean, false), $2 + c.ordinality
+             from jsonb_array_elements($3) with ordinality as c
+             returning *
+         )
+         select coalesce(jsonb_agg(to_jsonb(added) order by added.position), ''[]''::jsonb) from added',
+        tbl
+    ) into created using p_server_id, next_position, p_create;
+
+    for move in select value from jsonb_array_elements(p_move) loop
+        moved_id := (move->>'id')::uuid;
+        after_id := (move->>'after')::uuid;
+        if moved_id = after_id then
+            raise exception 'channel % cannot be placed after itself', moved_id using errcode = '22023';
+        end if;
+
+        for attempt in 1..2 loop
+            if after_id is null then
+                anchor := null;
+                execute format('select min(position) from %I where server_id = $1 and id <> $2', tbl)
+                    into following using p_server_id, moved_id;
+            else
+                execute format('select position from %I where server_id = $1 and id = $2', tbl)
+                    into anchor using p_server_id, after_id;
+                if anchor is null then
+                    raise exception 'channel % not found', after_id using errcode = 'P0002';
+                end if;
+                execute format(
+                    'select min(position) from %I where server_id = $1 and id <> $2 and position > $3',
+                    tbl
+                ) into following using p_server_id, moved_id, anchor;
+            end if;
+
+            new_position := case
+                when anchor is null and following is null then 1
+                when anchor is null then following - 1
+                when following is null then anchor + 1
+                else (anchor + following) / 2
+            end;
+            exit when anchor is null or following is null
+                or (new_position > anchor and new_position < following);
+
+            -- Промежуток исчерпан: перенумеровываем сервер и считаем заново
+            execute format(
+                'update %1$I c set position = ranked.rank
+                 from (select id, row_number() over (order by position, id) as rank
+                       from %1$I where server_id = $1) ranked
+                 where c.id = ranked.id',
+                tbl
+            ) using p_server_id;
+        end loop;
+
+        execute format('update %I set position = $3 where server_id = $1 and id = $2', tbl)
+            using p_server_id, moved_id, new_position;
+        get diagnostics updated = row_count;
+        if updated = 0 then
+            raise exception 'channel % not found', moved_id using errcode = 'P0002';
+        end if;
+    end loop;
+
+    execute format(
+        'select coalesce(jsonb_agg(to_jsonb(c) order by c.position), ''[]''::jsonb) from %I c where server_id = $1',
+        tbl
+    ) into channels using p_server_id;
+
+    return jsonb_build_object('created', created, 'deleted', deleted, 'channels', channels);
+end;
+$$;
+
+
+-- Права на сервер проверяет server-service до вызова, функция работает в
+-- обход RLS: вызывать её может только сервис (ключ service_role)
+revoke execute on function public.apply_channel_changes(uuid, text, jsonb, jsonb, uuid[]) from public, anon, authenticated;
+grant execute on function public.apply_channel_changes(uuid, text, jsonb, jsonb, uuid[]) to service_role;
@@ -0,0 +1,116 @@
+-- Удаление сервера фоновым заданием (server-service, app.deletion).
+--
+-- DELETE /servers/{id} только ставит задание в server_deletions и сразу
+-- отвечает 202. Фоновая задача забирает задания (claim_server_deletions,
+-- for update skip locked — несколько реплик не берут одно задание) и
+-- проходит два шага:
+--   pending -> cleanup: delete_server_cascade одной транзакцией удаляет
+--     сервер со всеми каналами, сообщениями, участниками, приглашениями и
+--     голосовыми сессиями;
+--   cleanup -> done: удаление картинки сервера из Cloudinary.
+-- Неудачный шаг повторяется с растущей задержкой (run_after), после
+-- нескольких попыток задание остаётся в статусе failed с last_error.
+
+create table if not exists public.server_deletions (
+    server_id uuid primary key,
+    requested_by uuid not null,
+    requested_at timestamptz not null default now(),
+    status text not null default 'pending'
+        check (status in ('pending', 'cleanup', 'done', 'failed')),
+    -- Картинка, которую нужно удалить из хранилища (заполняет каскад)
+    media_url text,
+    attempts integer not null default 0,
+    run_after timestamptz not null default now(),
+    last_error text,
+    finished_at timestamptz
+);
+
+create index if not exists server_deletions_due_idx
+    on public.server_deletions (run_after) where status in ('pending', 'cleanup');
+
+
+-- Задания, срок которых подошёл. Взятое задание откладывается на p_lease
+-- секунд: если реплика упадёт посреди шага, его повторит другая.
+create or replace function public.claim_server_deletions(p_limit integer default 10, p_lease integer default 60)
+returns setof public.server_deletions
+language sql
+security definer
+set search_path = public
+as $$
+    update server_deletions d
+    set attempts = d.attempts + 1,
+        run_after = now() + make_interval(secs => p_lease)
+    where d.server_id in (
+        select server_id from server_deletions
+        where status in ('pending', 'cleanup') and run_after <= now()
+        order by run_after
+        limit p_limit
+        for update skip locked
+    )
+    returning d.*;
+$$;
+
+
+-- Результат: {"members": [user_id], "voice_channels": [id], "media_url"}.
+-- media_url — картинка сервера, если её не использует другой сервер или
+-- профиль (одинаковые файлы загружаются один раз, см. core.upload_index).
+create or replace function public.delete_server_cascade(p_server_id uuid)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    image text;
+    members jsonb;
+    voice jsonb;
+begin
+    select image_url into image from servers where id = p_server_id for update;
+
+    select coalesce(jsonb_agg(user_id), '[]'::jsonb) into members
+    from server_members where server_id = p_server_id;
+    select coalesce(jsonb_agg(id), '[]'::jsonb) into voice
+    from voice_channels where server_id = p_server_id;
+
+    -- Таблица прежнего учёта присутствия, в новых установках её может не быть
+    if to_regclass('public.voice_sessions') is not null then
+        execute 'delete from voice_sessions where channel_id in (select id from voice_channels where server_id = $1)'
+            using p_server_id;
+    end if;
+    delete from server_invites where server_id = p_server_id;
+    delete from server_members where server_id = p_server_id;
+    delete from voice_channels where server_id = p_server_id;
+    -- Сообщения удаляются каскадом по messages.channel_id
+    delete from text_channels where server_id = p_server_id;
+    delete from servers where id = p_server_id;
+
+    if image is not null and (
+        exists (select 1 from servers where image_url = image)
+        or exists (select 1 from profiles where avatar_url = image)
+    ) then
+        image := null;
+    end if;
+
+    update server_deletions
+    set status = case when image is null then 'done' else 'cleanup' end,
+        media_url = image,
+        attempts = 0,
+        run_after = now(),
+        last_error = null,
+        finished_at = case when image is null then now() end
+    where server_id = p_server_id;
+
+    return jsonb_build_object('members', members, 'voice_channels', voice, 'media_url', image);
+end;
+$$;
+
+
+-- Задания ставит и выполняет только server-service: функции работают в
+-- обход RLS, вызывать их может только сервис (ключ service_role)
+revoke execute on function public.claim_server_deletions(integer, integer) from public, anon, authenticated;
+revoke execute on function public.delete_server_cascade(uuid) from public, anon, authenticated;
+grant execute on function public.claim_server_deletions(integer, integer) to service_role;
+grant execute on function public.delete_server_cascade(uuid) to service_role;
+
+-- Таблицу читает и пишет только сервис (service_role обходит RLS)
+alter table public.server_deletions enable row level security;
@@ -0,0 +1,13 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault("UPLOAD_STORAGE", "local")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
@@ -0,0 +1,116 @@
+import time
+
+import jwt
+import pytest
+from fastapi import HTTPException
+
+from core.auth import (
+    JWT_AUDIENCE,
+    Identity,
+    IdentityCache,
+    TokenVerifier,
+    VerifiedUser,
+    sign_identity,
+    verify_identity,
+)
+
+pytestmark = pytest.mark.anyio
+
+SECRET = "test-jwt-secret-with-enough-length-for-hs256"
+IDENTITY_SECRET = "internal-identity-secret"
+
+
+def token(exp_in: float = 3600, audience: str = JWT_AUDIENCE, secret: str = SECRET, sub: str = "user-1") -> str:
+    return jwt.encode(
+        {"sub": sub, "aud": audience, "exp": int(time.time() + exp_in), "email": "a@example.com", "role": "authenticated"},
+        secret,
+        algorithm="HS256",
+    )
+
+
+@pytest.fixture
+def verifier():
+    return TokenVerifier(jwt_secret=SECRET, cache=IdentityCache(ttl=300))
+
+
+async def test_valid_hs256_token(verifier):
+    identity = await verifier.verify(token())
+
+    assert identity.user.id == "user-1"
+    assert identity.user.email == "a@example.com"
+    assert verifier.cache.stats()["misses"] == 1
+
+
+async def test_cached_token_is_not_decoded_again(verifier, monkeypatch):
+    value = token()
+    await verifier.verify(value)
+
+    def fail(_):
+        raise AssertionError("decoded twice")
+
+    monkeypatch.setattr(verifier, "_decode_local", fail)
+    assert (await verifier.verify(value)).user.id == "user-1"
+    assert verifier.cache.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("value", [
+    token(exp_in=-10),
+    token(audience="anon"),
+    token(secret="another-secret-with-enough-length-for-hs256"),
+    "not-a-jwt",
+])
+async def test_invalid_tokens_are_rejected(verifier, value):
+    with pytest.raises(HTTPException) as error:
+        await verifier.verify(value)
+
+    assert error.value.status_code == 401
+    assert verifier.rejected == 1
+    assert verifier.cache.stats()["size"] == 0
+
+
+async def test_cache_ttl_is_capped_at_exp(verifier):
+    value = token(exp_in=2)
+    identity = await verifier.verify(value)
+
+    (expires, _), = verifier.cache._entries.values()
+    # Запись живёт до exp токена, а не AUTH_CACHE_TTL (300 с)
+    assert expires == identity.user.expires_at
+
+
+def test_peek_does_not_count(verifier):
+    identity = Identity(user=VerifiedUser(id="user-1", expires_at=int(time.time() + 60)))
+    verifier.cache.put("token", identity)
+
+    assert verifier.cache.peek("token") is identity
+    assert verifier.cache.peek("other") is None
+    assert verifier.cache.stats()["hits"] == verifier.cache.stats()["misses"] == 0
+
+
+def test_identity_round_trip():
+    identity = Identity(user=VerifiedUser(
+        id="user-1", email="a@example.com", role="authenticated",
+        expires_at=int(time.time() + 60), user_metadata={"name": "A"},
+    ))
+
+    assert verify_identity(sign_identity(identity, IDENTITY_SECRET), IDENTITY_SECRET) == identity
+
+
+def test_identity_tampering_is_rejected():
+    identity = Identity(user=VerifiedUser(id="user-1", expires_at=int(time.time() + 60)))
+    value = sign_identity(identity, IDENTITY_SECRET)
+    payload, signature = value.split(".")
+    forged = sign_identity(Identity(user=VerifiedUser(id="user-2", expires_at=identity.user.expires_at)), IDENTITY_SECRET)
+
+    assert verify_identity(value, "wrong-secret") is None
+    assert verify_identity(f"{forged.split('.')[0]}.{signature}", IDENTITY_SECRET) is None
+    assert verify_identity(payload, IDENTITY_SECRET) is None
+    assert verify_identity("garbage.!!!", IDENTITY_SECRET) is None
+
+
+def test_identity_expires():
+    expired = Identity(user=VerifiedUser(id="user-1", expires_at=int(time.time() - 1)))
+    fresh = Identity(user=VerifiedUser(id="user-1", expires_at=int(time.time() + 60)))
+
+    assert verify_identity(sign_identity(expired, IDENTITY_SECRET), IDENTITY_SECRET) is None
+    # Подпись шлюза старше max_age не принимается
+    assert verify_identity(sign_identity(fresh, IDENTITY_SECRET), IDENTITY_SECRET, max_age=-1) is None
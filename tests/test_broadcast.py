@@ -0,0 +1,39 @@
+import pytest
+from fastapi import FastAPI, WebSocket
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from core.broadcast import receive_object
+
+app = FastAPI()
+
+
+@app.websocket("/ws")
+async def echo(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        while True:
+            message = await receive_object(websocket)
+            await websocket.send_json({"received": message})
+    except WebSocketDisconnect:
+        pass
+
+
+@pytest.mark.parametrize("frame, expected", [
+    ('{"type": "ping"}', {"type": "ping"}),
+    ("not json", None),
+    ("[1, 2]", None),
+    ("42", None),
+    (b'{"type": "ping"}', None),
+])
+def test_receive_object_skips_bad_frames(frame, expected):
+    with TestClient(app).websocket_connect("/ws") as websocket:
+        if isinstance(frame, bytes):
+            websocket.send_bytes(frame)
+        else:
+            websocket.send_text(frame)
+        assert websocket.receive_json() == {"received": expected}
+        # Соединение живо после плохого кадра
+        websocket.send_text('{"type": "ping"}')
+        assert websocket.receive_json() == {"received": {"type": "ping"}}
+
@@ -0,0 +1,91 @@
+"""
+Одновременные заявки в друзья против RPC send_friend_request (миграция
+20261018000400). Нужна БД с применёнными миграциями: DATABASE_URL; без
+неё тесты пропускаются. FRIEND_RACE_PARALLEL — число соединений (100).
+"""
+import os
+import threading
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+PARALLEL = int(os.environ.get("FRIEND_RACE_PARALLEL", "100"))
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="DATABASE_URL is not set")
+
+
+@pytest.fixture
+def pair():
+    psycopg2 = pytest.importorskip("psycopg2")
+    users = [(str(uuid.uuid4()), f"race_{uuid.uuid4().hex[:12]}") for _ in range(2)]
+    ids = [user_id for user_id, _ in users]
+    with psycopg2.connect(DATABASE_URL) as conn, conn.cursor() as cur:
+        try:
+            cur.executemany("insert into profiles (user_id, username) values (%s, %s)", users)
+        except psycopg2.errors.ForeignKeyViolation:
+            pytest.skip("profiles требует пользователя в auth.users")
+    yield users
+    with psycopg2.connect(DATABASE_URL) as conn, conn.cursor() as cur:
+        cur.execute("delete from friends where sender_id = any(%s::uuid[]) or receiver_id = any(%s::uuid[])", (ids, ids))
+        cur.execute("delete from notification_badges where user_id = any(%s::uuid[])", (ids,))
+        cur.execute("delete from profiles where user_id = any(%s::uuid[])", (ids,))
+
+
+def race(calls: list[tuple]) -> tuple[Counter, set]:
+    """calls — (sender_id, receiver_username, idempotency_key) на каждое соединение."""
+    import psycopg2
+
+    connections = [psycopg2.connect(DATABASE_URL) for _ in calls]
+    for conn in connections:
+        conn.autocommit = True
+    barrier = threading.Barrier(len(calls))
+
+    def send(conn, call):
+        with conn.cursor() as cur:
+            barrier.wait()
+            cur.execute("select send_friend_request(%s, %s, %s)", call)
+            return cur.fetchone()[0]
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+            results = list(pool.map(send, connections, calls))
+    finally:
+        for conn in connections:
+            conn.close()
+    return Counter(result["result"] for result in results), {result["id"] for result in results}
+
+
+def pair_rows(a: str, b: str) -> int:
+    import psycopg2
+
+    with psycopg2.connect(DATABASE_URL) as conn, conn.cursor() as cur:
+        cur.execute("select count(*) from friends where user_low = least(%s::uuid, %s::uuid) "
+                    "and user_high = greatest(%s::uuid, %s::uuid)", (a, b, a, b))
+        return cur.fetchone()[0]
+
+
+def test_parallel_duplicates_create_one_request(pair):
+    (a, _), (b, name_b) = pair
+    results, ids = race([(a, name_b, None)] * PARALLEL)
+    assert results == {"created": 1, "exists": PARALLEL - 1}
+    assert len(ids) == 1
+    assert pair_rows(a, b) == 1
+
+
+def test_parallel_retries_with_same_key_are_replayed(pair):
+    (a, _), (b, name_b) = pair
+    results, ids = race([(a, name_b, "race-key")] * PARALLEL)
+    assert results == {"created": 1, "replayed": PARALLEL - 1}
+    assert len(ids) == 1
+    assert pair_rows(a, b) == 1
+
+
+def test_parallel_requests_in_both_directions(pair):
+    (a, name_a), (b, name_b) = pair
+    results, ids = race([(a, name_b, None) if i % 2 else (b, name_a, None) for i in range(PARALLEL)])
+    assert results == {"created": 1, "exists": PARALLEL - 1}
+    assert len(ids) == 1
+    assert pair_rows(a, b) == 1
@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+from core import profiles
+from core.profiles import ProfileCache, invalidate_profile
+from core.pubsub import LocalBroker
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeProfiles:
+    """Таблица profiles: select по in_ и eq, счётчик запросов."""
+
+    def __init__(self, rows: list[dict]):
+        self.rows = {row["user_id"]: row for row in rows}
+        self.queries = 0
+        # Вызывается посреди запроса — как изменение, пришедшее во время чтения
+        self.during_query = None
+
+    def table(self, name):
+        assert name == "profiles"
+        self._filter = lambda row: True
+        self._single = False
+        return self
+
+    def select(self, *columns):
+        return self
+
+    def in_(self, column, values):
+        self._filter = lambda row: row[column] in values
+        return self
+
+    def eq(self, column, value):
+        self._filter = lambda row: row[column] == value
+        self._single = True
+        return self
+
+    def maybe_single(self):
+        return self
+
+    async def execute(self):
+        self.queries += 1
+        rows = [dict(row) for row in self.rows.values() if self._filter(row)]
+        if self.during_query is not None:
+            self.during_query()
+        await asyncio.sleep(0)
+        result = type("Response", (), {})()
+        result.data = (rows[0] if rows else None) if self._single else rows
+        return result
+
+
+def profile(user_id: str, username: str) -> dict:
+    return {"user_id": user_id, "username": username, "first_name": username.title()}
+
+
+@pytest.fixture
+def table(monkeypatch):
+    table = FakeProfiles([profile(f"u{i}", f"user{i}") for i in range(5)])
+    monkeypatch.setattr(profiles, "db", table)
+    return table
+
+
+async def test_get_many_loads_misses_in_one_query(table):
+    cache = ProfileCache()
+
+    found = await cache.get_many(["u1", "u2", "u1", "missing"])
+    again = await cache.get_many(["u1", "u2"])
+
+    assert set(found) == {"u1", "u2"} and set(again) == {"u1", "u2"}
+    assert table.queries == 1
+    assert cache.stats()["hits"] == 2
+
+
+async def test_get_by_username_uses_cached_profile(table):
+    cache = ProfileCache()
+    await cache.get("u3")
+
+    assert (await cache.get_by_username("user3"))["user_id"] == "u3"
+    assert table.queries == 1
+
+
+async def test_lru_eviction(table):
+    cache = ProfileCache(max_size=2)
+    await cache.get("u0")
+    await cache.get("u1")
+    await cache.get("u0")  # u1 теперь самый старый
+    await cache.get("u2")
+
+    assert cache.stats()["evictions"] == 1
+    assert set(cache._entries) == {"u0", "u2"}
+    assert "user1" not in cache._by_username
+
+
+async def test_ttl_expiry(table):
+    cache = ProfileCache(ttl=0.01)
+    await cache.get("u0")
+    await asyncio.sleep(0.02)
+
+    await cache.get("u0")
+    assert table.queries == 2
+
+
+async def test_invalidation_during_query_is_not_cached(table):
+    cache = ProfileCache()
+    table.during_query = lambda: cache.invalidate_local("u0")
+
+    assert (await cache.get("u0"))["username"] == "user0"
+    assert "u0" not in cache._entries
+
+    table.during_query = None
+    await cache.get("u0")
+    assert "u0" in cache._entries
+
+
+async def test_memory_bytes_follows_entries(table):
+    cache = ProfileCache(max_size=2)
+    empty = cache.memory_bytes()
+    await cache.get_many(["u0", "u1", "u2"])
+
+    assert cache.stats()["memory_bytes"] == cache.memory_bytes() > empty
+    cache.invalidate_local("u1")
+    cache.invalidate_local("u2")
+    assert cache._bytes == 0
+
+
+async def test_invalidation_from_another_process(table, monkeypatch):
+    broker = LocalBroker()
+    monkeypatch.setattr(profiles, "get_broker", lambda: broker)
+    monkeypatch.setattr(profiles, "_cache", None)
+    cache = profiles.get_profile_cache()
+    await cache.get("u0")
+
+    # Сообщение другой реплики доходит через брокер
+    await broker.publish(profiles.INVALIDATION_CHANNEL, {"user_id": "u0"})
+    assert "u0" not in cache._entries
+    assert cache.stats()["invalidations"] == 1
+
+    await cache.get("u0")
+    await invalidate_profile("u0")
+    assert "u0" not in cache._entries
@@ -0,0 +1,79 @@
+import ipaddress
+import time
+
+import pytest
+from starlette.requests import HTTPConnection
+
+from core import ratelimit
+from core.ratelimit import MemoryBuckets, RedisBuckets, client_ip
+from core.redis_client import LocalRedis
+
+pytestmark = pytest.mark.anyio
+
+# 2 запроса в секунду, 4 подряд
+INTERVAL = 0.5
+WINDOW = 2.0
+
+
+@pytest.fixture(params=["memory", "redis"])
+def buckets(request):
+    if request.param == "memory":
+        return MemoryBuckets()
+    return RedisBuckets(LocalRedis())
+
+
+async def test_burst_then_throttled(buckets):
+    now = time.time()
+    for _ in range(4):
+        assert await buckets.take("ip:1", INTERVAL, WINDOW, now) == 0
+    retry_after = await buckets.take("ip:1", INTERVAL, WINDOW, now)
+    assert retry_after == pytest.approx(INTERVAL)
+    # Отклонённый запрос не расходует ведро
+    assert await buckets.take("ip:1", INTERVAL, WINDOW, now) == pytest.approx(INTERVAL)
+
+
+async def test_refill(buckets):
+    now = time.time()
+    for _ in range(4):
+        await buckets.take("ip:1", INTERVAL, WINDOW, now)
+    assert await buckets.take("ip:1", INTERVAL, WINDOW, now + INTERVAL / 2) > 0
+    assert await buckets.take("ip:1", INTERVAL, WINDOW, now + INTERVAL) == 0
+    assert await buckets.take("ip:1", INTERVAL, WINDOW, now + INTERVAL) > 0
+    # Через window ведро снова полное
+    later = now + INTERVAL + WINDOW
+    for _ in range(4):
+        assert await buckets.take("ip:1", INTERVAL, WINDOW, later) == 0
+    assert await buckets.take("ip:1", INTERVAL, WINDOW, later) > 0
+
+
+async def test_keys_are_independent(buckets):
+    now = time.time()
+    for _ in range(4):
+        await buckets.take("ip:1", INTERVAL, WINDOW, now)
+    assert await buckets.take("ip:1", INTERVAL, WINDOW, now) > 0
+    assert await buckets.take("ip:2", INTERVAL, WINDOW, now) == 0
+
+
+def connection(host: str, forwarded: str = None) -> HTTPConnection:
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return HTTPConnection({"type": "http", "client": (host, 50000), "headers": headers})
+
+
+def test_forwarded_for_from_trusted_proxy():
+    assert client_ip(connection("127.0.0.1", "198.51.100.1, 203.0.113.7")) == "203.0.113.7"
+
+
+def test_forwarded_for_from_untrusted_host_ignored():
+    # Частные сети не доверенные по умолчанию: сервисы доступны и в обход шлюза
+    for host in ("10.0.0.5", "172.18.0.3", "192.168.1.10", "203.0.113.9"):
+        assert client_ip(connection(host, "198.51.100.1")) == host
+
+
+def test_trusted_proxies_setting(monkeypatch):
+    monkeypatch.setattr(ratelimit, "TRUSTED_PROXIES", (ipaddress.ip_network("172.18.0.3/32"),))
+    ratelimit._is_trusted_proxy.cache_clear()
+    try:
+        assert client_ip(connection("172.18.0.3", "198.51.100.1")) == "198.51.100.1"
+        assert client_ip(connection("172.18.0.4", "198.51.100.1")) == "172.18.0.4"
+    finally:
+        ratelimit._is_trusted_proxy.cache_clear()
@@ -0,0 +1,110 @@
+import io
+
+import pytest
+from fastapi import FastAPI, HTTPException, UploadFile
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from core import upload_index, uploads
+from core.redis_client import LocalRedis
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def local_storage(monkeypatch):
+    storage = uploads.LocalImageStorage()
+    monkeypatch.setattr(uploads, "_storage", storage)
+    monkeypatch.setattr(upload_index, "_index", upload_index.MemoryUploadIndex())
+    return storage
+
+
+def png(width: int = 1200, height: int = 800, color=(200, 40, 40)) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(output, "PNG")
+    return output.getvalue()
+
+
+def upload_file(data: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename="image")
+
+
+async def test_transcodes_to_bounded_webp(local_storage):
+    result = await uploads.process_image_upload(upload_file(png()), "avatars")
+
+    assert result.image_type == "png"
+    assert not result.deduplicated
+    stored = local_storage.files[result.url.removeprefix("local://")]
+    with Image.open(io.BytesIO(stored)) as image:
+        assert image.format == "WEBP"
+        assert max(image.size) == uploads.IMAGE_MAX_SIDE
+    assert result.bytes_uploaded == len(stored)
+
+
+async def test_same_file_is_deduplicated(local_storage):
+    first = await uploads.process_image_upload(upload_file(png()), "avatars")
+    second = await uploads.process_image_upload(upload_file(png()), "avatars")
+
+    assert second.url == first.url
+    assert second.deduplicated
+    assert second.bytes_uploaded == 0
+    assert len(local_storage.files) == 1
+
+
+async def test_dedup_is_scoped_to_folder(local_storage):
+    avatar = await uploads.process_image_upload(upload_file(png()), "avatars")
+    server = await uploads.process_image_upload(upload_file(png()), "servers")
+
+    assert not server.deduplicated
+    assert avatar.url.startswith("local://avatars/")
+    assert server.url.startswith("local://servers/")
+
+
+@pytest.mark.parametrize("index", ["memory", "redis"])
+async def test_deleted_image_is_forgotten(monkeypatch, local_storage, index):
+    if index == "redis":
+        monkeypatch.setattr(upload_index, "_index", upload_index.RedisUploadIndex(LocalRedis()))
+    first = await uploads.process_image_upload(upload_file(png()), "avatars")
+    other = await uploads.process_image_upload(upload_file(png(color=(0, 0, 255))), "avatars")
+
+    assert await uploads.delete_image(first.url)
+    again = await uploads.process_image_upload(upload_file(png()), "avatars")
+
+    assert not again.deduplicated
+    assert again.url.removeprefix("local://") in local_storage.files
+    # Хэши другого файла остались в индексе
+    assert (await uploads.process_image_upload(upload_file(png(color=(0, 0, 255))), "avatars")).url == other.url
+
+
+async def test_rejects_non_image():
+    with pytest.raises(HTTPException) as error:
+        await uploads.process_image_upload(upload_file(b"%PDF-1.7 not an image"), "avatars")
+    assert error.value.status_code == 415
+
+
+async def test_rejects_corrupt_image():
+    with pytest.raises(HTTPException) as error:
+        await uploads.process_image_upload(upload_file(png()[:64]), "avatars")
+    assert error.value.status_code == 415
+
+
+async def test_rejects_oversized_file():
+    data = b"\x89PNG\r\n\x1a\n" + bytes(uploads.MAX_BYTES)
+    with pytest.raises(HTTPException) as error:
+        await uploads.process_image_upload(upload_file(data), "avatars")
+    assert error.value.status_code == 413
+
+
+def test_middleware_rejects_oversized_body():
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(file: UploadFile):
+        return {"size": len(await file.read())}
+
+    app.add_middleware(uploads.UploadSizeLimitMiddleware, paths=("/upload",), max_bytes=1024)
+    client = TestClient(app)
+
+    assert client.post("/upload", files={"file": ("a.png", b"x" * 512)}).json() == {"size": 512}
+    response = client.post("/upload", files={"file": ("a.png", b"x" * (uploads.MULTIPART_OVERHEAD + 2048))})
+    assert response.status_code == 413